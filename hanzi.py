@@ -9,16 +9,381 @@ import warnings
 warnings.filterwarnings("ignore", message="sipPyTypeDict.*deprecated")
 
 import sys
+import os
 import re
+import hashlib
+import marshal
+import tempfile
+import time
+import json
+import io
+import threading
+import asyncio
+from array import array
+from itertools import compress
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
+try:
+    import numpy as np  # 可选：用于相似度矩阵的向量化计算
+except ImportError:
+    np = None
+
+
+# 拼音声母（双字母声母在前，保证优先匹配）
+PINYIN_INITIALS = ['zh', 'ch', 'sh', 'b', 'p', 'm', 'f', 'd', 't', 'n', 'l',
+                   'g', 'k', 'h', 'j', 'q', 'x', 'r', 'z', 'c', 's', 'y', 'w']
+
+# 相似度特征及权重（权重之和为100，分数以百分制整数存储）
+SIMILARITY_FEATURES = ('类别', '结构', '部首', '韵母')
+SIMILARITY_WEIGHTS = (40, 25, 20, 15)
+
+# 派生索引缓存格式版本（索引结构变化时递增）
+INDEX_CACHE_VERSION = 1
+
+
+# 指令允许的操作数类型（None表示不需要操作数，提供了也会被忽略）
+INSTRUCTION_OPERANDS = {
+    # 算术指令
+    '加': ('slot', 'number'),
+    '减': ('slot', 'number'),
+    '乘': ('slot', 'number'),
+    '除': ('slot', 'number'),
+    '存储': ('slot',),
+    '读取': ('slot',),
+    '跳转': ('number', 'slot'),
+    '停机': None,
+    # 汉字处理指令
+    '拼接': ('hanzi', 'text', 'text_slot'),
+    '拆分': ('number',),
+    '修饰': ('hanzi', 'text'),
+    '复制': ('number',),
+    '粘贴': ('text_slot',),
+    '取含义': None,
+    '取拼音': None,
+    '取对话': None,
+    '取词性': None,
+    '取类别': None,
+    '取前压': None,
+    '后继': None,
+    '取结构位置适配': ('hanzi', 'text'),
+    '取语义位置适配': ('hanzi', 'text'),
+    '存储文本': ('text_slot',),
+    '读取文本': ('text_slot',),
+    '替换': ('text_slot', 'hanzi', 'text'),
+    # 区间指令（一条指令用切片处理槽A到槽B的整段内存，含两端）
+    '区间求和': ('slot_range',),
+    '区间填充': ('slot_range',),
+    '区间复制': ('slot_range',),
+    '区间反转': ('slot_range',),
+    '区间排序': ('slot_range',),
+    '区间拼接': ('text_slot_range',),
+    '区间拼音': ('text_slot_range',),
+}
+
+# 执行引擎：reference 逐条解释（execute_step），fast 预解码快速路径，
+# compiled 按基本块编译为Python函数（不记录逐条执行轨迹）
+ENGINES = ('reference', 'fast', 'compiled')
+
+# 编译引擎单个基本块的最大指令数
+MAX_BLOCK_SIZE = 256
+
+# 操作数类型的显示名称
+OPERAND_KIND_NAMES = {
+    'slot': '槽X',
+    'number': '数字',
+    'text_slot': '文槽X',
+    'hanzi': '汉字',
+    'text': '文本',
+    'slot_range': '槽A~B',
+    'text_slot_range': '文槽A~B',
+}
+
+# 卡片下拉框中的指令分组（顺序与 INSTRUCTION_OPERANDS 一致，算术和区间指令以外都是汉字处理指令）
+ARITHMETIC_INSTRUCTIONS = ('加', '减', '乘', '除', '存储', '读取', '跳转', '停机')
+RANGE_INSTRUCTIONS = ('区间求和', '区间填充', '区间复制', '区间反转', '区间排序', '区间拼接', '区间拼音')
+INSTRUCTION_GROUPS = (
+    ('算术指令', ARITHMETIC_INSTRUCTIONS),
+    ('汉字处理指令', tuple(name for name in INSTRUCTION_OPERANDS
+                     if name not in ARITHMETIC_INSTRUCTIONS and name not in RANGE_INSTRUCTIONS)),
+    ('区间指令', RANGE_INSTRUCTIONS),
+)
+
+# 指令说明（卡片的帮助文本）
+INSTRUCTION_HELP = {
+    '加': '累加器 = 累加器 + 操作数',
+    '减': '累加器 = 累加器 - 操作数',
+    '乘': '累加器 = 累加器 × 操作数',
+    '除': '累加器 = 累加器 ÷ 操作数',
+    '存储': '槽X = 累加器',
+    '读取': '累加器 = 槽X',
+    '跳转': '跳转到第X行',
+    '停机': '停止程序',
+    '拼接': '文本累加器 = 文本累加器 + 文本',
+    '拆分': '在位置X拆分文本',
+    '修饰': '给文本加上修饰语',
+    '复制': '复制文本X次',
+    '粘贴': '文本粘贴到文槽X',
+    '取含义': '获取文本含义',
+    '取拼音': '获取文本拼音',
+    '取对话': '生成对话回应',
+    '取词性': '获取文本词性',
+    '取类别': '获取文本类别',
+    '取前压': '获取文本押韵',
+    '后继': '获取后继汉字',
+    '取结构位置适配': '按字形结构适配汉字',
+    '取语义位置适配': '按语义适配汉字',
+    '存储文本': '存储文本到文槽X',
+    '读取文本': '从文槽X读取文本',
+    '替换': '按文槽X或文件中的替换表替换文本',
+    '区间求和': '累加器 = 槽A到槽B之和',
+    '区间填充': '槽A到槽B都设为累加器',
+    '区间复制': '槽A到槽B复制到从槽(累加器)开始的位置',
+    '区间反转': '槽A到槽B倒序排列',
+    '区间排序': '槽A到槽B从小到大排序',
+    '区间拼接': '文本累加器 += 文槽A到文槽B依次拼接',
+    '区间拼音': '文槽A到文槽B逐个转为拼音',
+}
+
+
+# 示例程序（IDE的“示例”菜单和基准测试共用）
+ARITHMETIC_EXAMPLE = """# 算术示例：计算 1+2+3+...+10
+# 初始化：槽0 = 10 (循环次数)，槽1 = 0 (累加和)
+
+读取 槽0    # 加载循环计数器
+减 1       # 计数器减1
+存储 槽0   # 保存计数器
+读取 槽1   # 加载累加和
+加 槽0    # 加上当前计数器值
+存储 槽1   # 保存累加和
+读取 槽0   # 加载计数器
+跳转 2    # 如果计数器>0，跳转到行2
+读取 槽1   # 加载最终结果
+停机      # 程序结束
+"""
+
+# 算术示例的初始内存
+ARITHMETIC_EXAMPLE_MEMORY = {0: 10, 1: 0}
+
+HANZI_EXAMPLE = """# 汉字处理示例
+# 演示汉字处理指令的使用
+
+拼接 你好中国     # 文本累加器 = "你好中国"
+取拼音           # 获取拼音
+存储文本 文槽0   # 存储到文本内存
+
+读取文本 文槽0   # 重新读取
+拼接 的拼音是     # 继续拼接
+存储文本 文槽1   # 存储结果
+
+读取文本 文槽1   # 读取结果
+取含义           # 获取含义
+存储文本 文槽2   # 存储含义
+
+拼接 山         # 测试单个汉字
+取词性          # 获取词性
+拼接 是名词     # 添加说明
+
+停机            # 程序结束
+"""
+
+
+def default_cache_dir():
+    """派生索引缓存目录（可用环境变量 HANZI_IDE_CACHE 指定）"""
+    return os.environ.get('HANZI_IDE_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', 'hanzi_ide')
+
+
+# 断点条件的词法单元（“文本累加器”“文槽”要先于“累加器”“槽”匹配）
+CONDITION_TOKEN = re.compile(r'\s*(>=|<=|==|!=|>|<|且|或|文本累加器|累加器|文槽-?\d+|槽-?\d+|-?\d+|[^\s<>=!且或]+)')
+
+CONDITION_OPERATORS = ('==', '!=', '>', '<', '>=', '<=')
+
+
+def compile_condition(condition, slots=100):
+    """把断点条件（如“累加器 > 100”“槽3 == 0 且 文槽1 != 你好”）编译为判断函数 f(vm) -> bool，
+    条件无效时抛出 ValueError"""
+    tokens = []
+    position = 0
+    condition = condition.strip()
+    while position < len(condition):
+        match = CONDITION_TOKEN.match(condition, position)
+        if not match:
+            raise ValueError(f"无效的断点条件 '{condition}'")
+        tokens.append(match.group(1))
+        position = match.end()
+
+    def operand(token):
+        """返回(Python表达式, 是否为文本)"""
+        if token == '累加器':
+            return 'vm.accumulator', False
+        if token == '文本累加器':
+            return 'vm.text_accumulator', True
+        for prefix, attribute, is_text in (('文槽', 'text_memory', True), ('槽', 'memory', False)):
+            if token.startswith(prefix) and token[len(prefix):].lstrip('-').isdigit():
+                slot = int(token[len(prefix):])
+                if not 0 <= slot < slots:
+                    raise ValueError(f"断点条件中的 {token} 超出范围")
+                return f'vm.{attribute}[{slot}]', is_text
+        if token.lstrip('-').isdigit():
+            return str(int(token)), False
+        if token in CONDITION_OPERATORS or token in ('且', '或'):
+            raise ValueError(f"断点条件 '{condition}' 在 '{token}' 处缺少操作数")
+        return repr(token), True
+
+    if len(tokens) % 4 != 3:
+        raise ValueError(f"断点条件 '{condition}' 应为“操作数 比较符 操作数”，可用“且”“或”连接")
+    parts = []
+    for index in range(0, len(tokens), 4):
+        left, op, right = tokens[index:index + 3]
+        if op not in CONDITION_OPERATORS:
+            raise ValueError(f"断点条件中的 '{op}' 不是比较符")
+        (left_code, left_text), (right_code, right_text) = operand(left), operand(right)
+        if left_text != right_text:
+            raise ValueError(f"断点条件 '{left} {op} {right}' 两边类型不一致（数字和文本不能比较）")
+        parts.append(f"{left_code} {op} {right_code}")
+        if index + 3 < len(tokens):
+            joiner = tokens[index + 3]
+            if joiner not in ('且', '或'):
+                raise ValueError(f"断点条件中的 '{joiner}' 应为“且”或“或”")
+            parts.append('and' if joiner == '且' else 'or')
+    return eval(compile(f"lambda vm: {' '.join(parts)}", '<断点条件>', 'eval'), {})
+
+
+# 程序文件分块读写的块大小（字符数）
+FILE_CHUNK_SIZE = 64 * 1024
+
+# 进程的文件创建掩码，导入时（主线程）读取一次；umask 是进程级设置，
+# 不能在工作线程里临时改动，否则其他线程同时创建的文件权限会出错
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def read_text_chunks(filename, chunk_size=FILE_CHUNK_SIZE):
+    """分块读取UTF-8文本文件，逐块产生(文本, 已读比例)"""
+    size = os.path.getsize(filename) or 1
+    with open(filename, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk, min(f.buffer.tell() / size, 1.0)
+
+
+def write_text_atomic(filename, text, chunk_size=FILE_CHUNK_SIZE, progress=None):
+    """原子写入UTF-8文本文件：先分块写入同目录的临时文件，完成后再替换目标文件，
+    写入中途失败时原文件保持不变；progress(已写比例) 在每块写完后调用"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.hanzi-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for start in range(0, len(text), chunk_size):
+                f.write(text[start:start + chunk_size])
+                if progress is not None:
+                    progress(min((start + chunk_size) / len(text), 1.0))
+            f.flush()
+            os.fsync(f.fileno())
+        # 临时文件默认只有本人可读写，改为原文件（或新建文件）应有的权限
+        if os.path.exists(filename):
+            mode = os.stat(filename).st_mode & 0o7777
+        else:
+            mode = 0o666 & ~_UMASK
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, filename)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class AhoCorasickReplacer:
+    """多模式替换自动机（Aho-Corasick），一次扫描完成整张替换表"""
+
+    def __init__(self, mapping):
+        self.mapping = dict(mapping)
+        self.goto = [{}]  # 状态转移
+        self.fail = [0]  # 失败指针
+        self.length = [0]  # 该状态对应的模式长度（0表示不是模式结尾）
+        self.dict_link = [0]  # 沿失败链的下一个模式结尾状态（0表示没有）
+
+        for pattern in self.mapping:
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.length.append(0)
+                    self.dict_link.append(0)
+                state = next_state
+            self.length[state] = len(pattern)
+
+        # 广度优先计算失败指针
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target
+                self.dict_link[next_state] = target if self.length[target] else self.dict_link[target]
+
+    def subn(self, text):
+        """替换所有匹配（最左最长、不重叠），返回(新文本, 替换次数)"""
+        if not self.mapping or not text:
+            return text, 0
+
+        goto, fail, length, dict_link = self.goto, self.fail, self.length, self.dict_link
+        longest = [0] * len(text)  # 每个起点的最长匹配长度
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            match = state if length[state] else dict_link[state]
+            while match:
+                start = end - length[match]
+                if length[match] > longest[start]:
+                    longest[start] = length[match]
+                match = dict_link[match]
+
+        pieces = []
+        count = 0
+        position = 0
+        copied = 0
+        while position < len(text):
+            size = longest[position]
+            if size:
+                pieces.append(text[copied:position])
+                pieces.append(self.mapping[text[position:position + size]])
+                count += 1
+                position += size
+                copied = position
+            else:
+                position += 1
+        pieces.append(text[copied:])
+        return "".join(pieces), count
+
+    def sub(self, text):
+        """替换所有匹配，返回新文本"""
+        return self.subn(text)[0]
+
 
 class HanziProcessor:
     """汉字处理器（无pypinyin依赖版本）"""
     
-    def __init__(self):
+    def __init__(self, cache_dir=None):
+        # 派生索引缓存目录，不指定（或传入空字符串）时不使用磁盘缓存；图形界面使用 default_cache_dir()
+        self.cache_dir = cache_dir
+
         # 拼音映射表（常用汉字）
         self.pinyin_map = {
             '啊': 'a', '阿': 'a', '爱': 'ai', '安': 'an', '按': 'an',
@@ -445,7 +810,50 @@ class HanziProcessor:
             '状态': ['大', '小', '高', '低', '长', '短', '多', '少', '好', '坏'],
             '抽象': ['道', '德', '理', '义', '仁', '智', '信', '礼', '孝', '忠']
         }
-        
+
+        # 汉字部首
+        self.radicals = {
+            '氵': ['江', '河', '湖', '海', '洋', '波', '流', '清', '深', '浅', '游', '洗'],
+            '木': ['林', '森', '树', '材', '村', '机', '桥', '校', '梅', '杨', '松', '桌'],
+            '亻': ['你', '他', '们', '休', '体', '信', '仁', '住', '作', '位', '伟', '传'],
+            '扌': ['打', '找', '把', '拉', '推', '提', '接', '抓', '拍', '指', '拿', '挂'],
+            '艹': ['花', '草', '苗', '茶', '菜', '药', '英', '落', '荷', '莲', '苦', '若'],
+            '口': ['吃', '喝', '叫', '吗', '呢', '吧', '唱', '听', '味', '品', '哭', '喊'],
+            '讠': ['说', '话', '读', '语', '词', '诗', '请', '谁', '课', '认', '让', '记'],
+            '日': ['日', '明', '昌', '春', '时', '早', '晚', '晴', '星', '晶', '暖', '晓'],
+            '月': ['月', '朋', '脑', '胖', '脸', '肥', '服', '望', '期', '腿', '胸', '脚'],
+            '女': ['女', '好', '妈', '姐', '妹', '她', '奶', '姑', '娘', '婚', '始', '妙'],
+            '心': ['心', '想', '思', '意', '念', '忘', '忠', '感', '愁', '悲', '怒', '忍'],
+            '忄': ['情', '快', '慢', '怕', '忙', '性', '惊', '悟', '惯', '恨', '忆', '怀'],
+            '土': ['土', '地', '场', '城', '坐', '块', '坡', '堂', '墙', '坏', '基', '境'],
+            '火': ['火', '灯', '炎', '烧', '焱', '炉', '烟', '炸', '灰', '灾', '燃', '炼'],
+            '灬': ['点', '热', '然', '照', '煮', '熟', '熊', '燕', '烈', '焦', '黑', '熙'],
+            '钅': ['钱', '钟', '铁', '银', '铜', '针', '钢', '锁', '链', '错', '镜', '铃'],
+            '纟': ['红', '绿', '纸', '线', '练', '组', '细', '给', '经', '结', '绝', '级'],
+            '辶': ['这', '还', '进', '远', '近', '道', '过', '送', '运', '通', '边', '连'],
+            '宀': ['字', '宇', '宙', '家', '安', '室', '客', '宝', '定', '宫', '完', '富'],
+            '囗': ['国', '圆', '囚', '团', '图', '回', '园', '因', '围', '困', '固', '圈'],
+            '门': ['门', '问', '间', '闪', '闻', '闭', '闹', '闲', '阅', '阔', '闷', '闯'],
+            '王': ['王', '玉', '玩', '环', '现', '班', '球', '理', '琴', '珠', '玲', '珍'],
+            '石': ['石', '磊', '破', '研', '砖', '码', '碗', '碎', '确', '硬', '矿', '碰'],
+            '目': ['目', '看', '眼', '睡', '眉', '盲', '睁', '瞧', '真', '着', '直', '相'],
+            '雨': ['雨', '雪', '雷', '雾', '零', '需', '震', '霜', '露', '霉', '雳', '霞'],
+            '鸟': ['鸟', '鸡', '鸭', '鸣', '鹰', '鸦', '鹿', '鸽', '鹅', '鹤', '鹏', '鸿'],
+            '马': ['马', '骑', '驾', '驶', '骂', '驴', '骄', '验', '驻', '骗', '骤', '骉'],
+            '人': ['人', '从', '众', '个', '今', '会', '全', '合', '以', '介', '令', '企'],
+            '犭': ['狗', '猫', '狼', '猪', '猴', '狮', '猛', '猎', '独', '狂', '犹', '狭'],
+            '足': ['足', '跑', '跳', '路', '跟', '踢', '距', '跨', '踏', '跃', '踪', '蹈']
+        }
+
+        # 已编译的替换表（表文本 -> 自动机）
+        self._replacer_cache = {}
+        # 已加载的替换表文件（绝对路径 -> (修改时间, 大小, 自动机)），文件变化后重新读取
+        self._replacement_files = {}
+
+        # 派生索引（倒排索引、韵母表、相似度特征），首次查询时加载或构建
+        self._indexes = None
+        self.index_stats = None
+
     def is_hanzi(self, text):
         """检查文本是否为汉字"""
         if not text:
@@ -595,15 +1003,63 @@ class HanziProcessor:
         """修改文本（简单替换）"""
         return text.replace(pattern, replacement)
     
+    def parse_replacement_table(self, table_text):
+        """解析替换表：每行“原文 替换文”，省略替换文表示删除，#开头为注释"""
+        mapping = {}
+        for line in table_text.split('\n'):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split(None, 1)
+            mapping[parts[0]] = parts[1].strip() if len(parts) > 1 else ""
+        return mapping
+
+    def compile_replacements(self, table_text):
+        """把替换表编译为自动机（同一张表只编译一次）"""
+        replacer = self._replacer_cache.get(table_text)
+        if replacer is None:
+            if len(self._replacer_cache) >= 32:
+                self._replacer_cache.clear()
+            replacer = AhoCorasickReplacer(self.parse_replacement_table(table_text))
+            self._replacer_cache[table_text] = replacer
+        return replacer
+
+    def load_replacement_file(self, filename):
+        """从文件加载并编译替换表（文件的修改时间和大小不变时直接用上次的自动机，不再读文件）"""
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        cached = self._replacement_files.get(path)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        with open(path, 'r', encoding='utf-8') as f:
+            replacer = self.compile_replacements(f.read())
+        if len(self._replacement_files) >= 32:
+            self._replacement_files.clear()
+        self._replacement_files[path] = (stat.st_mtime_ns, stat.st_size, replacer)
+        return replacer
+
+    def modify_many(self, text, table_text):
+        """按整张替换表修改文本（一次扫描）"""
+        return self.compile_replacements(table_text).sub(text)
+
     def duplicate(self, text, times):
         """复制文本"""
         return text * times
     
+    def get_dialog(self, text):
+        """简单的对话生成"""
+        if '你好' in text or '您好' in text:
+            return f"你好！我是汉字编程语言助手。"
+        elif '吗' in text or '？' in text or '?' in text:
+            return f"这是一个关于'{text}'的问题。"
+        else:
+            return f"你说的是: {text}"
+
     def get_structure(self, hanzi):
         """获取汉字结构"""
-        for structure, examples in self.structure_types.items():
-            if hanzi in examples:
-                return structure
+        structure = self.ensure_indexes()['structure'].get(hanzi)
+        if structure:
+            return structure
         
         # 简单判断
         if len(hanzi) == 1:
@@ -614,17 +1070,11 @@ class HanziProcessor:
     
     def get_pos(self, hanzi):
         """获取词性"""
-        for pos, examples in self.pos_tags.items():
-            if hanzi in examples:
-                return pos
-        return '未知词性'
+        return self.ensure_indexes()['pos'].get(hanzi, '未知词性')
     
     def get_category(self, hanzi):
         """获取类别"""
-        for category, examples in self.categories.items():
-            if hanzi in examples:
-                return category
-        return '其他类别'
+        return self.ensure_indexes()['category'].get(hanzi, '其他类别')
     
     def get_rhyme(self, hanzi):
         """获取押韵信息（简化版）"""
@@ -726,21 +1176,663 @@ class HanziProcessor:
         else:
             return f"语义类别不同: {cat1} ↔ {cat2}"
 
+    def get_radical(self, hanzi):
+        """获取部首"""
+        return self.ensure_indexes()['radical'].get(hanzi, '未知部首')
+
+    def get_final(self, hanzi):
+        """获取单个汉字的韵母（去掉声母）"""
+        pinyin = self.pinyin_map.get(hanzi, '')
+        for initial in PINYIN_INITIALS:
+            if pinyin.startswith(initial) and len(pinyin) > len(initial):
+                return pinyin[len(initial):]
+        return pinyin
+
+    def feature_labels(self, hanzi):
+        """获取相似度特征标签（类别、结构、部首、韵母），未知项为None"""
+        indexes = self.ensure_indexes()
+        return (
+            indexes['category'].get(hanzi),
+            indexes['structure'].get(hanzi),
+            indexes['radical'].get(hanzi),
+            indexes['final'].get(hanzi) or self.get_final(hanzi) or None,
+        )
+
+    def source_hash(self):
+        """源数据表的哈希，作为派生索引缓存的版本键"""
+        digest = hashlib.sha256()
+        digest.update(repr((INDEX_CACHE_VERSION, SIMILARITY_FEATURES, SIMILARITY_WEIGHTS,
+                            sys.byteorder)).encode('utf-8'))
+        for table in (self.pinyin_map, self.structure_types, self.pos_tags,
+                      self.categories, self.radicals):
+            digest.update(repr(table).encode('utf-8'))
+        return digest.hexdigest()
+
+    def build_indexes(self):
+        """从源数据表构建全部派生索引（可序列化的紧凑格式）"""
+        def invert(table):
+            index = {}
+            for label, examples in table.items():
+                for item in examples:
+                    index.setdefault(item, label)
+            return index
+
+        indexes = {
+            'structure': invert(self.structure_types),
+            'pos': invert(self.pos_tags),
+            'category': invert(self.categories),
+            'radical': invert(self.radicals),
+            'final': {char: self.get_final(char) for char in self.pinyin_map},
+        }
+
+        charset = set(self.pinyin_map)
+        for table in (self.structure_types, self.pos_tags, self.categories, self.radicals):
+            for examples in table.values():
+                charset.update(c for c in examples if len(c) == 1)
+        charset = sorted(charset)
+
+        # 每个特征一个词表，编号0保留给未知
+        vocabularies = [{} for _ in SIMILARITY_FEATURES]
+        features = array('h')
+        for char in charset:
+            labels = (indexes['category'].get(char), indexes['structure'].get(char),
+                      indexes['radical'].get(char), indexes['final'].get(char))
+            for vocab, label in zip(vocabularies, labels):
+                features.append(vocab.setdefault(label, len(vocab) + 1) if label else 0)
+
+        indexes['charset'] = ''.join(charset)
+        indexes['vocab'] = vocabularies
+        indexes['features'] = features.tobytes()
+        indexes['matrix'] = None
+        if np is not None:
+            rows = np.frombuffer(indexes['features'], dtype=np.int16).reshape(-1, len(SIMILARITY_FEATURES))
+            indexes['matrix'] = self._similarity_matrix_of(rows).tobytes()
+        return indexes
+
+    def _similarity_matrix_of(self, rows):
+        """由特征矩阵计算两两相似度矩阵（百分制uint8）"""
+        matrix = np.zeros((len(rows), len(rows)), dtype=np.uint8)
+        for col, weight in enumerate(SIMILARITY_WEIGHTS):
+            column = rows[:, col]
+            same = (column[:, None] == column[None, :]) & (column != 0)[:, None]
+            matrix += same.astype(np.uint8) * np.uint8(weight)
+        return matrix
+
+    def _cache_path(self):
+        return os.path.join(self.cache_dir, 'hanzi_indexes.marshal')
+
+    def _load_cached_indexes(self, key):
+        """读取、校验并展开磁盘缓存；文件不存在、版本不符或内容损坏（任何异常）时返回None，
+        由调用方重新构建。缓存用 marshal 保存，只含字符串、字节串、字典和列表，读取时不会执行代码"""
+        try:
+            with open(self._cache_path(), 'rb') as f:
+                cached = marshal.loads(f.read())
+            if cached['key'] != key:
+                return None
+            indexes = cached['indexes']
+            if np is not None and indexes['matrix'] is None:
+                return None  # 没有 NumPy 时写的缓存缺少相似度矩阵
+            return self._expand_indexes(indexes)
+        except Exception:
+            return None
+
+    def _save_cached_indexes(self, key, indexes):
+        """原子写入磁盘缓存（失败时静默跳过，不留下临时文件）"""
+        temp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(marshal.dumps({'key': key, 'indexes': indexes}))
+            os.replace(temp_path, self._cache_path())
+            temp_path = None
+        except (OSError, ValueError):
+            pass
+        finally:
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def _expand_indexes(self, indexes):
+        """在紧凑格式的索引上补充查询用的结构（字符列表、编号表、特征矩阵和相似度矩阵）"""
+        charset = indexes['charset']
+        indexes['charset_list'] = list(charset)
+        indexes['ids'] = {char: i for i, char in enumerate(charset)}
+        width = len(SIMILARITY_FEATURES)
+        if np is not None:
+            indexes['rows'] = np.frombuffer(indexes['features'], dtype=np.int16).reshape(-1, width)
+            indexes['matrix_array'] = np.frombuffer(indexes['matrix'], dtype=np.uint8).reshape(
+                len(charset), len(charset))
+        else:
+            features = array('h')
+            features.frombytes(indexes['features'])
+            indexes['rows'] = [tuple(features[i:i + width]) for i in range(0, len(features), width)]
+            indexes['matrix_array'] = None
+        return indexes
+
+    def ensure_indexes(self):
+        """加载派生索引：优先使用校验通过的磁盘缓存，否则重新构建并写入缓存"""
+        if self._indexes is not None:
+            return self._indexes
+
+        start = time.perf_counter()
+        key = self.source_hash()
+        indexes = self._load_cached_indexes(key) if self.cache_dir else None
+        source = 'cache'
+        if indexes is None:
+            indexes = self.build_indexes()
+            source = 'built'
+            if self.cache_dir:
+                self._save_cached_indexes(key, indexes)  # 先写紧凑格式，再展开
+            indexes = self._expand_indexes(indexes)
+
+        self._indexes = indexes
+        self.index_stats = {'source': source, 'seconds': time.perf_counter() - start}
+        return indexes
+
+    def feature_vector(self, hanzi):
+        """获取汉字的特征向量（各特征的编号，0表示未知）"""
+        indexes = self.ensure_indexes()
+        index = indexes['ids'].get(hanzi)
+        if index is not None:
+            return tuple(int(v) for v in indexes['rows'][index])
+        return tuple(vocab.get(label, -1) if label else 0
+                     for vocab, label in zip(indexes['vocab'], self.feature_labels(hanzi)))
+
+    def similarity(self, hanzi1, hanzi2):
+        """两个汉字的相似度（0~1）"""
+        vec1 = self.feature_vector(hanzi1)
+        vec2 = self.feature_vector(hanzi2)
+        score = sum(weight for a, b, weight in zip(vec1, vec2, SIMILARITY_WEIGHTS)
+                    if a > 0 and a == b)
+        return score / 100
+
+    def similarity_scores(self, hanzi):
+        """一个汉字对整个字符集的相似度（与 feature_charset 顺序一致）"""
+        indexes = self.ensure_indexes()
+        index = indexes['ids'].get(hanzi)
+
+        if np is not None:
+            if index is not None:
+                return indexes['matrix_array'][index] / 100
+            vector = np.array(self.feature_vector(hanzi), dtype=np.int16)
+            same = (indexes['rows'] == vector) & (vector > 0)
+            return same.astype(np.uint8) @ np.array(SIMILARITY_WEIGHTS, dtype=np.uint16) / 100
+
+        vector = self.feature_vector(hanzi)
+        return [sum(weight for a, b, weight in zip(vector, row, SIMILARITY_WEIGHTS)
+                    if a > 0 and a == b) / 100
+                for row in indexes['rows']]
+
+    @property
+    def feature_charset(self):
+        """参与相似度计算的字符集"""
+        return self.ensure_indexes()['charset_list']
+
+    def top_fits(self, hanzi, n=20):
+        """与给定汉字最适配的前n个汉字，返回[(汉字, 相似度), ...]"""
+        scores = self.similarity_scores(hanzi)
+        indexes = self._indexes
+        charset = indexes['charset_list']
+        index = indexes['ids'].get(hanzi)
+
+        if np is not None:
+            scores = scores.copy()
+            if index is not None:
+                scores[index] = -1
+            order = np.lexsort((np.arange(len(charset)), -scores))[:n]
+            return [(charset[i], float(scores[i])) for i in order]
+
+        ranked = sorted((i for i in range(len(charset)) if i != index),
+                        key=lambda i: (-scores[i], i))
+        return [(charset[i], scores[i]) for i in ranked[:n]]
+
+
+def measure_index_startup(cache_dir=None):
+    """测量派生索引的冷启动（无缓存构建）和热启动（读缓存）耗时，单位秒
+    （不指定 cache_dir 或传入空字符串时使用临时目录，测量完即删除）"""
+    if not cache_dir:
+        with tempfile.TemporaryDirectory(prefix='hanzi_index_') as temp_dir:
+            return measure_index_startup(temp_dir)
+    cold = HanziProcessor(cache_dir)
+    try:
+        os.remove(cold._cache_path())
+    except OSError:
+        pass
+    cold.ensure_indexes()
+    warm = HanziProcessor(cache_dir)
+    warm.ensure_indexes()
+    return {
+        'cold': cold.index_stats['seconds'],
+        'warm': warm.index_stats['seconds'],
+        'warm_source': warm.index_stats['source'],
+    }
+
+
+class CoverageReport:
+    """多次运行合并后的指令覆盖情况（hits[i]为执行到第i条指令的运行次数）"""
+
+    def __init__(self, program, source='program'):
+        self.program = program
+        self.source = source
+        self.runs = 0
+        self.hits = [0] * len(program)
+        self.results = []
+
+    def add(self, coverage):
+        """合并一次运行的覆盖位图"""
+        self.runs += 1
+        hits = self.hits
+        for index in compress(range(len(coverage)), coverage):
+            hits[index] += 1
+
+    @property
+    def covered(self):
+        """至少被一次运行执行到的指令数"""
+        return sum(1 for hit in self.hits if hit)
+
+    @property
+    def percent(self):
+        """指令覆盖率（百分比）"""
+        return 100.0 * self.covered / len(self.hits) if self.hits else 100.0
+
+    def uncovered(self):
+        """从未执行到的指令"""
+        return [item for item, hit in zip(self.program, self.hits) if not hit]
+
+    def to_text(self):
+        """文本报告：每条指令前标出执行到它的运行次数，从未执行的标为 #####"""
+        lines = [f"覆盖率: {self.covered}/{len(self.hits)} 条指令 ({self.percent:.1f}%)，共 {self.runs} 次运行"]
+        for item, hit in zip(self.program, self.hits):
+            mark = f"{hit:>5}" if hit else "#####"
+            lines.append(f"{mark} | 第{item['line']}行: {item['instruction']} {item['operand'] or ''}".rstrip())
+        return '\n'.join(lines)
+
+    def to_json(self):
+        """JSON报告"""
+        return json.dumps({
+            'source': self.source,
+            'runs': self.runs,
+            'instructions': len(self.hits),
+            'covered': self.covered,
+            'percent': round(self.percent, 2),
+            'lines': [{'line': item['line'], 'instruction': item['instruction'],
+                       'operand': item['operand'], 'hits': hit}
+                      for item, hit in zip(self.program, self.hits)],
+            'results': self.results,
+        }, ensure_ascii=False, indent=2)
+
+    def to_lcov(self):
+        """lcov格式报告（DA:行号,命中次数），可用 genhtml 等工具查看"""
+        lines = ['TN:', f"SF:{self.source}"]
+        lines += [f"DA:{item['line']},{hit}" for item, hit in zip(self.program, self.hits)]
+        lines += [f"LF:{len(self.hits)}", f"LH:{self.covered}", 'end_of_record']
+        return '\n'.join(lines) + '\n'
+
+
+class ExecutionHistory:
+    """逐步撤销记录：每步只保存被改写的一个槽和旧的累加器、程序计数器，
+    每 interval 步保存一个完整检查点；超过 limit 步时丢弃最早的一段，内存占用有上限"""
+
+    def __init__(self, interval=1000, limit=200000):
+        self.interval = interval
+        self.limit = limit
+        self.clear()
+
+    def clear(self):
+        """清空记录"""
+        self.base = 0  # deltas[0] 对应的步号（总是一个检查点）
+        self.deltas = []
+        self.checkpoints = {}  # 步号 -> 该步执行前的完整状态
+
+    @property
+    def step(self):
+        """当前步号（已记录的指令执行次数）"""
+        return self.base + len(self.deltas)
+
+    def trim(self):
+        """丢弃最早的检查点及其后的撤销记录，直到下一个检查点"""
+        later = [step for step in self.checkpoints if step > self.base]
+        if not later:
+            return
+        new_base = min(later)
+        del self.checkpoints[self.base]
+        del self.deltas[:new_base - self.base]
+        self.base = new_base
+
+    def truncate(self, step):
+        """丢弃 step 之后的记录"""
+        del self.deltas[step - self.base:]
+        for later in [s for s in self.checkpoints if s > step]:
+            del self.checkpoints[later]
+
+
+# 指令存储中的操作码（指令在此元组中的位置）和操作数类型码（0 表示没有操作数）
+INSTRUCTION_NAMES = tuple(INSTRUCTION_OPERANDS)
+INSTRUCTION_CODES = {name: code for code, name in enumerate(INSTRUCTION_NAMES)}
+OPERAND_KINDS = (None, 'slot', 'number', 'text_slot', 'hanzi', 'text', 'error', 'slot_range', 'text_slot_range')
+OPERAND_KIND_CODES = {kind: code for code, kind in enumerate(OPERAND_KINDS)}
+
+# 整数操作数列能存放的范围（超出的数字另存）
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+class Program:
+    """按列存放的已加载程序：操作码和操作数类型为字节数组，整数操作数和行号为整数数组，
+    操作数原文放在去重的字符串表中，每条指令约占18字节；加载后再加上快速路径的分派表和覆盖位图
+    各1字节（load_lines 读入100万条指令实测共约21MB）。
+    program[i] 仍返回 {'instruction', 'operand', 'line'} 字典（副本，修改不会写回），
+    执行路径用 instruction(i)、operand(i)、value(i) 和各列直接读取"""
+
+    __slots__ = ('opcodes', 'kinds', 'values', 'operands', 'lines', 'strings', 'big_values', '_string_codes')
+
+    def __init__(self):
+        self.opcodes = bytearray()
+        self.kinds = bytearray()
+        self.values = array('q')    # 槽号或数字，区间为 起点<<32|终点（其他类型为0）
+        self.operands = array('i')  # 操作数原文在字符串表中的位置，-1 表示没有操作数
+        self.lines = array('i')     # 源代码行号
+        self.strings = []
+        self.big_values = {}        # 超出整数列范围的数字：序号 -> 值
+        self._string_codes = {}
+
+    def append(self, instruction, operand, line_num, value=None, value_type=None):
+        """追加一条指令（value、value_type 为 decode_operand 的解析结果）"""
+        index = len(self.opcodes)
+        self.opcodes.append(INSTRUCTION_CODES[instruction])
+        self.kinds.append(OPERAND_KIND_CODES[value_type])
+        if value_type in ('slot', 'number', 'text_slot'):
+            if not INT64_MIN <= value <= INT64_MAX:
+                self.big_values[index] = value
+                value = 0
+            self.values.append(value)
+        elif value_type in ('slot_range', 'text_slot_range'):
+            self.values.append(value[0] << 32 | value[1])
+        else:
+            self.values.append(0)
+        if operand is None:
+            self.operands.append(-1)
+        else:
+            code = self._string_codes.get(operand)
+            if code is None:
+                code = self._string_codes[operand] = len(self.strings)
+                self.strings.append(sys.intern(operand))
+            self.operands.append(code)
+        self.lines.append(line_num)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, index):
+        return {'instruction': self.instruction(index), 'operand': self.operand(index), 'line': self.lines[index]}
+
+    def __iter__(self):
+        strings = self.strings
+        for opcode, operand, line_num in zip(self.opcodes, self.operands, self.lines):
+            yield {'instruction': INSTRUCTION_NAMES[opcode],
+                   'operand': strings[operand] if operand >= 0 else None,
+                   'line': line_num}
+
+    def instruction(self, index):
+        """第index条指令的名称"""
+        return INSTRUCTION_NAMES[self.opcodes[index]]
+
+    def operand(self, index):
+        """第index条指令的操作数原文（没有时为None）"""
+        code = self.operands[index]
+        return self.strings[code] if code >= 0 else None
+
+    def kind(self, index):
+        """第index条指令操作数的类型（与 decode_operand 相同）"""
+        return OPERAND_KINDS[self.kinds[index]]
+
+    def value(self, index):
+        """第index条指令操作数解析后的值（与 decode_operand 相同）"""
+        kind = OPERAND_KINDS[self.kinds[index]]
+        if kind in ('slot', 'number', 'text_slot'):
+            return self.big_values.get(index, self.values[index]) if self.big_values else self.values[index]
+        if kind in ('hanzi', 'text'):
+            return self.operand(index)
+        if kind in ('slot_range', 'text_slot_range'):
+            packed = self.values[index]
+            return (packed >> 32, packed & 0xFFFFFFFF)
+        return None
+
+    def to_columns(self):
+        """导出为只含字节串、字符串和整数的字典（供 marshal 写入缓存）"""
+        return {
+            'opcodes': bytes(self.opcodes),
+            'kinds': bytes(self.kinds),
+            'values': self.values.tobytes(),
+            'operands': self.operands.tobytes(),
+            'lines': self.lines.tobytes(),
+            'strings': list(self.strings),
+            'big_values': dict(self.big_values),
+        }
+
+    @classmethod
+    def from_columns(cls, columns):
+        """由 to_columns 的结果重建（各列长度不一致或引用越界时抛出 ValueError）"""
+        program = cls()
+        program.opcodes = bytearray(columns['opcodes'])
+        program.kinds = bytearray(columns['kinds'])
+        program.values.frombytes(columns['values'])
+        program.operands.frombytes(columns['operands'])
+        program.lines.frombytes(columns['lines'])
+        program.strings = [sys.intern(text) for text in columns['strings']]
+        program.big_values = dict(columns['big_values'])
+        size = len(program.opcodes)
+        if (any(len(column) != size for column in (program.kinds, program.values,
+                                                    program.operands, program.lines))
+                or any(opcode >= len(INSTRUCTION_NAMES) for opcode in program.opcodes)
+                or any(kind >= len(OPERAND_KINDS) for kind in program.kinds)
+                or any(not -1 <= operand < len(program.strings) for operand in program.operands)):
+            raise ValueError('程序各列不一致')
+        program._string_codes = {text: code for code, text in enumerate(program.strings)}
+        return program
+
+
+# 快速路径读取操作数值的方式（预解码时按操作数类型确定）
+FETCH_NONE, FETCH_INT, FETCH_TEXT, FETCH_RANGE, FETCH_BIG = range(5)
+
+
+class DecodedProgram:
+    """通过校验的程序的快速路径分派表：每条指令一个字节的处理编号（dispatch），
+    编号 -> (处理方法, 取值方式)（handlers）；操作数值和行号运行时直接从 Program 的各列读取，
+    不为每条指令另建对象。decoded[i] 返回第i条指令的 (处理方法, 值, 行号)"""
+
+    __slots__ = ('program', 'dispatch', 'handlers')
+
+    def __init__(self, program, dispatch, handlers):
+        self.program = program
+        self.dispatch = dispatch  # bytearray，每条指令的处理编号
+        self.handlers = handlers  # [(处理方法, FETCH_*), ...]
+
+    def __len__(self):
+        return len(self.dispatch)
+
+    def __getitem__(self, index):
+        handler, fetch = self.handlers[self.dispatch[index]]
+        return handler, self.value(index, fetch), self.program.lines[index]
+
+    def value(self, index, fetch):
+        """按取值方式读取第index条指令的操作数值（与 Program.value 相同）"""
+        program = self.program
+        if fetch == FETCH_INT:
+            return program.values[index]
+        if fetch == FETCH_TEXT:
+            return program.strings[program.operands[index]]
+        if fetch == FETCH_RANGE:
+            packed = program.values[index]
+            return (packed >> 32, packed & 0xFFFFFFFF)
+        if fetch == FETCH_BIG:
+            return program.big_values[index]
+        return None
+
+    def with_traps(self, indexes, make_trap):
+        """返回在 indexes 处换成 make_trap(处理方法) 的副本（共用各列，只复制分派表）"""
+        dispatch = bytearray(self.dispatch)
+        handlers = list(self.handlers)
+        traps = {}  # 原处理编号 -> 检查函数的编号
+        for index in indexes:
+            code = dispatch[index]
+            if code not in traps:
+                handler, fetch = handlers[code]
+                traps[code] = len(handlers)
+                handlers.append((make_trap(handler), fetch))
+            dispatch[index] = traps[code]
+        return DecodedProgram(self.program, dispatch, handlers)
+
+
+# 程序缓存格式版本（解析、校验或预解码规则变化时递增，旧缓存自动失效）
+PROGRAM_CACHE_VERSION = 3
+
+
+class ProgramCache:
+    """已加载程序的缓存：按源文本哈希保存解析、校验和预解码的结果，
+    内存中保留最近用过的 capacity 个程序；指定 cache_dir 时同时以 marshal 二进制格式存到磁盘"""
+
+    def __init__(self, capacity=32, cache_dir=None):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.entries = {}  # 键 -> 条目，按最近使用排序
+
+    @staticmethod
+    def key(program_text, optimize, slots):
+        """缓存键：源文本、优化开关、槽数、缓存格式版本、解释器版本和字节序的哈希"""
+        digest = hashlib.sha256()
+        digest.update(f"{PROGRAM_CACHE_VERSION}|{sys.implementation.cache_tag}|{sys.byteorder}|"
+                      f"{optimize:d}|{slots}|".encode())
+        digest.update(program_text.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.prog")
+
+    def get(self, key):
+        """取出缓存条目（先查内存，再查磁盘），没有时返回None"""
+        entry = self.entries.pop(key, None)
+        if entry is None and self.cache_dir:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    cached = marshal.loads(f.read())  # 整块读入再解析，比从文件逐段读取快得多
+            except (OSError, EOFError, ValueError, TypeError):
+                cached = None
+            if isinstance(cached, dict) and cached.get('key') == key:
+                entry = cached
+        if entry is not None:
+            self.remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        """保存缓存条目；写磁盘是原子的，失败时静默跳过"""
+        entry['key'] = key
+        self.remember(key, entry)
+        if not self.cache_dir:
+            return
+        temp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(entry, f)
+            os.replace(temp_path, self._path(key))
+            temp_path = None
+        except (OSError, ValueError):
+            pass
+        finally:
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def remember(self, key, entry):
+        """放入内存缓存，超出容量时丢弃最久未用的条目"""
+        self.entries[key] = entry
+        while len(self.entries) > self.capacity:
+            del self.entries[next(iter(self.entries))]
+
+    def discard(self, key):
+        """丢弃一个条目（内存和磁盘），用于读到损坏的条目时"""
+        self.entries.pop(key, None)
+        if self.cache_dir:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """清空内存缓存"""
+        self.entries.clear()
+
+
+# 所有虚拟机默认共用的程序缓存（只在内存中）
+PROGRAM_CACHE = ProgramCache()
+
+
+# iter_steps 产出的增量中改写位置的类型（1-4 与执行历史的改写类型相同）
+DELTA_NONE = 0         # 不改写状态（跳转、停机等）
+DELTA_SLOT = 1         # 数字槽，槽号为 int
+DELTA_TEXT_SLOT = 2    # 文本槽
+DELTA_SLOT_RANGE = 3   # 数字槽区间，槽号为(起点, 终点)，值为元组
+DELTA_TEXT_RANGE = 4   # 文本槽区间
+DELTA_ACC = 6          # 累加器，槽号为 None
+DELTA_TEXT_ACC = 7     # 文本累加器
+DELTA_SPLIT = 8        # 拆分同时改写文本累加器和文槽，值为(文本累加器, 文槽内容)
+
+# 改写累加器和文本累加器的指令
+ACC_INSTRUCTIONS = ('加', '减', '乘', '除', '读取', '区间求和')
+TEXT_ACC_INSTRUCTIONS = ('拼接', '修饰', '复制', '取含义', '取拼音', '取对话', '取词性', '取类别', '取前压',
+                         '后继', '取结构位置适配', '取语义位置适配', '读取文本', '替换', '拆分', '区间拼接')
+
+
+def copy_slots(memory, start, end, target):
+    """把 memory[start..end] 整段复制到从 target 开始的位置（两段可以重叠），目标越界时抛出 ValueError"""
+    count = end - start + 1
+    if not 0 <= target <= len(memory) - count:
+        raise ValueError(f"复制目标 槽{target} 超出范围")
+    memory[target:target + count] = memory[start:end + 1]
+
 
 class VirtualMachine:
-    """虚拟机类，执行卡片程序"""
+    """虚拟机类，执行卡片程序（cache_dir 为汉字处理器派生索引的磁盘缓存目录，不指定时只在内存中构建）"""
     
-    def __init__(self):
+    def __init__(self, cache_dir=None):
         self.memory = [0] * 100  # 数字存储槽
         self.text_memory = [""] * 100  # 文本存储槽
         self.accumulator = 0
         self.text_accumulator = ""
         self.program_counter = 0
         self.is_running = False
-        self.program = []
+        self.program = Program()
         self.output_history = []
         self.max_memory_slots = 100
-        self.hanzi_processor = HanziProcessor()
+        self.hanzi_processor = HanziProcessor(cache_dir)
+        self.optimization_report = []
+        self.load_errors = []
+        self.validated = False
+        self.engine = 'fast'
+        self.steps_executed = 0
+        self.profiling = False  # 性能分析模式：逐条计时，关闭时运行路径不受影响
+        self.profile_counts = []
+        self.profile_times = []
+        self.coverage = bytearray()  # 覆盖位图：每条指令一个字节，执行到置1
+        self.recording = False  # 记录执行历史，支持单步后退和跳到任意步
+        self.history = ExecutionHistory()
+        self._write_targets = None
+        self._step_targets = None  # iter_steps 用的每条指令改写位置
+        self.breakpoints = {}  # 源代码行号 -> 条件文本（None 表示无条件断点）
+        self.break_hit = None  # 最近一次运行停在的断点行号
+        self._break_checks = None  # 程序序号 -> 判断函数，运行时按需生成
+        self._trapped = None  # 断点处换成检查函数的预解码程序
+        self._decoded = None
+        self._blocks = {}
+        self._leader_breaks = frozenset()  # 编译基本块时断点所在的程序序号
+        self.program_cache = PROGRAM_CACHE  # 设为 None 可关闭缓存
+        self._program_key = None  # 当前程序的缓存键
         
     def reset(self):
         """重置虚拟机状态"""
@@ -751,88 +1843,334 @@ class VirtualMachine:
         self.program_counter = 0
         self.is_running = False
         self.output_history = []
-        self.program = []
-        
-    def load_program(self, program_text):
-        """从文本加载程序"""
-        self.program = []
-        lines = program_text.strip().split('\n')
+        self.program = Program()
+        self.optimization_report = []
+        self.load_errors = []
+        self.validated = False
+        self.profile_counts = []
+        self.profile_times = []
+        self.coverage = bytearray()
+        self.history.clear()
+        self._write_targets = None
+        self._step_targets = None
+        self.break_hit = None
+        self._break_checks = None
+        self._trapped = None
+        self._decoded = None
+        self._blocks = {}
+        self._program_key = None
+        
+    def load_program(self, program_text, optimize=False):
+        """从文本加载程序并做静态校验（optimize为True时执行窥孔优化）
+        源文本未变时直接使用缓存的解析结果；与当前程序相同时连已编译的基本块也保留"""
+        key = None
+        if self.program_cache is not None:
+            key = self.program_cache.key(program_text, optimize, self.max_memory_slots)
+            entry = self.program_cache.get(key)
+            if entry is not None:
+                if self._load_cached(key, entry):
+                    self._after_load()
+                    return
+                self.program_cache.discard(key)  # 条目损坏，按未命中处理并重新生成
+                
+        output_start = len(self.output_history)
+        self.load_lines(io.StringIO(program_text), optimize)
+        if key is not None:
+            # 程序本身已是按列存放，直接存字节串；预解码结果加载时由各列快速重建
+            entry = self.program.to_columns()
+            entry.update(errors=list(self.load_errors),
+                         messages=self.output_history[output_start:],
+                         report=list(self.optimization_report))
+            self.program_cache.put(key, entry)
+            self._program_key = key
+
+    def load_lines(self, lines, optimize=False):
+        """从任意行迭代器（打开的文件、sys.stdin、生成器等）一遍流式加载程序，不经过程序缓存
+        行号按迭代顺序从1开始；源文本不整体驻留内存，内存占用只与加载后的指令数成正比"""
+        self._program_key = None
+        program = self.program = Program()
+        self.optimization_report = []
+        self.load_errors = []
+        self._decoded = None
+        self._blocks = {}
         
         for line_num, line in enumerate(lines, 1):
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue  # 跳过空行和注释
-                
-            parts = line.split()
-            if len(parts) < 1:
+            instruction, operand, decoded, error = self._parse_line(line)
+            if error:
+                self.report_load_error(line_num, error)
+            if instruction is None:
+                continue  # 空行、注释，或无法加入程序的错误行
+            program.append(instruction, operand, line_num, decoded[0], decoded[1])
+
+        # 跳转目标依赖程序长度，全部读入后再检查
+        jump = INSTRUCTION_CODES['跳转']
+        number = OPERAND_KIND_CODES['number']
+        for index, (opcode, kind) in enumerate(zip(program.opcodes, program.kinds)):
+            if opcode == jump and kind == number:
+                value = program.value(index)
+                if not 0 <= value < len(program):
+                    self.report_load_error(program.lines[index], f"跳转目标 {value} 无效")
+        self.load_errors.sort(key=lambda error: error[0])
+
+        if optimize:
+            self.optimization_report = self.optimize_program()
+
+        # 通过校验的程序预解码，运行时走无检查的快速路径
+        self.validated = not self.load_errors
+        if self.validated:
+            self._decode_program()
+        self._after_load()
+
+    def _load_cached(self, key, entry):
+        """从缓存条目恢复程序（与当前程序相同时保留预解码结果和已编译的基本块）
+        条目缺少字段或内容损坏（任何异常，包括预解码失败）时不改动虚拟机，返回False"""
+        try:
+            messages = list(entry['messages'])
+            errors = [tuple(error) for error in entry['errors']]
+            report = list(entry['report'])
+            program = decoded = None
+            if key != self._program_key:
+                program = Program.from_columns(entry)
+                if not errors:
+                    decoded = self._decode(program)
+        except Exception:
+            return False
+        self.output_history.extend(messages)
+        self.load_errors = errors
+        self.optimization_report = report
+        self.validated = not self.load_errors
+        if program is None:
+            return True
+        self._program_key = key
+        self.program = program
+        self._blocks = {}
+        self._decoded = decoded
+        return True
+
+    def _after_load(self):
+        """加载程序后重置与程序相关的运行数据"""
+        self.reset_profile()
+        self.coverage = bytearray(len(self.program))
+        self.history.clear()
+        self._write_targets = None
+        self._step_targets = None
+        self._break_checks = None
+        self._trapped = None
+
+    def reset_profile(self):
+        """清空性能分析数据（每条指令的执行次数和累计耗时，首次以性能分析模式运行时才按程序长度分配）"""
+        self.profile_counts = []
+        self.profile_times = []
+
+    def profile_report(self):
+        """性能分析结果，按总耗时从高到低排列（只包含执行过的指令）"""
+        report = []
+        for index, count in enumerate(self.profile_counts):
+            if not count:
                 continue
-                
-            instruction = parts[0]
-            operand = parts[1] if len(parts) > 1 else None
+            item = self.program[index]
+            total = self.profile_times[index]
+            report.append({
+                'index': index,
+                'line': item['line'],
+                'text': f"{item['instruction']} {item['operand'] or ''}".strip(),
+                'count': count,
+                'total': total,
+                'average': total / count,
+            })
+        report.sort(key=lambda row: (-row['total'], row['index']))
+        return report
+
+    def report_load_error(self, line_num, message):
+        """记录一条加载错误"""
+        self.load_errors.append((line_num, message))
+        self.output_history.append(f"第{line_num}行: {message}")
+
+    def parse_line(self, line):
+        """解析并静态检查一行代码，返回(指令, 操作数, 错误信息)
+        空行和注释，以及指令无效或缺少操作数的行（不加入程序）返回的指令为None"""
+        instruction, operand, _, error = self._parse_line(line)
+        return (instruction, operand, error)
+
+    def _parse_line(self, line):
+        """parse_line 的实现，另外返回操作数的解析结果(值, 类型)，加载时不必再解析一遍"""
+        line = line.strip()
+        if not line or line.startswith('#'):
+            return (None, None, None, None)
             
-            # 验证指令
-            valid_instructions = [
-                # 算术指令
-                '加', '减', '乘', '除', '存储', '读取', '跳转', '停机',
-                # 汉字处理指令
-                '拼接', '拆分', '修饰', '复制', '粘贴', '取含义', '取拼音',
-                '取对话', '取词性', '取类别', '取前压', '后继', 
-                '取结构位置适配', '取语义位置适配', '存储文本', '读取文本'
-            ]
+        parts = line.split()
+        instruction = parts[0]
+        operand = parts[1] if len(parts) > 1 else None
+        
+        # 验证指令
+        if instruction not in INSTRUCTION_OPERANDS:
+            return (None, None, None, f"无效指令 '{instruction}'")
             
-            if instruction not in valid_instructions:
-                self.output_history.append(f"第{line_num}行: 无效指令 '{instruction}'")
-                continue
-                
-            # 验证操作数
-            if instruction != '停机' and operand is None:
-                self.output_history.append(f"第{line_num}行: 指令 '{instruction}' 需要操作数")
-                continue
-                
-            self.program.append({
-                'instruction': instruction,
-                'operand': operand,
-                'line': line_num
-            })
+        # 验证操作数
+        if INSTRUCTION_OPERANDS[instruction] is not None and operand is None:
+            return (None, None, None, f"指令 '{instruction}' 需要操作数")
             
-    def parse_operand(self, operand):
-        """解析操作数，返回(值, 类型)"""
+        decoded = self.decode_operand(operand)
+        return (instruction, operand, decoded, self.check_operand(instruction, operand, decoded))
+
+    def check_operand(self, instruction, operand, decoded=None):
+        """检查操作数是否符合指令要求，返回错误信息或None（decoded 为已有的 decode_operand 结果）"""
+        allowed = INSTRUCTION_OPERANDS[instruction]
+        value, value_type, error = decoded or self.decode_operand(operand)
+        if error:
+            return error.replace("错误: ", "")
+        if allowed is None:
+            return None
+        if value_type not in allowed:
+            expected = '/'.join(OPERAND_KIND_NAMES[kind] for kind in allowed)
+            return f"指令 '{instruction}' 的操作数 '{operand}' 类型不匹配（应为 {expected}）"
+        if instruction == '拆分' and value < 0:
+            return f"拆分位置 {value} 不能为负数"
+        return None
+
+    def decode_operand(self, operand):
+        """解析操作数，返回(值, 类型, 错误信息)，不写入输出"""
         if operand is None:
-            return (None, None)
+            return (None, None, None)
             
+        # 检查是否是存储槽区间（槽A~B、文槽A~B）
+        if '~' in operand and operand.startswith('文槽'):
+            return self.decode_range(operand[2:], 'text_slot_range', '文本存储槽', operand)
+        elif '~' in operand and operand.startswith('槽'):
+            return self.decode_range(operand[1:], 'slot_range', '存储槽', operand)
         # 检查是否是文本存储位置
-        if operand.startswith('文槽'):
+        elif operand.startswith('文槽'):
             try:
                 slot_num = int(operand[2:])
                 if 0 <= slot_num < self.max_memory_slots:
-                    return (slot_num, 'text_slot')
+                    return (slot_num, 'text_slot', None)
                 else:
-                    self.output_history.append(f"错误: 文本存储槽 {slot_num} 超出范围")
-                    return (None, 'error')
+                    return (None, 'error', f"错误: 文本存储槽 {slot_num} 超出范围")
             except ValueError:
-                self.output_history.append(f"错误: 无效的文本存储槽格式 '{operand}'")
-                return (None, 'error')
+                return (None, 'error', f"错误: 无效的文本存储槽格式 '{operand}'")
         # 检查是否是数字存储位置
         elif operand.startswith('槽'):
             try:
                 slot_num = int(operand[1:])
                 if 0 <= slot_num < self.max_memory_slots:
-                    return (slot_num, 'slot')
+                    return (slot_num, 'slot', None)
                 else:
-                    self.output_history.append(f"错误: 存储槽 {slot_num} 超出范围")
-                    return (None, 'error')
+                    return (None, 'error', f"错误: 存储槽 {slot_num} 超出范围")
             except ValueError:
-                self.output_history.append(f"错误: 无效的存储槽格式 '{operand}'")
-                return (None, 'error')
+                return (None, 'error', f"错误: 无效的存储槽格式 '{operand}'")
         # 检查是否是数字
         elif operand.isdigit() or (operand[0] == '-' and operand[1:].isdigit()):
-            return (int(operand), 'number')
+            return (int(operand), 'number', None)
         # 检查是否是汉字文本
         elif self.hanzi_processor.is_hanzi(operand):
-            return (operand, 'hanzi')
+            return (operand, 'hanzi', None)
         # 否则作为普通文本
         else:
-            return (operand, 'text')
+            return (operand, 'text', None)
+
+    def decode_range(self, text, value_type, name, operand):
+        """解析区间操作数中 A~B 部分，返回((起点, 终点), 类型, 错误信息)"""
+        try:
+            start, end = (int(part) for part in text.split('~'))
+        except ValueError:
+            return (None, 'error', f"错误: 无效的{name}区间格式 '{operand}'")
+        if not 0 <= start <= end < self.max_memory_slots:
+            return (None, 'error', f"错误: {name}区间 {start}~{end} 无效")
+        return ((start, end), value_type, None)
+
+    def parse_operand(self, operand):
+        """解析操作数，返回(值, 类型)"""
+        value, value_type, error = self.decode_operand(operand)
+        if error:
+            self.output_history.append(error)
+        return (value, value_type)
+
+    def optimize_program(self):
+        """窥孔优化：在不改变程序行为的前提下改写指令列表，返回改写记录"""
+        report = []
+        program = list(self.program)  # 展开为字典列表改写，最后再存回按列的指令存储
+        decoded = [self.decode_operand(item['operand'])[:2] for item in program]
+
+        # 跳转链穿透：跳转到另一条跳转时直接跳到最终目标（不改变指令位置）
+        for index, item in enumerate(program):
+            value, value_type = decoded[index]
+            if item['instruction'] != '跳转' or value_type != 'number':
+                continue
+            target = value
+            visited = {index}
+            while (0 <= target < len(program) and target not in visited
+                   and program[target]['instruction'] == '跳转'
+                   and decoded[target][1] == 'number'
+                   and 0 <= decoded[target][0] < len(program)):
+                visited.add(target)
+                target = decoded[target][0]
+            if target != value and target not in visited:
+                item['operand'] = str(target)
+                decoded[index] = (target, 'number')
+                report.append(f"第{item['line']}行: 跳转链穿透 跳转 {value} → 跳转 {target}")
+
+        # 删除或合并指令会改变行号，只有全部跳转目标都静态可知且有效时才进行
+        jump_targets = set()
+        for item, (value, value_type) in zip(program, decoded):
+            if item['instruction'] != '跳转':
+                continue
+            if value_type != 'number' or not 0 <= value < len(program):
+                self.program = self._store_program(program)
+                return report
+            jump_targets.add(value)
+
+        optimized = []
+        new_index = {}
+        for index, item in enumerate(program):
+            value, value_type = decoded[index]
+            previous = optimized[-1] if optimized else None
+            mergeable = previous is not None and index not in jump_targets
+
+            if (mergeable and item['instruction'] in ('加', '减') and value_type == 'number'
+                    and previous['instruction'] in ('加', '减') and previous['kind'] == 'number'):
+                delta = ((previous['value'] if previous['instruction'] == '加' else -previous['value'])
+                         + (value if item['instruction'] == '加' else -value))
+                merged = '加' if delta >= 0 else '减'
+                report.append(f"第{previous['line']}-{item['line']}行: 合并常量 "
+                              f"{previous['instruction']} {previous['operand']}、"
+                              f"{item['instruction']} {item['operand']} → {merged} {abs(delta)}")
+                previous.update(instruction=merged, operand=str(abs(delta)), value=abs(delta))
+                continue
+
+            if (mergeable and item['instruction'] == '读取' and value_type == 'slot'
+                    and previous['instruction'] == '存储' and previous['kind'] == 'slot'
+                    and previous['value'] == value):
+                report.append(f"第{item['line']}行: 删除冗余读取 读取 {item['operand']}（紧跟在存储之后）")
+                continue
+
+            if (mergeable and item['instruction'] == '拼接' and value_type in ('hanzi', 'text')
+                    and previous['instruction'] == '拼接' and previous['kind'] in ('hanzi', 'text')):
+                text = previous['operand'] + item['operand']
+                text_value, text_type, _ = self.decode_operand(text)
+                if text_type in ('hanzi', 'text'):
+                    report.append(f"第{previous['line']}-{item['line']}行: 合并拼接 "
+                                  f"{previous['operand']}、{item['operand']} → {text}")
+                    previous.update(operand=text, value=text_value, kind=text_type)
+                    continue
+
+            new_index[index] = len(optimized)
+            optimized.append(dict(item, value=value, kind=value_type))
+
+        for item in optimized:
+            if item['instruction'] == '跳转' and new_index[item['value']] != item['value']:
+                item['operand'] = str(new_index[item['value']])
+            del item['value'], item['kind']
+
+        self.program = self._store_program(optimized)
+        return report
+
+    def _store_program(self, items):
+        """把 {'instruction', 'operand', 'line'} 字典列表存为按列的指令存储"""
+        program = Program()
+        for item in items:
+            value, value_type, _ = self.decode_operand(item['operand'])
+            program.append(item['instruction'], item['operand'], item['line'], value, value_type)
+        return program
             
     def execute_step(self):
         """执行一步程序"""
@@ -841,10 +2179,13 @@ class VirtualMachine:
             self.output_history.append("程序执行完毕")
             return False
             
-        instruction_data = self.program[self.program_counter]
-        instruction = instruction_data['instruction']
-        operand = instruction_data['operand']
-        line_num = instruction_data['line']
+        program = self.program
+        pc = self.program_counter
+        self.coverage[pc] = 1
+        instruction = INSTRUCTION_NAMES[program.opcodes[pc]]
+        operand = program.operands[pc]
+        operand = program.strings[operand] if operand >= 0 else None
+        line_num = program.lines[pc]
         
         value, value_type = self.parse_operand(operand)
         
@@ -958,6 +2299,18 @@ class VirtualMachine:
                     self.text_accumulator = f"【{self.text_accumulator}】的{value}"
                     self.output_history.append(f"行{line_num}: 文本修饰为 '{self.text_accumulator}'")
                     
+            elif instruction == '替换':
+                # 操作数为存放替换表的文槽，或替换表文件名
+                if value_type == 'text_slot':
+                    replacer = self.hanzi_processor.compile_replacements(self.text_memory[value])
+                elif value_type in ['hanzi', 'text']:
+                    replacer = self.hanzi_processor.load_replacement_file(value)
+                else:
+                    replacer = None
+                if replacer is not None:
+                    self.text_accumulator, count = replacer.subn(self.text_accumulator)
+                    self.output_history.append(f"行{line_num}: 替换 {count} 处: '{self.text_accumulator}'")
+                    
             elif instruction == '复制':
                 if value_type == 'number':
                     self.text_accumulator = self.hanzi_processor.duplicate(self.text_accumulator, value)
@@ -983,12 +2336,7 @@ class VirtualMachine:
             elif instruction == '取对话':
                 # 简单的对话生成
                 if self.text_accumulator:
-                    if '你好' in self.text_accumulator or '您好' in self.text_accumulator:
-                        response = f"你好！我是汉字编程语言助手。"
-                    elif '吗' in self.text_accumulator or '？' in self.text_accumulator or '?' in self.text_accumulator:
-                        response = f"这是一个关于'{self.text_accumulator}'的问题。"
-                    else:
-                        response = f"你说的是: {self.text_accumulator}"
+                    response = self.hanzi_processor.get_dialog(self.text_accumulator)
                     self.text_accumulator = response
                     self.output_history.append(f"行{line_num}: 对话: {response}")
                     
@@ -1040,6 +2388,53 @@ class VirtualMachine:
                 if value_type == 'text_slot':
                     self.text_accumulator = self.text_memory[value]
                     self.output_history.append(f"行{line_num}: 从文槽{value}读取文本: '{self.text_accumulator}'")
+                    
+            # === 区间指令 ===
+            elif instruction == '区间求和':
+                if value_type == 'slot_range':
+                    start, end = value
+                    self.accumulator = sum(self.memory[start:end + 1])
+                    self.output_history.append(f"行{line_num}: 累加器 = 槽{start}~{end} 之和 = {self.accumulator}")
+                    
+            elif instruction == '区间填充':
+                if value_type == 'slot_range':
+                    start, end = value
+                    self.memory[start:end + 1] = [self.accumulator] * (end - start + 1)
+                    self.output_history.append(f"行{line_num}: 槽{start}~{end} = {self.accumulator}")
+                    
+            elif instruction == '区间复制':
+                if value_type == 'slot_range':
+                    start, end = value
+                    target = self.accumulator
+                    copy_slots(self.memory, start, end, target)
+                    self.output_history.append(f"行{line_num}: 槽{start}~{end} 复制到 槽{target}~{target + end - start}")
+                    
+            elif instruction == '区间反转':
+                if value_type == 'slot_range':
+                    start, end = value
+                    self.memory[start:end + 1] = self.memory[start:end + 1][::-1]
+                    self.output_history.append(f"行{line_num}: 槽{start}~{end} 已反转")
+                    
+            elif instruction == '区间排序':
+                if value_type == 'slot_range':
+                    start, end = value
+                    self.memory[start:end + 1] = sorted(self.memory[start:end + 1])
+                    self.output_history.append(f"行{line_num}: 槽{start}~{end} 已排序")
+                    
+            elif instruction == '区间拼接':
+                if value_type == 'text_slot_range':
+                    start, end = value
+                    self.text_accumulator = self.hanzi_processor.concatenate(
+                        self.text_accumulator, ''.join(self.text_memory[start:end + 1]))
+                    self.output_history.append(f"行{line_num}: 文本累加器 = '{self.text_accumulator}'")
+                    
+            elif instruction == '区间拼音':
+                if value_type == 'text_slot_range':
+                    start, end = value
+                    get_pinyin = self.hanzi_processor.get_pinyin
+                    self.text_memory[start:end + 1] = [get_pinyin(text) if text else text
+                                                       for text in self.text_memory[start:end + 1]]
+                    self.output_history.append(f"行{line_num}: 文槽{start}~{end} 已转为拼音")
                 
         except Exception as e:
             self.output_history.append(f"行{line_num}: 执行错误: {str(e)}")
@@ -1049,68 +2444,1350 @@ class VirtualMachine:
         self.program_counter += 1
         return True
         
-    def run_program(self):
-        """运行整个程序"""
-        self.is_running = True
-        max_steps = 1000  # 防止无限循环
+    # === 快速执行路径 ===
+    # 仅用于通过静态校验的程序：加载时按(指令, 操作数类型)为每条指令预先选好处理方法
+    # （DecodedProgram，每条指令一个字节），运行时直接从指令存储的各列读取操作数值，
+    # 不再检查槽号范围和操作数类型。
+    # 处理方法返回False表示停止执行，与 execute_step 的输出和状态完全一致。
+
+    FAST_HANDLERS = {
+        ('加', 'slot'): '_fast_add_slot',
+        ('加', 'number'): '_fast_add_number',
+        ('减', 'slot'): '_fast_sub_slot',
+        ('减', 'number'): '_fast_sub_number',
+        ('乘', 'slot'): '_fast_mul_slot',
+        ('乘', 'number'): '_fast_mul_number',
+        ('除', 'slot'): '_fast_div_slot',
+        ('除', 'number'): '_fast_div_number',
+        ('存储', 'slot'): '_fast_store',
+        ('读取', 'slot'): '_fast_load',
+        ('跳转', 'number'): '_fast_jump',
+        ('跳转', 'slot'): '_fast_jump_slot',
+        ('停机', None): '_fast_halt',
+        ('拼接', 'hanzi'): '_fast_concat',
+        ('拼接', 'text'): '_fast_concat',
+        ('拼接', 'text_slot'): '_fast_concat_slot',
+        ('拆分', 'number'): '_fast_split',
+        ('修饰', 'hanzi'): '_fast_decorate',
+        ('修饰', 'text'): '_fast_decorate',
+        ('复制', 'number'): '_fast_duplicate',
+        ('粘贴', 'text_slot'): '_fast_paste',
+        ('取含义', None): '_fast_meaning',
+        ('取拼音', None): '_fast_pinyin',
+        ('取对话', None): '_fast_dialog',
+        ('取词性', None): '_fast_pos',
+        ('取类别', None): '_fast_category',
+        ('取前压', None): '_fast_rhyme',
+        ('后继', None): '_fast_successor',
+        ('取结构位置适配', 'hanzi'): '_fast_structure_fit',
+        ('取结构位置适配', 'text'): '_fast_structure_fit',
+        ('取语义位置适配', 'hanzi'): '_fast_semantic_fit',
+        ('取语义位置适配', 'text'): '_fast_semantic_fit',
+        ('存储文本', 'text_slot'): '_fast_store_text',
+        ('读取文本', 'text_slot'): '_fast_load_text',
+        ('替换', 'text_slot'): '_fast_replace_slot',
+        ('替换', 'hanzi'): '_fast_replace_file',
+        ('替换', 'text'): '_fast_replace_file',
+        ('区间求和', 'slot_range'): '_fast_range_sum',
+        ('区间填充', 'slot_range'): '_fast_range_fill',
+        ('区间复制', 'slot_range'): '_fast_range_copy',
+        ('区间反转', 'slot_range'): '_fast_range_reverse',
+        ('区间排序', 'slot_range'): '_fast_range_sort',
+        ('区间拼接', 'text_slot_range'): '_fast_range_join',
+        ('区间拼音', 'text_slot_range'): '_fast_range_pinyin',
+    }
+
+    def _decode_program(self):
+        """预解码当前程序（须已通过校验）"""
+        self._decoded = self._decode(self.program)
+
+    def _decode(self, program):
+        """为通过校验的程序建立分派表（DecodedProgram），指令与操作数类型不匹配时抛出 KeyError"""
+        codes = {}  # (操作码, 类型码, 是否超出整数列) -> 处理编号，同一处理方法只取一次
+        handlers = []
+        dispatch = bytearray(len(program))
+        big_values = program.big_values
+        for index, (opcode, kind) in enumerate(zip(program.opcodes, program.kinds)):
+            key = (opcode, kind, index in big_values) if big_values else (opcode, kind, False)
+            code = codes.get(key)
+            if code is None:
+                instruction = INSTRUCTION_NAMES[opcode]
+                value_type = None if INSTRUCTION_OPERANDS[instruction] is None else OPERAND_KINDS[kind]
+                if value_type is None:
+                    fetch = FETCH_NONE
+                elif key[2]:
+                    fetch = FETCH_BIG
+                elif value_type in ('slot', 'number', 'text_slot'):
+                    fetch = FETCH_INT
+                elif value_type in ('hanzi', 'text'):
+                    fetch = FETCH_TEXT
+                else:
+                    fetch = FETCH_RANGE
+                code = codes[key] = len(handlers)
+                handlers.append((getattr(self, self.FAST_HANDLERS[(instruction, value_type)]), fetch))
+            dispatch[index] = code
+        return DecodedProgram(program, dispatch, handlers)
+
+    def _fast_add_slot(self, value, line_num):
+        self.accumulator += self.memory[value]
+        self.output_history.append(f"行{line_num}: 累加器 = {self.accumulator} + {self.memory[value]}")
+
+    def _fast_add_number(self, value, line_num):
+        self.accumulator += value
+        self.output_history.append(f"行{line_num}: 累加器 = {self.accumulator} + {value}")
+
+    def _fast_sub_slot(self, value, line_num):
+        self.accumulator -= self.memory[value]
+        self.output_history.append(f"行{line_num}: 累加器 = {self.accumulator} - {self.memory[value]}")
+
+    def _fast_sub_number(self, value, line_num):
+        self.accumulator -= value
+        self.output_history.append(f"行{line_num}: 累加器 = {self.accumulator} - {value}")
+
+    def _fast_mul_slot(self, value, line_num):
+        self.accumulator *= self.memory[value]
+        self.output_history.append(f"行{line_num}: 累加器 = {self.accumulator} * {self.memory[value]}")
+
+    def _fast_mul_number(self, value, line_num):
+        self.accumulator *= value
+        self.output_history.append(f"行{line_num}: 累加器 = {self.accumulator} * {value}")
+
+    def _fast_div_slot(self, value, line_num):
+        return self._fast_div_number(self.memory[value], line_num)
+
+    def _fast_div_number(self, value, line_num):
+        if value == 0:
+            self.output_history.append(f"行{line_num}: 错误: 除以零")
+            self.is_running = False
+            return False
+        self.accumulator //= value
+        self.output_history.append(f"行{line_num}: 累加器 = {self.accumulator} // {value}")
+
+    def _fast_store(self, value, line_num):
+        self.memory[value] = self.accumulator
+        self.output_history.append(f"行{line_num}: 槽{value} = {self.accumulator}")
+
+    def _fast_load(self, value, line_num):
+        self.accumulator = self.memory[value]
+        self.output_history.append(f"行{line_num}: 累加器 = 槽{value} = {self.memory[value]}")
+
+    def _fast_jump(self, value, line_num):
+        self.program_counter = value - 1
+        self.output_history.append(f"行{line_num}: 跳转到行 {value}")
+
+    def _fast_jump_slot(self, value, line_num):
+        # 槽中的跳转目标只有运行时才知道，保留动态检查
+        target = self.memory[value]
+        if 0 <= target < len(self.program):
+            self.program_counter = target - 1
+            self.output_history.append(f"行{line_num}: 跳转到行 {target}")
+        else:
+            self.output_history.append(f"行{line_num}: 错误: 跳转目标 {target} 无效")
+            self.is_running = False
+            return False
+
+    def _fast_halt(self, value, line_num):
+        self.output_history.append(f"行{line_num}: 程序停机")
+        self.is_running = False
+        return False
+
+    def _fast_concat(self, value, line_num):
+        self.text_accumulator = self.hanzi_processor.concatenate(self.text_accumulator, value)
+        self.output_history.append(f"行{line_num}: 文本累加器 = '{self.text_accumulator}'")
+
+    def _fast_concat_slot(self, value, line_num):
+        self._fast_concat(self.text_memory[value], line_num)
+
+    def _fast_split(self, value, line_num):
+        parts = self.hanzi_processor.split(self.text_accumulator, value)
+        self.text_accumulator = parts[0]
+        if value < self.max_memory_slots - 1:
+            self.text_memory[value] = parts[1]
+        self.output_history.append(f"行{line_num}: 文本拆分为 '{parts[0]}' 和 '{parts[1]}'")
+
+    def _fast_decorate(self, value, line_num):
+        self.text_accumulator = f"【{self.text_accumulator}】的{value}"
+        self.output_history.append(f"行{line_num}: 文本修饰为 '{self.text_accumulator}'")
+
+    def _fast_duplicate(self, value, line_num):
+        self.text_accumulator = self.hanzi_processor.duplicate(self.text_accumulator, value)
+        self.output_history.append(f"行{line_num}: 文本复制 {value} 次: '{self.text_accumulator}'")
+
+    def _fast_paste(self, value, line_num):
+        self.text_memory[value] = self.text_accumulator
+        self.output_history.append(f"行{line_num}: 文本粘贴到 文槽{value}: '{self.text_accumulator}'")
+
+    def _fast_meaning(self, value, line_num):
+        if self.text_accumulator:
+            self.text_accumulator = self.hanzi_processor.get_meaning(self.text_accumulator)
+            self.output_history.append(f"行{line_num}: 含义: {self.text_accumulator}")
+
+    def _fast_pinyin(self, value, line_num):
+        if self.text_accumulator:
+            self.text_accumulator = self.hanzi_processor.get_pinyin(self.text_accumulator)
+            self.output_history.append(f"行{line_num}: 拼音: {self.text_accumulator}")
+
+    def _fast_dialog(self, value, line_num):
+        if self.text_accumulator:
+            self.text_accumulator = self.hanzi_processor.get_dialog(self.text_accumulator)
+            self.output_history.append(f"行{line_num}: 对话: {self.text_accumulator}")
+
+    def _fast_pos(self, value, line_num):
+        if self.text_accumulator:
+            self.text_accumulator = self.hanzi_processor.get_pos(self.text_accumulator)
+            self.output_history.append(f"行{line_num}: 词性: {self.text_accumulator}")
+
+    def _fast_category(self, value, line_num):
+        if self.text_accumulator:
+            self.text_accumulator = self.hanzi_processor.get_category(self.text_accumulator)
+            self.output_history.append(f"行{line_num}: 类别: {self.text_accumulator}")
+
+    def _fast_rhyme(self, value, line_num):
+        if self.text_accumulator:
+            self.text_accumulator = self.hanzi_processor.get_rhyme(self.text_accumulator)
+            self.output_history.append(f"行{line_num}: 押韵: {self.text_accumulator}")
+
+    def _fast_successor(self, value, line_num):
+        if self.text_accumulator:
+            successors = self.hanzi_processor.get_successor(self.text_accumulator)
+            self.text_accumulator = "、".join(successors[:5]) if successors else "无"
+            self.output_history.append(f"行{line_num}: 后继汉字: {self.text_accumulator}")
+
+    def _fast_structure_fit(self, value, line_num):
+        if self.text_accumulator:
+            self.text_accumulator = self.hanzi_processor.structure_position_fit(self.text_accumulator, value)
+            self.output_history.append(f"行{line_num}: 结构适配: {self.text_accumulator}")
+
+    def _fast_semantic_fit(self, value, line_num):
+        if self.text_accumulator:
+            self.text_accumulator = self.hanzi_processor.semantic_position_fit(self.text_accumulator, value)
+            self.output_history.append(f"行{line_num}: 语义适配: {self.text_accumulator}")
+
+    def _fast_store_text(self, value, line_num):
+        self.text_memory[value] = self.text_accumulator
+        self.output_history.append(f"行{line_num}: 存储文本到 文槽{value}: '{self.text_accumulator}'")
+
+    def _fast_load_text(self, value, line_num):
+        self.text_accumulator = self.text_memory[value]
+        self.output_history.append(f"行{line_num}: 从文槽{value}读取文本: '{self.text_accumulator}'")
+
+    def _fast_replace_slot(self, value, line_num):
+        self._fast_apply_replacer(self.hanzi_processor.compile_replacements(self.text_memory[value]), line_num)
+
+    def _fast_replace_file(self, value, line_num):
+        self._fast_apply_replacer(self.hanzi_processor.load_replacement_file(value), line_num)
+
+    def _fast_apply_replacer(self, replacer, line_num):
+        self.text_accumulator, count = replacer.subn(self.text_accumulator)
+        self.output_history.append(f"行{line_num}: 替换 {count} 处: '{self.text_accumulator}'")
+
+    def _fast_range_sum(self, value, line_num):
+        start, end = value
+        self.accumulator = sum(self.memory[start:end + 1])
+        self.output_history.append(f"行{line_num}: 累加器 = 槽{start}~{end} 之和 = {self.accumulator}")
+
+    def _fast_range_fill(self, value, line_num):
+        start, end = value
+        self.memory[start:end + 1] = [self.accumulator] * (end - start + 1)
+        self.output_history.append(f"行{line_num}: 槽{start}~{end} = {self.accumulator}")
+
+    def _fast_range_copy(self, value, line_num):
+        # 复制目标来自累加器，只有运行时才知道，保留动态检查
+        start, end = value
+        target = self.accumulator
+        copy_slots(self.memory, start, end, target)
+        self.output_history.append(f"行{line_num}: 槽{start}~{end} 复制到 槽{target}~{target + end - start}")
+
+    def _fast_range_reverse(self, value, line_num):
+        start, end = value
+        self.memory[start:end + 1] = self.memory[start:end + 1][::-1]
+        self.output_history.append(f"行{line_num}: 槽{start}~{end} 已反转")
+
+    def _fast_range_sort(self, value, line_num):
+        start, end = value
+        self.memory[start:end + 1] = sorted(self.memory[start:end + 1])
+        self.output_history.append(f"行{line_num}: 槽{start}~{end} 已排序")
+
+    def _fast_range_join(self, value, line_num):
+        start, end = value
+        self._fast_concat(''.join(self.text_memory[start:end + 1]), line_num)
+
+    def _fast_range_pinyin(self, value, line_num):
+        start, end = value
+        get_pinyin = self.hanzi_processor.get_pinyin
+        self.text_memory[start:end + 1] = [get_pinyin(text) if text else text
+                                           for text in self.text_memory[start:end + 1]]
+        self.output_history.append(f"行{line_num}: 文槽{start}~{end} 已转为拼音")
+
+    def _run_fast(self, max_steps):
+        """按分派表运行，返回执行的步数（断点处的处理函数已换成检查函数）"""
+        decoded = self._trapped or self._decoded
+        dispatch, handlers = decoded.dispatch, decoded.handlers
+        program = decoded.program
+        values, operands, strings, lines = program.values, program.operands, program.strings, program.lines
+        size = len(dispatch)
+        fetch_int, fetch_text, fetch_none, fetch_range = FETCH_INT, FETCH_TEXT, FETCH_NONE, FETCH_RANGE
+        covered = self.coverage
         steps = 0
-        
-        while self.is_running and steps < max_steps:
-            if not self.execute_step():
+        line_num = None
+        try:
+            while steps < max_steps:
+                pc = self.program_counter
+                if pc >= size:
+                    self.is_running = False
+                    self.output_history.append("程序执行完毕")
+                    break
+                handler, fetch = handlers[dispatch[pc]]
+                line_num = lines[pc]
+                if fetch == fetch_int:
+                    value = values[pc]
+                elif fetch == fetch_text:
+                    value = strings[operands[pc]]
+                elif fetch == fetch_none:
+                    value = None
+                elif fetch == fetch_range:
+                    packed = values[pc]
+                    value = (packed >> 32, packed & 0xFFFFFFFF)
+                else:
+                    value = program.big_values[pc]
+                covered[pc] = 1
+                if handler(value, line_num) is False:
+                    break
+                self.program_counter += 1
+                steps += 1
+        except Exception as e:
+            self.output_history.append(f"行{line_num}: 执行错误: {str(e)}")
+            self.is_running = False
+        return steps
+
+    def _run_profiled(self, engine, max_steps):
+        """性能分析模式下运行，逐条记录执行次数和耗时，返回执行的步数
+        （编译引擎没有逐条边界，改用快速路径的处理函数计时）"""
+        if len(self.profile_counts) != len(self.program):
+            self.profile_counts = array('L', bytes(array('L').itemsize * len(self.program)))
+            self.profile_times = array('d', bytes(array('d').itemsize * len(self.program)))
+        counts, times = self.profile_counts, self.profile_times
+        clock = time.perf_counter
+        decoded = self._decoded if engine != 'reference' else None
+        checks = self._break_checks
+        steps = 0
+        if decoded is None:
+            while self.is_running and steps < max_steps:
+                pc = self.program_counter
+                if pc >= len(self.program):
+                    self.execute_step()
+                    break
+                if checks and self._break_here():
+                    break
+                start = clock()
+                executed = self.execute_step()
+                times[pc] += clock() - start
+                counts[pc] += 1
+                if not executed:
+                    break
+                steps += 1
+            return steps
+
+        line_num = None
+        try:
+            while steps < max_steps:
+                pc = self.program_counter
+                if pc >= len(decoded):
+                    self.is_running = False
+                    self.output_history.append("程序执行完毕")
+                    break
+                if checks and self._break_here():
+                    break
+                handler, value, line_num = decoded[pc]
+                self.coverage[pc] = 1
+                start = clock()
+                result = handler(value, line_num)
+                times[pc] += clock() - start
+                counts[pc] += 1
+                if result is False:
+                    break
+                self.program_counter += 1
+                steps += 1
+        except Exception as e:
+            self.output_history.append(f"行{line_num}: 执行错误: {str(e)}")
+            self.is_running = False
+        return steps
+
+    # === 执行历史（单步后退） ===
+    # 每步执行前记录 (程序计数器, 累加器, 文本累加器, 运行状态, 改写类型, 槽号, 旧值)，
+    # 改写类型 0 表示不改写内存，1 为数字槽，2 为文本槽，3、4 为数字槽和文本槽区间
+    # （槽号为(起点, 终点)，旧值为整段切片）；检查点保存完整状态。
+
+    def _compute_write_targets(self):
+        """每条指令会改写的内存槽：[(改写类型, 槽号), ...]"""
+        slots = self.max_memory_slots
+        targets = []
+        program = self.program
+        for index in range(len(program)):
+            instruction = program.instruction(index)
+            value, value_type = program.value(index), program.kind(index)
+            if instruction == '存储' and value_type == 'slot':
+                targets.append((1, value))
+            elif instruction in ('粘贴', '存储文本') and value_type == 'text_slot':
+                targets.append((2, value))
+            elif instruction == '拆分' and value_type == 'number' and -slots <= value < slots - 1:
+                targets.append((2, value))
+            elif instruction in ('区间填充', '区间反转', '区间排序') and value_type == 'slot_range':
+                targets.append((3, value))
+            elif instruction == '区间复制' and value_type == 'slot_range':
+                # 目标起点是执行时的累加器，记录时再确定区间，这里先记下长度
+                targets.append((5, value[1] - value[0] + 1))
+            elif instruction == '区间拼音' and value_type == 'text_slot_range':
+                targets.append((4, value))
+            else:
+                targets.append((0, 0))
+        self._write_targets = targets
+
+    def _snapshot(self):
+        """完整状态快照"""
+        return (list(self.memory), list(self.text_memory), self.accumulator,
+                self.text_accumulator, self.program_counter, self.is_running)
+
+    def _restore(self, snapshot):
+        """恢复完整状态快照"""
+        memory, text_memory, self.accumulator, self.text_accumulator, self.program_counter, self.is_running = snapshot
+        self.memory[:] = memory
+        self.text_memory[:] = text_memory
+
+    def _record_step(self):
+        """执行一条指令前记录撤销信息"""
+        history = self.history
+        if self._write_targets is None:
+            self._compute_write_targets()
+        if history.step % history.interval == 0:
+            history.checkpoints[history.step] = self._snapshot()
+        pc = self.program_counter
+        kind, slot = self._write_targets[pc]
+        if kind == 1:
+            old = self.memory[slot]
+        elif kind == 2:
+            old = self.text_memory[slot]
+        elif kind == 5:
+            target, count = self.accumulator, slot
+            if 0 <= target <= self.max_memory_slots - count:
+                kind, slot = 3, (target, target + count - 1)
+                old = self.memory[target:target + count]
+            else:
+                kind, slot, old = 0, 0, None  # 目标越界，执行时报错，不改写内存
+        elif kind == 3:
+            old = self.memory[slot[0]:slot[1] + 1]
+        elif kind == 4:
+            old = self.text_memory[slot[0]:slot[1] + 1]
+        else:
+            old = None
+        history.deltas.append((pc, self.accumulator, self.text_accumulator, self.is_running, kind, slot, old))
+        if len(history.deltas) > history.limit:
+            history.trim()
+
+    def step(self):
+        """单步执行（开启记录时先保存撤销信息），返回是否继续运行"""
+        if self.recording and self.is_running and self.program_counter < len(self.program):
+            self._record_step()
+        return self.execute_step()
+
+    def _run_recorded(self, engine, max_steps):
+        """记录执行历史的同时运行，返回执行的步数（编译引擎没有逐条边界，改用快速路径）"""
+        decoded = self._decoded if engine != 'reference' else None
+        checks = self._break_checks
+        steps = 0
+        if decoded is None:
+            while self.is_running and steps < max_steps:
+                if checks and self._break_here():
+                    break
+                if not self.step():
+                    break
+                steps += 1
+            return steps
+
+        covered = self.coverage
+        line_num = None
+        try:
+            while steps < max_steps:
+                pc = self.program_counter
+                if pc >= len(decoded):
+                    self.is_running = False
+                    self.output_history.append("程序执行完毕")
+                    break
+                if checks and self._break_here():
+                    break
+                handler, value, line_num = decoded[pc]
+                self._record_step()
+                covered[pc] = 1
+                if handler(value, line_num) is False:
+                    break
+                self.program_counter += 1
+                steps += 1
+        except Exception as e:
+            self.output_history.append(f"行{line_num}: 执行错误: {str(e)}")
+            self.is_running = False
+        return steps
+
+    def step_back(self):
+        """撤销最近一步，返回是否成功"""
+        history = self.history
+        if not history.deltas:
+            return False
+        pc, self.accumulator, self.text_accumulator, self.is_running, kind, slot, old = history.deltas.pop()
+        self.program_counter = pc
+        if kind == 1:
+            self.memory[slot] = old
+        elif kind == 2:
+            self.text_memory[slot] = old
+        elif kind == 3:
+            self.memory[slot[0]:slot[1] + 1] = old
+        elif kind == 4:
+            self.text_memory[slot[0]:slot[1] + 1] = old
+        return True
+
+    def goto_step(self, target):
+        """跳到第 target 步执行前的状态，返回实际到达的步号
+        （向后跳时逐步撤销或从最近的检查点重新执行，取较短的一种，最多执行 interval 步）"""
+        history = self.history
+        target = max(target, history.base)
+        if target < history.step:
+            checkpoint = max(s for s in history.checkpoints if s <= target)
+            if history.step - target <= target - checkpoint:
+                while history.step > target:
+                    self.step_back()
+                return history.step
+            self._restore(history.checkpoints[checkpoint])
+            history.truncate(checkpoint)
+
+        # 向前执行（重新执行时不重复输出）
+        output = self.output_history
+        self.output_history = []
+        recording = self.recording
+        self.recording = True
+        while history.step < target and self.is_running:
+            if self.program_counter >= len(self.program):
+                self.is_running = False
                 break
-            steps += 1
-            
+            self.step()
+        self.recording = recording
+        self.output_history = output
+        return history.step
+
+    # === 编译执行路径 ===
+    # 程序在跳转目标处切分为基本块，每个块生成一个Python函数，累加器用局部变量保存；
+    # 块函数返回(下一条指令, 累加器, 文本累加器, 已执行步数, 停止原因)，由 _run_compiled 串联。
+
+    def _block_leaders(self):
+        """基本块起点：程序开头、断点、静态跳转目标、跳转和停机之后的指令"""
+        leaders = {0} | set(self._break_checks or ())
+        for index, (handler, value, line_num) in enumerate(self._decoded):
+            name = handler.__name__
+            if name == '_fast_jump':
+                leaders.add(value)
+            if name in ('_fast_jump', '_fast_jump_slot', '_fast_halt'):
+                leaders.add(index + 1)
+        return leaders
+
+    def _compile_block(self, start):
+        """把从start开始的基本块编译为函数，返回(函数, 最多执行的指令数)"""
+        if not self._blocks:
+            self._leaders = self._block_leaders()
+            self._leader_breaks = frozenset(self._break_checks or ())
+        decoded = self._decoded
+        hp = self.hanzi_processor
+        namespace = {
+            'concatenate': hp.concatenate, 'split': hp.split, 'duplicate': hp.duplicate,
+            'get_meaning': hp.get_meaning, 'get_pinyin': hp.get_pinyin, 'get_dialog': hp.get_dialog,
+            'get_pos': hp.get_pos, 'get_category': hp.get_category, 'get_rhyme': hp.get_rhyme,
+            'get_successor': hp.get_successor,
+            'structure_position_fit': hp.structure_position_fit,
+            'semantic_position_fit': hp.semantic_position_fit,
+            'compile_replacements': hp.compile_replacements,
+            'load_replacement_file': hp.load_replacement_file,
+            'copy_slots': copy_slots,
+        }
+        source = ["def block(mem, tmem, acc, tacc):", "    try:"]
+        line_map = {}
+        index = start
+        ended = False
+
+        def emit(*code):
+            for text in code:
+                source.append("        " + text)
+                line_map[len(source)] = index
+
+        # 其他引擎每步都把累加器格式化进执行轨迹，超过整数转字符串的位数上限时报执行错误；
+        # 编译代码不输出轨迹，在可能让累加器变大的指令后显式检查（超过上限时 str 抛出同样的异常）
+        max_digits = getattr(sys, 'get_int_max_str_digits', lambda: 0)()
+
+        def check_acc():
+            if max_digits:
+                emit(f"if acc.bit_length() > {max_digits * 3}:", "    str(acc)")
+
+        while index < len(decoded) and not ended and index - start < MAX_BLOCK_SIZE:
+            if index != start and index in self._leaders:
+                break
+            handler, value, line_num = decoded[index]
+            name = handler.__name__
+            done = index - start  # 本条指令之前已执行的步数
+            exit_to = f"return ({index}, acc, tacc, {done}, "
+
+            if name == '_fast_add_slot':
+                emit(f"acc += mem[{value}]")
+                check_acc()
+            elif name == '_fast_add_number':
+                emit(f"acc += {value!r}")
+                check_acc()
+            elif name == '_fast_sub_slot':
+                emit(f"acc -= mem[{value}]")
+                check_acc()
+            elif name == '_fast_sub_number':
+                emit(f"acc -= {value!r}")
+                check_acc()
+            elif name == '_fast_mul_slot':
+                emit(f"acc *= mem[{value}]")
+                check_acc()
+            elif name == '_fast_mul_number':
+                emit(f"acc *= {value!r}")
+                check_acc()
+            elif name == '_fast_div_slot':
+                emit(f"if mem[{value}] == 0:", f"    {exit_to}'div_zero')", f"acc //= mem[{value}]")
+            elif name == '_fast_div_number':
+                if value == 0:
+                    emit(f"{exit_to}'div_zero')")
+                    ended = True
+                else:
+                    emit(f"acc //= {value!r}")
+            elif name == '_fast_store':
+                emit(f"mem[{value}] = acc")
+            elif name == '_fast_load':
+                emit(f"acc = mem[{value}]")
+                check_acc()
+            elif name == '_fast_jump':
+                emit(f"return ({value}, acc, tacc, {done + 1}, None)")
+                ended = True
+            elif name == '_fast_jump_slot':
+                emit(f"if 0 <= mem[{value}] < {len(decoded)}:",
+                     f"    return (mem[{value}], acc, tacc, {done + 1}, None)",
+                     f"{exit_to}'bad_jump')")
+                ended = True
+            elif name == '_fast_halt':
+                emit(f"{exit_to}'halt')")
+                ended = True
+            elif name == '_fast_concat':
+                emit(f"tacc = concatenate(tacc, {value!r})")
+            elif name == '_fast_concat_slot':
+                emit(f"tacc = concatenate(tacc, tmem[{value}])")
+            elif name == '_fast_split':
+                emit(f"parts = split(tacc, {value!r})", "tacc = parts[0]")
+                if value < self.max_memory_slots - 1:
+                    emit(f"tmem[{value}] = parts[1]")
+            elif name == '_fast_decorate':
+                emit(f"tacc = '【' + tacc + '】的' + {value!r}")
+            elif name == '_fast_duplicate':
+                emit(f"tacc = duplicate(tacc, {value!r})")
+            elif name in ('_fast_paste', '_fast_store_text'):
+                emit(f"tmem[{value}] = tacc")
+            elif name == '_fast_load_text':
+                emit(f"tacc = tmem[{value}]")
+            elif name in ('_fast_meaning', '_fast_pinyin', '_fast_dialog', '_fast_pos',
+                          '_fast_category', '_fast_rhyme'):
+                function = {'_fast_meaning': 'get_meaning', '_fast_pinyin': 'get_pinyin',
+                            '_fast_dialog': 'get_dialog', '_fast_pos': 'get_pos',
+                            '_fast_category': 'get_category', '_fast_rhyme': 'get_rhyme'}[name]
+                emit("if tacc:", f"    tacc = {function}(tacc)")
+            elif name == '_fast_successor':
+                emit("if tacc:", "    found = get_successor(tacc)",
+                     "    tacc = '、'.join(found[:5]) if found else '无'")
+            elif name == '_fast_structure_fit':
+                emit("if tacc:", f"    tacc = structure_position_fit(tacc, {value!r})")
+            elif name == '_fast_semantic_fit':
+                emit("if tacc:", f"    tacc = semantic_position_fit(tacc, {value!r})")
+            elif name == '_fast_replace_slot':
+                emit(f"tacc = compile_replacements(tmem[{value}]).sub(tacc)")
+            elif name == '_fast_replace_file':
+                emit(f"tacc = load_replacement_file({value!r}).sub(tacc)")
+            elif name == '_fast_range_sum':
+                emit(f"acc = sum(mem[{value[0]}:{value[1] + 1}])")
+                check_acc()
+            elif name == '_fast_range_fill':
+                emit(f"mem[{value[0]}:{value[1] + 1}] = [acc] * {value[1] - value[0] + 1}")
+            elif name == '_fast_range_copy':
+                emit(f"copy_slots(mem, {value[0]}, {value[1]}, acc)")
+            elif name == '_fast_range_reverse':
+                emit(f"mem[{value[0]}:{value[1] + 1}] = mem[{value[0]}:{value[1] + 1}][::-1]")
+            elif name == '_fast_range_sort':
+                emit(f"mem[{value[0]}:{value[1] + 1}] = sorted(mem[{value[0]}:{value[1] + 1}])")
+            elif name == '_fast_range_join':
+                emit(f"tacc = concatenate(tacc, ''.join(tmem[{value[0]}:{value[1] + 1}]))")
+            elif name == '_fast_range_pinyin':
+                emit(f"tmem[{value[0]}:{value[1] + 1}] = [get_pinyin(text) if text else text "
+                     f"for text in tmem[{value[0]}:{value[1] + 1}]]")
+            else:
+                raise ValueError(f"无法编译的指令处理方法: {name}")
+            index += 1
+
+        length = index - start
+        if not ended:
+            source.append(f"        return ({index}, acc, tacc, {length}, None)")
+        source += [
+            "    except Exception as error:",
+            "        at = LINE_MAP[error.__traceback__.tb_lineno]",
+            f"        return (at, acc, tacc, at - {start}, error)",
+        ]
+        namespace['LINE_MAP'] = line_map
+        exec(compile("\n".join(source), f"<卡片程序块 {start}>", "exec"), namespace)
+        block = (namespace['block'], length)
+        self._blocks[start] = block
+        return block
+
+    def _run_compiled(self, max_steps):
+        """用编译后的基本块运行程序，返回执行的步数（不记录逐条执行轨迹）"""
+        decoded = self._decoded
+        blocks = self._blocks
+        mem, tmem = self.memory, self.text_memory
+        acc, tacc = self.accumulator, self.text_accumulator
+        pc = self.program_counter
+        steps = 0
+        status = None
+
+        covered = self.coverage
+        checks = self._break_checks
+        while pc < len(decoded):
+            # 断点都是基本块起点，只需在进入块时检查
+            if checks and pc in checks:
+                self.accumulator, self.text_accumulator = acc, tacc
+                if checks[pc](self):
+                    self.break_hit = self.program.lines[pc]
+                    break
+            function, length = blocks.get(pc) or self._compile_block(pc)
+            if steps + length > max_steps:
+                break
+            start = pc
+            pc, acc, tacc, count, status = function(mem, tmem, acc, tacc)
+            steps += count
+            # 基本块是直线代码，执行过的指令是从块起点开始的连续一段
+            covered[start:start + count] = b'\x01' * count
+            if status is not None:
+                covered[pc] = 1
+                break
+
+        self.accumulator, self.text_accumulator, self.program_counter = acc, tacc, pc
+        if status is not None:
+            line_num = self.program.lines[pc]
+            if status == 'halt':
+                self.output_history.append(f"行{line_num}: 程序停机")
+            elif status == 'div_zero':
+                self.output_history.append(f"行{line_num}: 错误: 除以零")
+            elif status == 'bad_jump':
+                self.output_history.append(f"行{line_num}: 错误: 跳转目标 {mem[decoded[pc][1]]} 无效")
+            else:
+                self.output_history.append(f"行{line_num}: 执行错误: {str(status)}")
+            self.is_running = False
+        elif pc >= len(decoded):
+            self.is_running = False
+            self.output_history.append("程序执行完毕")
+        elif steps < max_steps and self.break_hit is None:
+            # 剩余步数不够执行完整个块：用快速路径逐条执行余下的步数，只保留结束信息
+            history = self.output_history
+            self.output_history = []
+            steps += self._run_fast(max_steps - steps)
+            if not self.is_running and self.output_history:
+                history.append(self.output_history[-1])
+            self.output_history = history
+        return steps
+
+    # === 断点 ===
+
+    def set_breakpoint(self, line_num, condition=None):
+        """在源代码第 line_num 行设置断点（condition 为条件文本，无效时抛出 ValueError）"""
+        if condition:
+            compile_condition(condition, self.max_memory_slots)
+        self.breakpoints[line_num] = condition or None
+        self._break_checks = None
+
+    def clear_breakpoint(self, line_num):
+        """删除断点"""
+        self.breakpoints.pop(line_num, None)
+        self._break_checks = None
+
+    def clear_breakpoints(self):
+        """删除所有断点"""
+        self.breakpoints = {}
+        self._break_checks = None
+
+    def _prepare_breakpoints(self):
+        """把断点行号映射到程序序号，条件编译为判断函数，并在预解码程序中换上检查函数"""
+        checks = {}
+        for index, line_num in enumerate(self.program.lines):
+            if line_num in self.breakpoints:
+                condition = self.breakpoints[line_num]
+                checks[index] = compile_condition(condition, self.max_memory_slots) if condition else (lambda vm: True)
+        self._break_checks = checks
+        if frozenset(checks) != self._leader_breaks:
+            self._blocks = {}  # 断点位置变了，基本块的划分也要变
+        self._trapped = None
+        if checks and self._decoded is not None:
+            self._trapped = self._decoded.with_traps(checks, self._make_trap)
+
+    def _make_trap(self, handler):
+        """断点检查函数：当前指令处的断点条件成立时返回 False 停下（不执行该指令），否则照常执行"""
+        def trap(value, line_num):
+            if self._break_checks[self.program_counter](self):
+                self.break_hit = line_num
+                return False
+            return handler(value, line_num)
+        trap.__name__ = handler.__name__
+        return trap
+
+    def _break_here(self):
+        """当前指令处的断点是否触发（逐条执行的路径使用）"""
+        predicate = self._break_checks.get(self.program_counter)
+        if predicate is not None and predicate(self):
+            self.break_hit = self.program.lines[self.program_counter]
+            return True
+        return False
+
+    def run_program(self, engine=None, max_steps=1000, resume=False):
+        """运行整个程序（engine 为 ENGINES 之一，默认使用 self.engine；max_steps 防止无限循环）
+        遇到断点时停在断点指令之前，break_hit 为断点行号；resume 为 True 时先越过当前所在的断点"""
+        self.is_running = True
+        steps = self.run_burst(max_steps, engine, resume)
+        self.steps_executed = steps
         if steps >= max_steps:
             self.output_history.append("警告: 程序可能陷入无限循环，已停止")
             
+    def run_burst(self, max_steps, engine=None, resume=False):
+        """从当前状态连续执行最多 max_steps 步，返回执行的步数
+        （不设置运行状态、不输出死循环警告，动画运行按帧分批调用）"""
+        engine = engine or self.engine
+        self.break_hit = None
+        if self._break_checks is None:
+            self._prepare_breakpoints()
+        steps = 0
+        
+        if resume and self.program_counter in self._break_checks:
+            if self.step():
+                steps = 1
+        
+        if not self.is_running:
+            pass
+        elif self.profiling:
+            steps += self._run_profiled(engine, max_steps - steps)
+        elif self.recording:
+            steps += self._run_recorded(engine, max_steps - steps)
+        elif engine == 'compiled' and self._decoded is not None:
+            steps += self._run_compiled(max_steps - steps)
+        elif engine != 'reference' and self._decoded is not None:
+            steps += self._run_fast(max_steps - steps)
+        else:
+            checks = self._break_checks
+            while self.is_running and steps < max_steps:
+                if checks and self._break_here():
+                    break
+                if not self.execute_step():
+                    break
+                steps += 1
+        return steps
+            
+    def run_batch(self, inputs, engine=None, max_steps=1000, source='program'):
+        """用多组初始内存运行已加载的程序，合并覆盖位图，返回CoverageReport
+        （inputs 中每项为 {'memory': {槽: 值}, 'text_memory': {文槽: 文本}}，
+        运行前先检查全部输入，槽号越界或值的类型不对时抛出 ValueError）"""
+        cases = [self.check_batch_input(number, case) for number, case in enumerate(inputs, 1)]
+        report = CoverageReport(self.program, source)
+        for memory, text_memory in cases:
+            self.memory = [0] * self.max_memory_slots
+            self.text_memory = [""] * self.max_memory_slots
+            for slot, value in memory.items():
+                self.memory[slot] = value
+            for slot, text in text_memory.items():
+                self.text_memory[slot] = text
+            self.accumulator = 0
+            self.text_accumulator = ""
+            self.program_counter = 0
+            self.output_history = []
+            self.coverage = bytearray(len(self.program))
+            self.run_program(engine, max_steps)
+            report.add(self.coverage)
+            report.results.append({
+                'accumulator': self.accumulator,
+                'text_accumulator': self.text_accumulator,
+                'steps': self.steps_executed,
+                'finished': not self.is_running,
+                'last_output': self.output_history[-1] if self.output_history else '',
+            })
+        return report
+
+    def check_batch_input(self, number, case):
+        """检查 run_batch 的第 number 组输入，返回({槽: 整数}, {文槽: 文本})，无效时抛出 ValueError"""
+        if not isinstance(case, dict):
+            raise ValueError(f"第{number}组输入应为对象")
+        tables = []
+        for field, name, kind in (('memory', '存储槽', int), ('text_memory', '文本存储槽', str)):
+            items = case.get(field, {})
+            if not isinstance(items, dict):
+                raise ValueError(f"第{number}组输入: {field} 应为对象")
+            table = {}
+            for key, value in items.items():
+                try:
+                    slot = int(key)
+                except (TypeError, ValueError):
+                    raise ValueError(f"第{number}组输入: 无效的{name}编号 '{key}'") from None
+                if not 0 <= slot < self.max_memory_slots:
+                    raise ValueError(f"第{number}组输入: {name} {slot} 超出范围")
+                if not isinstance(value, kind) or isinstance(value, bool):
+                    raise ValueError(f"第{number}组输入: {name} {slot} 的值 {value!r} 应为"
+                                     + ('整数' if kind is int else '文本'))
+                table[slot] = value
+            tables.append(table)
+        return tuple(tables)
+
+    # === 逐条增量 ===
+    # iter_steps 每执行一条指令产出 (程序计数器, 操作码, 改写类型, 槽号, 旧值, 新值)，
+    # 使用方按需拉取（可配合 itertools.islice 等），执行期间不累积逐条输出。
+
+    def _compute_step_targets(self):
+        """每条指令改写的位置：[(DELTA_* 类型, 槽号), ...]（区间复制为(5, 长度)，执行时按累加器确定）"""
+        if self._write_targets is None:
+            self._compute_write_targets()
+        targets = []
+        for opcode, (kind, slot) in zip(self.program.opcodes, self._write_targets):
+            instruction = INSTRUCTION_NAMES[opcode]
+            if instruction == '拆分':
+                targets.append((DELTA_SPLIT, slot) if kind == 2 else (DELTA_TEXT_ACC, None))
+            elif kind:
+                targets.append((kind, slot))
+            elif instruction in ACC_INSTRUCTIONS:
+                targets.append((DELTA_ACC, None))
+            elif instruction in TEXT_ACC_INSTRUCTIONS:
+                targets.append((DELTA_TEXT_ACC, None))
+            else:
+                targets.append((DELTA_NONE, None))
+        self._step_targets = targets
+
+    def _read_target(self, kind, slot):
+        """读取改写位置的当前值（区间返回元组，不随之后的执行改变）"""
+        if kind == DELTA_ACC:
+            return self.accumulator
+        if kind == DELTA_TEXT_ACC:
+            return self.text_accumulator
+        if kind == DELTA_SLOT:
+            return self.memory[slot]
+        if kind == DELTA_TEXT_SLOT:
+            return self.text_memory[slot]
+        if kind == DELTA_SLOT_RANGE:
+            return tuple(self.memory[slot[0]:slot[1] + 1])
+        if kind == DELTA_TEXT_RANGE:
+            return tuple(self.text_memory[slot[0]:slot[1] + 1])
+        if kind == DELTA_SPLIT:
+            return (self.text_accumulator, self.text_memory[slot])
+        return None
+
+    def iter_steps(self, max_steps=None, engine=None):
+        """从当前程序计数器开始运行的生成器，每执行完一条指令产出一个增量
+        (程序计数器, 操作码, 改写类型, 槽号, 旧值, 新值)，改写类型为 DELTA_* 之一。
+        逐条输出不写入 output_history，停止时只追加结束信息；不检查断点，不输出死循环警告。
+        通过校验的程序用快速路径的处理方法执行（compiled 没有逐条边界，同样如此），
+        否则或 engine 为 reference 时用 execute_step。max_steps 为 None 表示不限步数"""
+        engine = engine or self.engine
+        decoded = self._decoded if engine != 'reference' else None
+        if self._step_targets is None:
+            self._compute_step_targets()
+        targets = self._step_targets
+        opcodes = self.program.opcodes
+        sink = []  # 执行期间的输出去处，每步清空
+        self.is_running = True
+        self.steps_executed = steps = 0
+        while max_steps is None or steps < max_steps:
+            pc = self.program_counter
+            if pc >= len(opcodes):
+                self.is_running = False
+                self.output_history.append("程序执行完毕")
+                break
+            kind, slot = targets[pc]
+            if kind == 5:
+                target, count = self.accumulator, slot
+                if 0 <= target <= self.max_memory_slots - count:
+                    kind, slot = DELTA_SLOT_RANGE, (target, target + count - 1)
+                else:
+                    kind, slot = DELTA_NONE, None  # 目标越界，执行时报错
+            old = self._read_target(kind, slot)
+
+            history, self.output_history = self.output_history, sink
+            line_num = None
+            try:
+                if decoded is None:
+                    running = self.execute_step()
+                else:
+                    handler, value, line_num = decoded[pc]
+                    self.coverage[pc] = 1
+                    running = handler(value, line_num) is not False
+                    if running:
+                        self.program_counter += 1
+            except Exception as e:
+                sink.append(f"行{line_num}: 执行错误: {str(e)}")
+                self.is_running = running = False
+            finally:
+                self.output_history = history
+            if not running:
+                if sink:
+                    history.append(sink[-1])
+                break
+            sink.clear()
+            steps += 1
+            self.steps_executed = steps
+            yield (pc, opcodes[pc], kind, slot, old, self._read_target(kind, slot))
+
     def get_program_status(self):
         """获取程序状态"""
         if not self.program:
             return "无程序加载"
             
-        if self.program_counter < len(self.program):
-            current = self.program[self.program_counter]
-            return f"行 {current['line']}: {current['instruction']} {current['operand'] or ''}"
+        program = self.program
+        pc = self.program_counter
+        if pc < len(program):
+            return f"行 {program.lines[pc]}: {program.instruction(pc)} {program.operand(pc) or ''}"
         else:
             return "程序结束"
 
 
+# run_async 每次让出事件循环之前执行的步数
+ASYNC_STEP_SLICE = 200
+
+
+async def run_async(vm, step_slice=ASYNC_STEP_SLICE, max_steps=1000, engine=None, resume=False):
+    """在 asyncio 事件循环中运行程序，每执行 step_slice 步 await asyncio.sleep(0) 让出一次，
+    同一事件循环上的多个虚拟机按批轮流执行；参数和结束状态与 run_program 相同，max_steps 为 None 表示不限步数。
+    取消只会发生在两批之间，此时虚拟机停在完整的指令边界上，保持运行状态并追加一条取消信息，
+    之后可以用 resume=True 再次调用从原处继续；返回执行的步数。同一虚拟机不能同时运行多个协程"""
+    if step_slice < 1:
+        raise ValueError(f"每批步数必须至少为 1: {step_slice}")
+    vm.is_running = True
+    steps = 0
+    try:
+        while vm.is_running and (max_steps is None or steps < max_steps):
+            burst = step_slice if max_steps is None else min(step_slice, max_steps - steps)
+            count = vm.run_burst(burst, engine, resume and steps == 0)
+            steps += count
+            vm.steps_executed = steps
+            if vm.break_hit is not None or count < burst:
+                break  # 停在断点、停机或出错
+            await asyncio.sleep(0)
+    except asyncio.CancelledError:
+        vm.output_history.append(f"程序已取消: 执行了 {steps} 步，停在{vm.get_program_status()}")
+        raise
+    if max_steps is not None and steps >= max_steps:
+        vm.output_history.append("警告: 程序可能陷入无限循环，已停止")
+    return steps
+
+
+# 动画运行的速度档位：每帧执行的步数，None 表示不限速（每批步数自动调整为约一帧的执行时间）
+ANIMATION_SPEEDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, None)
+
+# 动画运行每帧最多转交给界面的输出条数（更早的输出只计数）
+ANIMATION_OUTPUT_TAIL = 200
+
+
+class AnimationWorker(QObject):
+    """动画运行：在工作线程中按帧分批执行虚拟机，界面只取最新的一帧状态"""
+    frame_ready = pyqtSignal()
+    finished = pyqtSignal()
+
+    def __init__(self, vm, engine, fps=25, steps_per_frame=1, resume=False, spill=None):
+        super(AnimationWorker, self).__init__()
+        self.vm = vm
+        self.spill = spill  # 接收每批完整输出的函数（写日志文件），界面只显示末尾部分
+        self.engine = engine
+        self.fps = fps
+        self.steps_per_frame = steps_per_frame
+        self.resume = resume
+        self.total_steps = 0
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._frame = None
+
+    def stop(self):
+        """请求停止（当前一批执行完后生效）"""
+        self._stopped = True
+
+    def take_frame(self):
+        """取出最新一帧（界面线程调用），没有新帧时返回 None"""
+        with self._lock:
+            frame, self._frame = self._frame, None
+        return frame
+
+    def publish(self):
+        """把虚拟机当前状态复制为一帧；界面还没取走的旧帧直接被替换，只合并其输出"""
+        vm = self.vm
+        output, vm.output_history = vm.output_history, []
+        if self.spill is not None and output:
+            self.spill(output)
+        frame = {
+            'accumulator': vm.accumulator,
+            'text_accumulator': vm.text_accumulator,
+            'program_counter': vm.program_counter,
+            'status': vm.get_program_status(),
+            'memory': list(vm.memory),
+            'text_memory': list(vm.text_memory),
+            'is_running': vm.is_running,
+            'steps': self.total_steps,
+            'output': output[-ANIMATION_OUTPUT_TAIL:],
+            'skipped': max(len(output) - ANIMATION_OUTPUT_TAIL, 0),
+        }
+        with self._lock:
+            previous = self._frame
+            if previous is not None:
+                merged = previous['output'] + frame['output']
+                frame['skipped'] += previous['skipped'] + max(len(merged) - ANIMATION_OUTPUT_TAIL, 0)
+                frame['output'] = merged[-ANIMATION_OUTPUT_TAIL:]
+            self._frame = frame
+        if previous is None:
+            self.frame_ready.emit()
+
+    def run(self):
+        """按帧循环：每帧执行一批指令并提交一次状态"""
+        vm = self.vm
+        interval = 1.0 / self.fps
+        burst = 100
+        resume = self.resume
+        while not self._stopped:
+            start = time.perf_counter()
+            steps_per_frame = self.steps_per_frame
+            executed = vm.run_burst(steps_per_frame or burst, self.engine, resume)
+            resume = False
+            self.total_steps += executed
+            elapsed = time.perf_counter() - start
+            if steps_per_frame is None:
+                # 不限速：按实测速度调整下一批的步数，使一批约占一帧
+                if elapsed > 0:
+                    burst = max(1, min(int(burst * interval / elapsed), burst * 4))
+                else:
+                    burst *= 4
+            self.publish()
+            if not vm.is_running or vm.break_hit is not None:
+                break
+            if steps_per_frame is not None and elapsed < interval:
+                time.sleep(interval - elapsed)
+        self.finished.emit()
+
+
+class FileWorker(QObject):
+    """在工作线程中分块打开或保存程序文件，界面线程按块插入文本并显示进度"""
+    chunk_ready = pyqtSignal(str)
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(str)  # 错误信息，成功时为空字符串
+
+    def __init__(self, filename, text=None):
+        super(FileWorker, self).__init__()
+        self.filename = filename
+        self.text = text  # 要保存的文本；None 表示打开文件
+
+    def run(self):
+        error = ''
+        try:
+            if self.text is None:
+                for chunk, fraction in read_text_chunks(self.filename):
+                    self.chunk_ready.emit(chunk)
+                    self.progress.emit(int(fraction * 100))
+            else:
+                write_text_atomic(self.filename, self.text,
+                                  progress=lambda fraction: self.progress.emit(int(fraction * 100)))
+        except (OSError, UnicodeDecodeError) as e:
+            error = str(e)
+        self.finished.emit(error)
+
+
+# 输出窗口最多保留的行数（更早的行自动丢弃，完整内容可另存到日志文件）
+OUTPUT_MAX_BLOCKS = 5000
+
+
+class OutputConsole(QPlainTextEdit):
+    """程序输出窗口：纯文本、行数有上限，每次刷新一次性插入，可把完整输出同时写入日志文件"""
+
+    def __init__(self, parent=None):
+        super(OutputConsole, self).__init__(parent)
+        self.setReadOnly(True)
+        self.setMaximumBlockCount(OUTPUT_MAX_BLOCKS)
+        self.log_file = None
+        self._log_lock = threading.Lock()
+
+    def write(self, messages, log=True):
+        """一次性追加多行；超出上限的部分只写入日志文件（log 为 False 表示已写过日志）"""
+        if not messages:
+            return
+        if log:
+            self.spill(messages)
+        if len(messages) > OUTPUT_MAX_BLOCKS:
+            skipped = len(messages) - OUTPUT_MAX_BLOCKS + 1
+            messages = [f"…（省略 {skipped} 条输出）"] + list(messages[-OUTPUT_MAX_BLOCKS + 1:])
+        self.appendPlainText('\n'.join(messages))
+        self.moveCursor(QTextCursor.End)
+
+    def append(self, message):
+        """追加一行"""
+        self.write([message])
+
+    def spill(self, messages):
+        """把输出写入日志文件（可在工作线程中调用）"""
+        with self._log_lock:
+            if self.log_file is not None:
+                self.log_file.write('\n'.join(messages) + '\n')
+
+    def set_log_file(self, filename):
+        """开始（filename 为文件名）或停止（None）把完整输出写入日志文件"""
+        with self._log_lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+            if filename:
+                self.log_file = open(filename, 'a', encoding='utf-8')
+
+
+def heat_color(fraction):
+    """热度颜色：0为白色，1为红色"""
+    fade = int(255 - 175 * max(0.0, min(fraction, 1.0)))
+    return QColor(255, fade, fade)
+
+
+# 代码编辑器中一行的记号：第一个为指令，第二个为操作数，其余忽略
+CODE_TOKEN = re.compile(r'\S+')
+
+# 逐行校验的延迟（毫秒）：停止输入后才检查刚编辑过的行
+VALIDATION_DELAY = 250
+
+
+def text_format(color, bold=False):
+    """生成高亮用的文字格式"""
+    fmt = QTextCharFormat()
+    fmt.setForeground(QColor(color))
+    if bold:
+        fmt.setFontWeight(QFont.Bold)
+    return fmt
+
+
+class CodeHighlighter(QSyntaxHighlighter):
+    """代码高亮：着色指令、槽、数字和注释，并按 load_program 的规则给错误行加波浪线
+    
+    Qt 只对编辑过的行调用 highlightBlock；校验结果按行文本缓存，
+    新出现的行先只着色，停止输入 VALIDATION_DELAY 毫秒后再检查并补画波浪线。
+    跳转目标是否越界取决于整个程序，仍在加载时检查。"""
+    
+    def __init__(self, document, vm):
+        super(CodeHighlighter, self).__init__(document)
+        self.vm = vm
+        self.errors = {}     # 行文本 -> 错误信息（None 表示无误）
+        self.pending = []    # 等待校验的文本块
+        self.formats = {
+            'instruction': text_format('#0050a0', bold=True),
+            'slot': text_format('#8a2be2'),
+            'number': text_format('#b05000'),
+            'text': text_format('#107010'),
+            'comment': text_format('#909090'),
+        }
+        self.validate_timer = QTimer(self)
+        self.validate_timer.setSingleShot(True)
+        self.validate_timer.setInterval(VALIDATION_DELAY)
+        self.validate_timer.timeout.connect(self.validate_pending)
+        
+    def highlightBlock(self, text):
+        key = text.strip()
+        if key.startswith('#'):
+            self.setFormat(0, len(text), self.formats['comment'])
+            return
+        tokens = list(CODE_TOKEN.finditer(text))
+        
+        # 已校验过的行带上波浪线；没校验过的先排队
+        error = self.errors.get(key)
+        if key and key not in self.errors:
+            self.pending.append(self.currentBlock())
+            self.validate_timer.start()
+        
+        for position, match in enumerate(tokens[:2]):
+            fmt = self.formats[self.token_kind(position, match.group())]
+            if error and position == self.error_token(tokens):
+                fmt = QTextCharFormat(fmt)
+                fmt.setUnderlineStyle(QTextCharFormat.SpellCheckUnderline)
+                fmt.setUnderlineColor(QColor(220, 0, 0))
+                fmt.setToolTip(error)
+            self.setFormat(match.start(), match.end() - match.start(), fmt)
+        # 操作数之后的内容不参与执行，从第一个以#开头的记号起按注释着色
+        for match in tokens[2:]:
+            if match.group().startswith('#'):
+                self.setFormat(match.start(), len(text) - match.start(), self.formats['comment'])
+                break
+            
+    def token_kind(self, position, token):
+        """记号的着色类别"""
+        if position == 0:
+            return 'instruction' if token in INSTRUCTION_OPERANDS else 'text'
+        if token.startswith('槽') or token.startswith('文槽'):
+            return 'slot'
+        if token.lstrip('-').isdigit():
+            return 'number'
+        return 'text'
+        
+    def error_token(self, tokens):
+        """错误标在哪个记号上：指令无效或缺少操作数时标指令，否则标操作数"""
+        if tokens[0].group() not in INSTRUCTION_OPERANDS or len(tokens) < 2:
+            return 0
+        return 1
+        
+    def validate_pending(self):
+        """校验排队的行（只检查新出现的行文本），有错误的行重新着色"""
+        pending, self.pending = self.pending, []
+        if len(self.errors) > 50000:
+            self.errors.clear()  # 防止缓存无限增长，清空后按需重建
+        for block in pending:
+            if not block.isValid():
+                continue
+            key = block.text().strip()
+            if key in self.errors:
+                continue
+            error = self.vm.parse_line(key)[2]
+            self.errors[key] = error
+            if error:
+                self.rehighlightBlock(block)
+                
+    def line_error(self, block):
+        """某行已知的错误信息（尚未校验或无误时为None）"""
+        return self.errors.get(block.text().strip())
+
+
+# 卡片帮助标签的文本（预先生成，切换指令时只需查表）
+CARD_HELP_LABELS = {name: f" ({text})" for name, text in INSTRUCTION_HELP.items()}
+
+_instruction_model = None
+
+
+def instruction_model():
+    """所有卡片下拉框共用的指令列表模型（分组标题加指令名，首次使用时创建）"""
+    global _instruction_model
+    if _instruction_model is None:
+        items = []
+        for group, names in INSTRUCTION_GROUPS:
+            items.append(f"-- {group} --")
+            items.extend(names)
+        _instruction_model = QStringListModel(items)
+    return _instruction_model
+
+
 class CardWidget(QWidget):
-    """单个卡片部件"""
+    """卡片编辑部件：只为卡片列表中当前选中的那一行创建"""
+    
+    edited = pyqtSignal()
     
-    def __init__(self, card_num, parent=None):
+    def __init__(self, parent=None):
         super(CardWidget, self).__init__(parent)
-        self.card_num = card_num
+        self.entry = None  # 最近一次 set_card 设置的 (指令, 操作数)，用户修改后清空
         self.setup_ui()
         
     def setup_ui(self):
         layout = QHBoxLayout()
-        layout.setContentsMargins(5, 2, 5, 2)
-        
-        # 卡片编号
-        self.number_label = QLabel(f"{self.card_num:03d}")
-        self.number_label.setFixedWidth(40)
-        self.number_label.setAlignment(Qt.AlignCenter)
-        self.number_label.setStyleSheet("QLabel { background-color: #e0e0e0; border: 1px solid #a0a0a0; }")
+        layout.setContentsMargins(5, 0, 5, 0)
         
-        # 指令选择
+        # 指令选择（所有卡片共用同一个指令列表模型）
         self.instruction_combo = QComboBox()
-        
-        # 分组添加指令
-        self.instruction_combo.addItem("-- 算术指令 --")
-        arithmetic_instructions = ['加', '减', '乘', '除', '存储', '读取', '跳转', '停机']
-        for inst in arithmetic_instructions:
-            self.instruction_combo.addItem(inst)
-            
-        self.instruction_combo.addItem("-- 汉字处理指令 --")
-        hanzi_instructions = [
-            '拼接', '拆分', '修饰', '复制', '粘贴', '取含义', '取拼音',
-            '取对话', '取词性', '取类别', '取前压', '后继', 
-            '取结构位置适配', '取语义位置适配', '存储文本', '读取文本'
-        ]
-        for inst in hanzi_instructions:
-            self.instruction_combo.addItem(inst)
-            
+        self.instruction_combo.setModel(instruction_model())
         self.instruction_combo.setFixedWidth(120)
         
         # 操作数输入
@@ -1122,69 +3799,276 @@ class CardWidget(QWidget):
         self.help_label = QLabel("")
         self.help_label.setStyleSheet("QLabel { color: #606060; font-size: 10pt; }")
         
-        layout.addWidget(self.number_label)
         layout.addWidget(self.instruction_combo)
         layout.addWidget(self.operand_input)
         layout.addWidget(self.help_label)
         layout.addStretch()
         
         self.setLayout(layout)
+        self.setAutoFillBackground(True)
         
         # 连接信号
         self.instruction_combo.currentTextChanged.connect(self.update_help_text)
+        self.instruction_combo.activated.connect(self.on_edited)
+        self.operand_input.textEdited.connect(self.on_edited)
+        
+    def on_edited(self, *args):
+        """用户直接修改了卡片，之后以部件中的内容为准"""
+        self.entry = None
+        self.edited.emit()
         
     def update_help_text(self, instruction):
         """更新帮助文本"""
-        help_texts = {
-            '加': '累加器 = 累加器 + 操作数',
-            '减': '累加器 = 累加器 - 操作数',
-            '乘': '累加器 = 累加器 × 操作数',
-            '除': '累加器 = 累加器 ÷ 操作数',
-            '存储': '槽X = 累加器',
-            '读取': '累加器 = 槽X',
-            '跳转': '跳转到第X行',
-            '停机': '停止程序',
-            '拼接': '文本累加器 = 文本累加器 + 文本',
-            '拆分': '在位置X拆分文本',
-            '复制': '复制文本X次',
-            '粘贴': '文本粘贴到文槽X',
-            '取含义': '获取文本含义',
-            '取拼音': '获取文本拼音',
-            '取词性': '获取文本词性',
-            '取类别': '获取文本类别',
-            '取前压': '获取文本押韵',
-            '后继': '获取后继汉字',
-            '存储文本': '存储文本到文槽X',
-            '读取文本': '从文槽X读取文本'
-        }
-        
-        if instruction in help_texts:
-            self.help_label.setText(f" ({help_texts[instruction]})")
-        else:
-            self.help_label.setText("")
+        self.help_label.setText(CARD_HELP_LABELS.get(instruction, ""))
             
-    def get_card_text(self):
-        """获取卡片文本表示"""
+    def get_entry(self):
+        """获取卡片内容 (指令, 操作数)，分组标题视为空卡片"""
+        if self.entry is not None:
+            # 未修改过：原样返回，保留下拉框中没有的指令
+            return self.entry
         instruction = self.instruction_combo.currentText()
-        operand = self.operand_input.text().strip()
-        
-        # 跳过分组标题
-        if '--' in instruction:
-            return ""
-            
-        if instruction == '停机':
-            return instruction
-        elif operand:
-            return f"{instruction} {operand}"
-        else:
-            return f"{instruction}"
+        if instruction not in INSTRUCTION_OPERANDS:
+            instruction = ""
+        return (instruction, self.operand_input.text().strip())
             
     def set_card(self, instruction, operand):
         """设置卡片内容"""
         index = self.instruction_combo.findText(instruction)
-        if index >= 0:
-            self.instruction_combo.setCurrentIndex(index)
+        self.instruction_combo.setCurrentIndex(max(index, 0))
         self.operand_input.setText(operand)
+        self.entry = (instruction, operand)
+
+
+# 卡片列表模型的自定义数据角色
+CARD_ROLE = Qt.UserRole         # (指令, 操作数)
+BREAK_ROLE = Qt.UserRole + 1    # 是否设了断点
+HEAT_ROLE = Qt.UserRole + 2     # 热度颜色（未分析时为None）
+
+# 卡片行高和左侧断点、编号区域的宽度（像素）
+CARD_ROW_HEIGHT = 30
+CARD_GUTTER_WIDTH = 66
+# 卡片上指令说明相对指令文本的缩进（下拉框和操作数输入框的宽度之和）
+CARD_HELP_OFFSET = 280
+
+
+def card_text(entry):
+    """卡片的代码文本（空卡片为空字符串）"""
+    instruction, operand = entry
+    if not instruction:
+        return ""
+    if instruction == '停机' or not operand:
+        return instruction
+    return f"{instruction} {operand}"
+
+
+class CardListModel(QAbstractListModel):
+    """卡片列表模型：每张卡片只是一条 (指令, 操作数) 记录，源代码行号、断点和热度按行另存"""
+    
+    def __init__(self, parent=None):
+        super(CardListModel, self).__init__(parent)
+        self.entries = []
+        self.lines = []   # 每张卡片在代码编辑器中的行号（还没写入编辑器的卡片为 None）
+        self.breaks = []  # 每行是否设了断点
+        self.heat = []    # 每行的 (热度颜色, 提示) 或 None
+        
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+        
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == CARD_ROLE:
+            return self.entries[row]
+        if role == Qt.DisplayRole:
+            return card_text(self.entries[row])
+        if role == BREAK_ROLE:
+            return self.breaks[row]
+        if role == HEAT_ROLE:
+            return self.heat[row][0] if self.heat[row] else None
+        if role == Qt.ToolTipRole:
+            return self.heat[row][1] if self.heat[row] else None
+        return None
+        
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid():
+            return False
+        row = index.row()
+        if role in (CARD_ROLE, Qt.EditRole):
+            value = tuple(value)
+            if value == self.entries[row]:
+                return True
+            self.entries[row] = value
+        elif role == BREAK_ROLE:
+            self.breaks[row] = bool(value)
+        else:
+            return False
+        self.dataChanged.emit(index, index, [role])
+        return True
+        
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable
+        
+    def append_card(self, entry=("", "")):
+        """在末尾添加一张卡片"""
+        self.insert_cards(len(self.entries), [entry])
+        
+    def insert_cards(self, row, entries):
+        """在第row行前插入多张卡片"""
+        if not entries:
+            return
+        self.beginInsertRows(QModelIndex(), row, row + len(entries) - 1)
+        self.entries[row:row] = [tuple(entry) for entry in entries]
+        self.lines[row:row] = [None] * len(entries)
+        self.breaks[row:row] = [False] * len(entries)
+        self.heat[row:row] = [None] * len(entries)
+        self.endInsertRows()
+        
+    def remove_cards(self, row, count):
+        """删除从第row行开始的count张卡片"""
+        if count <= 0:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+        del self.entries[row:row + count]
+        del self.lines[row:row + count]
+        del self.breaks[row:row + count]
+        del self.heat[row:row + count]
+        self.endRemoveRows()
+        
+    def clear(self):
+        """删除所有卡片"""
+        self.beginResetModel()
+        self.entries, self.lines, self.breaks, self.heat = [], [], [], []
+        self.endResetModel()
+        
+    def sync(self, entries):
+        """把卡片改成entries：跳过首尾相同的卡片，只改写、插入或删除中间变化的一段"""
+        old = self.entries
+        prefix = 0
+        limit = min(len(old), len(entries))
+        while prefix < limit and old[prefix] == entries[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old[-1 - suffix] == entries[-1 - suffix]:
+            suffix += 1
+        old_end, new_end = len(old) - suffix, len(entries) - suffix
+        
+        reused = min(old_end, new_end) - prefix
+        if reused > 0:
+            old[prefix:prefix + reused] = entries[prefix:prefix + reused]
+            self.dataChanged.emit(self.index(prefix), self.index(prefix + reused - 1), [CARD_ROLE])
+        if new_end > old_end:
+            self.insert_cards(old_end, entries[old_end:new_end])
+        elif old_end > new_end:
+            self.remove_cards(new_end, old_end - new_end)
+            
+    def set_lines(self, lines):
+        """设置每张卡片对应的源代码行号（与 entries 等长）"""
+        self.lines = list(lines)
+        
+    def rows_by_line(self):
+        """源代码行号 -> 卡片行（卡片与指令按 vm.program.lines 中的行号对应，
+        被加载器丢弃或被优化删除的行没有对应的指令）"""
+        return {line: row for row, line in enumerate(self.lines) if line is not None}
+        
+    def set_heat(self, heat):
+        """按 {卡片行: (颜色, 提示)} 设置热度（源代码行号先用 rows_by_line 转换）"""
+        for row, value in heat.items():
+            self.heat[row] = value
+        if heat:
+            self.dataChanged.emit(self.index(min(heat)), self.index(max(heat)), [HEAT_ROLE, Qt.ToolTipRole])
+            
+    def clear_heat(self):
+        """清除所有热度"""
+        if any(self.heat):
+            self.heat = [None] * len(self.entries)
+            self.dataChanged.emit(self.index(0), self.index(len(self.entries) - 1),
+                                  [HEAT_ROLE, Qt.ToolTipRole])
+            
+    def clear_breaks(self):
+        """清除所有卡片断点"""
+        if any(self.breaks):
+            self.breaks = [False] * len(self.entries)
+            self.dataChanged.emit(self.index(0), self.index(len(self.entries) - 1), [BREAK_ROLE])
+
+
+class CardDelegate(QStyledItemDelegate):
+    """卡片绘制代理：所有卡片直接绘制，只给当前行创建编辑部件；点击左侧圆点切换断点"""
+    
+    def paint(self, painter, option, index):
+        painter.save()
+        rect = option.rect
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(rect, option.palette.highlight().color().lighter(180))
+        
+        # 断点标记
+        dot = QRect(rect.left() + 5, rect.top() + (rect.height() - 12) // 2, 12, 12)
+        painter.setRenderHint(QPainter.Antialiasing)
+        if index.data(BREAK_ROLE):
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(QColor(220, 50, 50))
+        else:
+            painter.setPen(QColor(210, 210, 210))
+            painter.setBrush(Qt.NoBrush)
+        painter.drawEllipse(dot)
+        
+        # 卡片编号（性能分析时按热度着色）
+        number_rect = QRect(rect.left() + 22, rect.top() + 3, 40, rect.height() - 6)
+        heat = index.data(HEAT_ROLE)
+        painter.fillRect(number_rect, heat if heat is not None else QColor('#e0e0e0'))
+        painter.setPen(QColor('#a0a0a0'))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawRect(number_rect.adjusted(0, 0, -1, -1))
+        painter.setPen(option.palette.text().color())
+        painter.drawText(number_rect, Qt.AlignCenter, f"{index.row():03d}")
+        
+        # 指令和操作数
+        text_rect = rect.adjusted(CARD_GUTTER_WIDTH + 10, 0, -5, 0)
+        text = index.data(Qt.DisplayRole)
+        if not text:
+            painter.setPen(QColor('#a0a0a0'))
+            text = '（空卡片）'
+        painter.drawText(text_rect, Qt.AlignVCenter | Qt.AlignLeft, text)
+        
+        # 指令说明（与编辑部件中的帮助标签对齐）
+        help_text = CARD_HELP_LABELS.get(index.data(CARD_ROLE)[0])
+        if help_text:
+            painter.setPen(QColor('#606060'))
+            painter.drawText(text_rect.adjusted(CARD_HELP_OFFSET, 0, 0, 0),
+                             Qt.AlignVCenter | Qt.AlignLeft, help_text)
+        painter.restore()
+        
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), CARD_ROW_HEIGHT)
+        
+    def editorEvent(self, event, model, option, index):
+        """点击断点区域时切换断点，不打开编辑部件"""
+        if (event.type() == QEvent.MouseButtonRelease
+                and event.pos().x() - option.rect.left() < 20):
+            model.setData(index, not index.data(BREAK_ROLE), BREAK_ROLE)
+            return True
+        return super(CardDelegate, self).editorEvent(event, model, option, index)
+        
+    def createEditor(self, parent, option, index):
+        editor = CardWidget(parent)
+        # 每次修改立即写回模型，不必等编辑部件关闭
+        editor.edited.connect(lambda: self.commitData.emit(editor))
+        return editor
+        
+    def setEditorData(self, editor, index):
+        # 编辑部件写回模型后也会调用这里，内容相同时不重设，以免打断输入
+        entry = index.data(CARD_ROLE)
+        if entry != editor.get_entry():
+            editor.set_card(*entry)
+            
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.get_entry(), CARD_ROLE)
+        
+    def updateEditorGeometry(self, editor, option, index):
+        # 编辑部件只盖住指令区，断点标记和编号仍由代理绘制
+        editor.setGeometry(option.rect.adjusted(CARD_GUTTER_WIDTH, 0, 0, 0))
 
 
 class MainWindow(QMainWindow):
@@ -1192,9 +4076,16 @@ class MainWindow(QMainWindow):
     
     def __init__(self):
         super(MainWindow, self).__init__()
-        self.vm = VirtualMachine()
-        self.cards = []
+        self.vm = VirtualMachine(default_cache_dir())
+        self.card_model = CardListModel()
         self.current_line_highlight = -1
+        self.editor_breakpoints = {}  # 代码编辑器行号 -> 条件文本（None 表示无条件）
+        self.heat_selections = []
+        self.animation_worker = None
+        self.animation_thread = None
+        self.file_worker = None
+        self.file_thread = None
+        self.file_backup = None  # 打开文件前编辑器中的程序，读取失败时恢复
         self.setup_ui()
         self.setup_menu()
         
@@ -1225,8 +4116,13 @@ class MainWindow(QMainWindow):
         for i in range(5):
             self.add_card()
             
-        # 状态栏
+        # 状态栏（打开、保存大文件时显示进度条）
         self.statusBar().showMessage('就绪 - 汉字卡片编程语言 IDE')
+        self.file_progress = QProgressBar()
+        self.file_progress.setRange(0, 100)
+        self.file_progress.setMaximumWidth(200)
+        self.file_progress.hide()
+        self.statusBar().addPermanentWidget(self.file_progress)
         
     def create_left_panel(self):
         """创建左侧面板"""
@@ -1240,7 +4136,7 @@ class MainWindow(QMainWindow):
         editor_group = QGroupBox('代码编辑器 (可直接编辑文本)')
         editor_layout = QVBoxLayout()
         
-        self.code_editor = QTextEdit()
+        self.code_editor = QPlainTextEdit()
         self.code_editor.setPlaceholderText(
             "在此直接输入代码，每行一条指令\n\n"
             "示例 (算术):\n"
@@ -1251,25 +4147,34 @@ class MainWindow(QMainWindow):
         )
         self.code_editor.setFont(QFont("微软雅黑", 10))
         self.code_editor.textChanged.connect(self.on_code_changed)
+        self.code_editor.cursorPositionChanged.connect(self.show_line_error)
+        self.highlighter = CodeHighlighter(self.code_editor.document(), self.vm)
+        
+        # 编辑器内容变化后延迟同步到卡片（连续输入只同步一次）
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.setInterval(300)
+        self.sync_timer.timeout.connect(self.sync_code_to_cards)
         
         editor_layout.addWidget(self.code_editor)
         editor_group.setLayout(editor_layout)
         
         # 卡片编辑器
-        cards_group = QGroupBox('卡片编辑器 (双击卡片可快速编辑)')
+        cards_group = QGroupBox('卡片编辑器 (选中卡片即可编辑，点击左侧圆点设置断点)')
         cards_layout = QVBoxLayout()
         
-        # 卡片滚动区域
-        self.scroll_area = QScrollArea()
-        self.scroll_content = QWidget()
-        self.cards_layout = QVBoxLayout()
-        self.cards_layout.setAlignment(Qt.AlignTop)
-        self.cards_layout.setSpacing(2)
-        self.scroll_content.setLayout(self.cards_layout)
-        self.scroll_area.setWidget(self.scroll_content)
-        self.scroll_area.setWidgetResizable(True)
-        
-        cards_layout.addWidget(self.scroll_area)
+        # 卡片列表：卡片由代理直接绘制，只有当前行有编辑部件，卡片再多部件数也不变
+        self.card_view = QListView()
+        self.card_view.setModel(self.card_model)
+        self.card_view.setItemDelegate(CardDelegate(self.card_view))
+        self.card_view.setUniformItemSizes(True)
+        self.card_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.card_view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.card_view.setEditTriggers(QAbstractItemView.CurrentChanged
+                                       | QAbstractItemView.DoubleClicked
+                                       | QAbstractItemView.SelectedClicked)
+        
+        cards_layout.addWidget(self.card_view)
         cards_group.setLayout(cards_layout)
         
         layout.addWidget(toolbar)
@@ -1342,10 +4247,64 @@ class MainWindow(QMainWindow):
         self.load_btn.clicked.connect(self.load_from_cards)
         self.load_btn.setToolTip('从卡片加载程序到虚拟机')
         
+        # 执行引擎选择（每次运行生效）
+        self.engine_combo = QComboBox()
+        self.engine_combo.addItem('快速执行', 'fast')
+        self.engine_combo.addItem('编译执行（无逐条输出）', 'compiled')
+        self.engine_combo.addItem('标准解释', 'reference')
+        self.engine_combo.setToolTip('运行整个程序时使用的执行引擎')
+        
         control_layout.addWidget(self.run_btn, 0, 0)
         control_layout.addWidget(self.step_btn, 0, 1)
         control_layout.addWidget(self.reset_btn, 1, 0)
         control_layout.addWidget(self.load_btn, 1, 1)
+        control_layout.addWidget(QLabel('执行引擎:'), 2, 0)
+        control_layout.addWidget(self.engine_combo, 2, 1)
+        
+        self.continue_btn = QPushButton(QIcon.fromTheme('media-playback-start'), '继续')
+        self.continue_btn.clicked.connect(self.continue_program)
+        self.continue_btn.setToolTip('从断点处继续运行到下一个断点')
+        
+        # 执行历史：开启后可以单步后退、跳到任意步
+        self.record_check = QCheckBox('记录执行历史')
+        self.record_check.setToolTip('记录每步的撤销信息，支持后退和跳到指定步')
+        self.record_check.toggled.connect(self.toggle_recording)
+        
+        self.step_back_btn = QPushButton(QIcon.fromTheme('media-seek-backward'), '后退一步')
+        self.step_back_btn.clicked.connect(self.step_back)
+        self.step_back_btn.setToolTip('撤销上一步执行')
+        
+        self.goto_step_spin = QSpinBox()
+        self.goto_step_spin.setRange(0, 2 ** 31 - 1)
+        self.goto_step_btn = QPushButton('跳到步骤')
+        self.goto_step_btn.clicked.connect(self.goto_step)
+        
+        control_layout.addWidget(self.record_check, 3, 0)
+        control_layout.addWidget(self.step_back_btn, 3, 1)
+        control_layout.addWidget(self.goto_step_spin, 4, 0)
+        control_layout.addWidget(self.goto_step_btn, 4, 1)
+        control_layout.addWidget(self.continue_btn, 5, 0, 1, 2)
+        
+        # 动画运行：连续执行，界面按帧率刷新
+        self.animate_btn = QPushButton('动画运行')
+        self.animate_btn.clicked.connect(self.toggle_animation)
+        self.animate_btn.setToolTip('连续执行并按帧率刷新显示，再次点击停止')
+        
+        self.fps_spin = QSpinBox()
+        self.fps_spin.setRange(1, 60)
+        self.fps_spin.setValue(25)
+        self.fps_spin.setSuffix(' 帧/秒')
+        
+        self.speed_slider = QSlider(Qt.Horizontal)
+        self.speed_slider.setRange(0, len(ANIMATION_SPEEDS) - 1)
+        self.speed_slider.valueChanged.connect(self.on_speed_changed)
+        self.speed_label = QLabel()
+        self.on_speed_changed(0)
+        
+        control_layout.addWidget(self.animate_btn, 6, 0)
+        control_layout.addWidget(self.fps_spin, 6, 1)
+        control_layout.addWidget(self.speed_slider, 7, 0)
+        control_layout.addWidget(self.speed_label, 7, 1)
         control_group.setLayout(control_layout)
         
         # 状态显示
@@ -1384,8 +4343,7 @@ class MainWindow(QMainWindow):
         output_group = QGroupBox('程序输出')
         output_layout = QVBoxLayout()
         
-        self.output_text = QTextEdit()
-        self.output_text.setReadOnly(True)
+        self.output_text = OutputConsole()
         self.output_text.setFont(QFont("微软雅黑", 9))
         self.output_text.setMaximumHeight(150)
         
@@ -1442,8 +4400,17 @@ class MainWindow(QMainWindow):
         text_memory_layout.addWidget(self.text_memory_table)
         text_memory_group.setLayout(text_memory_layout)
         
+        # 热点行（性能分析模式下运行后填充，点击表头排序）
+        self.profile_table = QTableWidget(0, 5)
+        self.profile_table.setHorizontalHeaderLabels(['行号', '指令', '执行次数', '总耗时(ms)', '平均(μs)'])
+        self.profile_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.profile_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.profile_table.verticalHeader().setVisible(False)
+        self.profile_table.setSortingEnabled(True)
+        
         memory_tab.addTab(num_memory_group, "数字内存")
         memory_tab.addTab(text_memory_group, "文本内存")
+        memory_tab.addTab(self.profile_table, "热点行")
         
         # 帮助信息
         help_group = QGroupBox('指令帮助')
@@ -1478,6 +4445,18 @@ class MainWindow(QMainWindow):
         <li><b>后继</b>: 获取后继汉字</li>
         <li><b>存储文本 文槽X</b>: 存储文本到文槽X</li>
         <li><b>读取文本 文槽X</b>: 从文槽X读取文本</li>
+        <li><b>替换 文槽X/文件名</b>: 按替换表（每行“原文 替换文”）一次性替换文本</li>
+        </ul>
+        
+        <h3>区间指令:</h3>
+        <ul>
+        <li><b>区间求和 槽A~B</b>: 累加器 = 槽A到槽B之和</li>
+        <li><b>区间填充 槽A~B</b>: 槽A到槽B都设为累加器</li>
+        <li><b>区间复制 槽A~B</b>: 槽A到槽B复制到从槽(累加器)开始的位置</li>
+        <li><b>区间反转 槽A~B</b>: 槽A到槽B倒序排列</li>
+        <li><b>区间排序 槽A~B</b>: 槽A到槽B从小到大排序</li>
+        <li><b>区间拼接 文槽A~B</b>: 文槽A到文槽B依次拼接到文本累加器</li>
+        <li><b>区间拼音 文槽A~B</b>: 文槽A到文槽B逐个转为拼音</li>
         </ul>
         
         <h3>操作数格式:</h3>
@@ -1486,6 +4465,7 @@ class MainWindow(QMainWindow):
         <li><b>汉字文本</b>: 你好, 中国, 汉字</li>
         <li><b>数字存储槽</b>: 槽0, 槽1, 槽99</li>
         <li><b>文本存储槽</b>: 文槽0, 文槽1, 文槽99</li>
+        <li><b>存储槽区间</b>: 槽0~9, 文槽3~5（含两端）</li>
         </ul>
         """)
         help_text.setMaximumHeight(300)
@@ -1509,9 +4489,9 @@ class MainWindow(QMainWindow):
         # 文件菜单
         file_menu = menubar.addMenu('文件')
         
-        new_action = QAction('新建', self)
-        new_action.triggered.connect(self.new_file)
-        file_menu.addAction(new_action)
+        self.new_action = QAction('新建', self)
+        self.new_action.triggered.connect(self.new_file)
+        file_menu.addAction(self.new_action)
         
         open_action = QAction('打开...', self)
         open_action.triggered.connect(self.open_file)
@@ -1521,6 +4501,11 @@ class MainWindow(QMainWindow):
         save_action.triggered.connect(self.save_file)
         file_menu.addAction(save_action)
         
+        self.log_action = QAction('输出同时写入日志文件...', self)
+        self.log_action.setCheckable(True)
+        self.log_action.toggled.connect(self.toggle_output_log)
+        file_menu.addAction(self.log_action)
+        
         file_menu.addSeparator()
         
         exit_action = QAction('退出', self)
@@ -1530,9 +4515,9 @@ class MainWindow(QMainWindow):
         # 编辑菜单
         edit_menu = menubar.addMenu('编辑')
         
-        clear_action = QAction('清空所有', self)
-        clear_action.triggered.connect(self.clear_all)
-        edit_menu.addAction(clear_action)
+        self.clear_action = QAction('清空所有', self)
+        self.clear_action.triggered.connect(self.clear_all)
+        edit_menu.addAction(self.clear_action)
         
         # 工具菜单
         tool_menu = menubar.addMenu('工具')
@@ -1541,6 +4526,45 @@ class MainWindow(QMainWindow):
         hanzi_test_action.triggered.connect(self.test_hanzi_processor)
         tool_menu.addAction(hanzi_test_action)
         
+        self.optimize_action = QAction('加载时优化程序', self)
+        self.optimize_action.setCheckable(True)
+        self.optimize_action.setToolTip('加载程序后执行窥孔优化（合并常量、删除冗余读取、跳转链穿透）')
+        tool_menu.addAction(self.optimize_action)
+        
+        self.profile_action = QAction('性能分析模式', self)
+        self.profile_action.setCheckable(True)
+        self.profile_action.setToolTip('运行时统计每行的执行次数和耗时，并以热度图显示')
+        self.profile_action.toggled.connect(self.toggle_profiling)
+        tool_menu.addAction(self.profile_action)
+        
+        # 调试菜单
+        debug_menu = menubar.addMenu('调试')
+        
+        toggle_break_action = QAction('切换断点', self)
+        toggle_break_action.setShortcut('F9')
+        toggle_break_action.triggered.connect(self.toggle_breakpoint)
+        debug_menu.addAction(toggle_break_action)
+        
+        condition_break_action = QAction('设置条件断点...', self)
+        condition_break_action.triggered.connect(self.set_condition_breakpoint)
+        debug_menu.addAction(condition_break_action)
+        
+        clear_breaks_action = QAction('清除所有断点', self)
+        clear_breaks_action.triggered.connect(self.clear_breakpoints)
+        debug_menu.addAction(clear_breaks_action)
+        
+        debug_menu.addSeparator()
+        
+        self.continue_action = QAction('继续', self)
+        self.continue_action.setShortcut('F5')
+        self.continue_action.triggered.connect(self.continue_program)
+        debug_menu.addAction(self.continue_action)
+        
+        self.run_to_cursor_action = QAction('运行到光标处', self)
+        self.run_to_cursor_action.setShortcut('Ctrl+F10')
+        self.run_to_cursor_action.triggered.connect(self.run_to_cursor)
+        debug_menu.addAction(self.run_to_cursor_action)
+        
         # 帮助菜单
         help_menu = menubar.addMenu('帮助')
         
@@ -1550,24 +4574,20 @@ class MainWindow(QMainWindow):
         
     def add_card(self):
         """添加新卡片"""
-        card_num = len(self.cards)
-        card = CardWidget(card_num)
-        self.cards.append(card)
-        self.cards_layout.addWidget(card)
+        self.card_model.append_card()
+        self.card_view.scrollToBottom()
         self.update_code_from_cards()
         
     def remove_last_card(self):
         """删除最后一张卡片"""
-        if self.cards:
-            card = self.cards.pop()
-            card.deleteLater()
+        count = self.card_model.rowCount()
+        if count:
+            self.card_model.remove_cards(count - 1, 1)
             self.update_code_from_cards()
             
     def clear_cards(self):
         """清空所有卡片"""
-        for card in self.cards:
-            card.deleteLater()
-        self.cards.clear()
+        self.card_model.clear()
         self.update_code_from_cards()
         
     def clear_all(self):
@@ -1578,98 +4598,69 @@ class MainWindow(QMainWindow):
         
     def load_example(self):
         """加载算术示例程序"""
+        if self.animation_worker is not None:
+            return
         self.clear_cards()
         
-        example_code = """# 算术示例：计算 1+2+3+...+10
-# 初始化：槽0 = 10 (循环次数)，槽1 = 0 (累加和)
-
-读取 槽0    # 加载循环计数器
-减 1       # 计数器减1
-存储 槽0   # 保存计数器
-读取 槽1   # 加载累加和
-加 槽0    # 加上当前计数器值
-存储 槽1   # 保存累加和
-读取 槽0   # 加载计数器
-跳转 2    # 如果计数器>0，跳转到行2
-读取 槽1   # 加载最终结果
-停机      # 程序结束
-"""
-        
-        self.code_editor.setText(example_code)
+        self.code_editor.setPlainText(ARITHMETIC_EXAMPLE)
         self.sync_code_to_cards()
         
         # 初始化内存
-        self.vm.memory[0] = 10
-        self.vm.memory[1] = 0
+        for slot, value in ARITHMETIC_EXAMPLE_MEMORY.items():
+            self.vm.memory[slot] = value
         self.update_memory_display()
         
     def load_hanzi_example(self):
         """加载汉字处理示例程序"""
+        if self.animation_worker is not None:
+            return
         self.clear_cards()
         
-        example_code = """# 汉字处理示例
-# 演示汉字处理指令的使用
-
-拼接 你好中国     # 文本累加器 = "你好中国"
-取拼音           # 获取拼音
-存储文本 文槽0   # 存储到文本内存
-
-读取文本 文槽0   # 重新读取
-拼接 的拼音是     # 继续拼接
-存储文本 文槽1   # 存储结果
-
-读取文本 文槽1   # 读取结果
-取含义           # 获取含义
-存储文本 文槽2   # 存储含义
-
-拼接 山         # 测试单个汉字
-取词性          # 获取词性
-拼接 是名词     # 添加说明
-
-停机            # 程序结束
-"""
-        
-        self.code_editor.setText(example_code)
+        self.code_editor.setPlainText(HANZI_EXAMPLE)
         self.sync_code_to_cards()
         
     def sync_code_to_cards(self):
-        """从代码编辑器同步到卡片"""
-        code_text = self.code_editor.toPlainText()
-        lines = code_text.strip().split('\n')
-        
-        self.clear_cards()
-        
-        for line in lines:
+        """从代码编辑器同步到卡片：模型只改动有变化的一段（不改写编辑器）"""
+        entries = []
+        lines = []
+        for line_num, line in enumerate(self.code_editor.toPlainText().split('\n'), 1):
             line = line.strip()
             if not line or line.startswith('#'):
                 continue
-                
             parts = line.split()
-            if len(parts) < 1:
-                continue
-                
-            instruction = parts[0]
-            operand = parts[1] if len(parts) > 1 else ""
-            
-            self.add_card()
-            if self.cards:
-                self.cards[-1].set_card(instruction, operand)
+            entries.append((parts[0], parts[1] if len(parts) > 1 else ""))
+            lines.append(line_num)
+        self.card_model.sync(entries)
+        self.card_model.set_lines(lines)
                 
     def update_code_from_cards(self):
         """从卡片更新代码编辑器"""
-        code_lines = []
-        for i, card in enumerate(self.cards):
-            card_text = card.get_card_text()
-            if card_text:
-                code_lines.append(card_text)
+        code_lines = [text for text in map(card_text, self.card_model.entries) if text]
+        # 非空卡片依次写成第1、2、3……行，空卡片不写入编辑器
+        lines = []
+        line_num = 0
+        for entry in self.card_model.entries:
+            if card_text(entry):
+                line_num += 1
+                lines.append(line_num)
+            else:
+                lines.append(None)
+        self.card_model.set_lines(lines)
                 
         self.code_editor.blockSignals(True)
-        self.code_editor.setText('\n'.join(code_lines))
+        self.code_editor.setPlainText('\n'.join(code_lines))
         self.code_editor.blockSignals(False)
         
     def on_code_changed(self):
-        """代码编辑器内容变化时的处理"""
-        pass
+        """代码编辑器内容变化时的处理：停止输入一段时间后自动同步到卡片"""
+        self.sync_timer.start()
+        
+    def show_line_error(self):
+        """光标所在行有语法错误时在状态栏显示"""
+        error = self.highlighter.line_error(self.code_editor.textCursor().block())
+        if error:
+            line = self.code_editor.textCursor().blockNumber() + 1
+            self.statusBar().showMessage(f"第{line}行: {error}")
         
     def get_program_text(self):
         """从代码编辑器获取程序文本"""
@@ -1678,18 +4669,24 @@ class MainWindow(QMainWindow):
     def load_from_cards(self):
         """从卡片加载程序到虚拟机"""
         program_text = self.get_program_text()
-        self.vm.load_program(program_text)
+        self.vm.load_program(program_text, optimize=self.optimize_action.isChecked())
         self.vm.program_counter = 0
         
         if self.vm.output_history:
-            for msg in self.vm.output_history:
-                self.output_text.append(msg)
+            self.output_text.write(self.vm.output_history)
             self.vm.output_history = []
             
-        self.statusBar().showMessage(f'已加载 {len(self.vm.program)} 条指令')
+        self.output_text.write([f"优化: {msg}" for msg in self.vm.optimization_report])
+            
+        if self.vm.load_errors:
+            self.statusBar().showMessage(f'已加载 {len(self.vm.program)} 条指令，静态检查发现 {len(self.vm.load_errors)} 个错误')
+        else:
+            self.statusBar().showMessage(f'已加载 {len(self.vm.program)} 条指令')
         
     def run_program(self):
         """运行程序"""
+        # 先清空输出，保留加载时写出的优化记录和静态检查错误
+        self.output_text.clear()
         self.load_from_cards()
         
         if not self.vm.program:
@@ -1700,9 +4697,252 @@ class MainWindow(QMainWindow):
         self.running_label.setText('运行中')
         self.running_label.setStyleSheet("QLabel { background-color: #ccffcc; border: 1px solid #99cc99; padding: 2px; }")
         
-        self.output_text.clear()
-        self.vm.run_program()
+        self.apply_breakpoints()
+        self.vm.run_program(engine=self.engine_combo.currentData())
+        self.after_run()
+        
+    def continue_program(self):
+        """从断点处继续运行（程序未在运行时从头运行）"""
+        if self.animation_worker is not None:
+            return
+        if not self.vm.is_running or not self.vm.program:
+            self.run_program()
+            return
+        self.apply_breakpoints()
+        self.vm.run_program(engine=self.engine_combo.currentData(), resume=True)
+        self.after_run()
+        
+    def run_to_cursor(self):
+        """运行到代码编辑器光标所在行（相当于在该行设一个临时断点）"""
+        if self.animation_worker is not None:
+            return
+        line = self.code_editor.textCursor().blockNumber() + 1
+        temporary = line not in self.editor_breakpoints
+        if temporary:
+            self.editor_breakpoints[line] = None
+        try:
+            self.continue_program()
+        finally:
+            if temporary:
+                del self.editor_breakpoints[line]
+        
+    def on_speed_changed(self, index):
+        """动画速度滑块变化（运行中立即生效）"""
+        steps = ANIMATION_SPEEDS[index]
+        self.speed_label.setText('不限速' if steps is None else f'每帧 {steps} 步')
+        if self.animation_worker is not None:
+            self.animation_worker.steps_per_frame = steps
+        
+    def set_run_controls_enabled(self, enabled):
+        """动画运行期间禁用会直接操作虚拟机的按钮、菜单项和选项（虚拟机此时由工作线程改写）"""
+        for control in (self.run_btn, self.step_btn, self.reset_btn, self.load_btn,
+                        self.continue_btn, self.step_back_btn, self.goto_step_btn,
+                        self.load_example_btn, self.load_hanzi_example_btn, self.record_check,
+                        self.new_action, self.clear_action, self.continue_action,
+                        self.run_to_cursor_action, self.profile_action):
+            control.setEnabled(enabled)
+        
+    def toggle_animation(self):
+        """开始或停止动画运行（停在断点或单步中途时从当前状态继续）"""
+        if self.animation_worker is not None:
+            self.animation_worker.stop()
+            return
+        resume = self.vm.is_running and bool(self.vm.program)
+        if not resume:
+            self.output_text.clear()
+            self.load_from_cards()
+            if not self.vm.program:
+                self.output_text.append("错误: 没有可执行的程序")
+                return
+            self.vm.is_running = True
+        self.apply_breakpoints()
+        
+        worker = AnimationWorker(self.vm, self.engine_combo.currentData(), self.fps_spin.value(),
+                                 ANIMATION_SPEEDS[self.speed_slider.value()], resume, self.output_text.spill)
+        thread = QThread(self)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.frame_ready.connect(self.on_animation_frame)
+        worker.finished.connect(self.on_animation_finished)
+        worker.finished.connect(thread.quit)
+        thread.finished.connect(thread.deleteLater)
+        self.animation_worker, self.animation_thread = worker, thread
+        
+        self.set_run_controls_enabled(False)
+        self.animate_btn.setText('停止动画')
+        self.update_running_label()
+        thread.start()
+        
+    def on_animation_frame(self):
+        """显示工作线程提交的最新一帧"""
+        if self.animation_worker is None:
+            return
+        frame = self.animation_worker.take_frame()
+        if frame is not None:
+            self.show_frame(frame)
+        
+    def show_frame(self, frame):
+        """按帧中的状态副本刷新显示（动画运行期间不直接读取虚拟机）"""
+        self.acc_label.setText(str(frame['accumulator']))
+        text = frame['text_accumulator']
+        self.text_acc_label.setText(text[:50] + ("..." if len(text) > 50 else ""))
+        self.pc_label.setText(str(frame['program_counter']))
+        self.current_inst_label.setText(frame['status'])
+        self.update_memory_display(frame['memory'], frame['text_memory'])
+        if frame['skipped']:
+            self.output_text.write([f"…（省略 {frame['skipped']} 条输出）"] + frame['output'], log=False)
+        else:
+            self.output_text.write(frame['output'], log=False)
+        self.statusBar().showMessage(f"动画运行: 已执行 {frame['steps']} 步")
+        
+    def on_animation_finished(self):
+        """动画运行结束（程序结束、停在断点或被停止）"""
+        worker = self.animation_worker
+        frame = worker.take_frame()
+        if frame is not None:
+            self.show_frame(frame)
+        self.animation_worker = None
+        self.animation_thread = None
+        worker.deleteLater()
+        self.vm.steps_executed = worker.total_steps
+        self.set_run_controls_enabled(True)
+        self.animate_btn.setText('动画运行')
+        self.after_run()
+        
+    def after_run(self):
+        """运行结束或停在断点后刷新一次界面"""
         self.update_display()
+        self.update_running_label()
+        if self.vm.break_hit is not None:
+            self.output_text.append(f"在第{self.vm.break_hit}行的断点处暂停（已执行 {self.vm.steps_executed} 步）")
+            self.statusBar().showMessage(f'断点: 第{self.vm.break_hit}行')
+        if self.vm.profiling:
+            self.show_profile()
+        
+    def apply_breakpoints(self):
+        """把编辑器和卡片上的断点交给虚拟机（卡片断点按卡片的源代码行号设置，
+        该行没有对应指令时——加载时被丢弃或被优化删除——不设断点）；
+        动画运行期间虚拟机归工作线程所有，不做改动"""
+        if self.animation_worker is not None:
+            return
+        self.vm.clear_breakpoints()
+        for line, condition in self.editor_breakpoints.items():
+            self.vm.set_breakpoint(line, condition)
+        program_lines = set(self.vm.program.lines)
+        model = self.card_model
+        for row, line in enumerate(model.lines):
+            if model.breaks[row] and line in program_lines:
+                self.vm.set_breakpoint(line)
+        
+    def toggle_breakpoint(self):
+        """在光标所在行切换无条件断点"""
+        line = self.code_editor.textCursor().blockNumber() + 1
+        if line in self.editor_breakpoints:
+            del self.editor_breakpoints[line]
+            self.statusBar().showMessage(f'已删除第{line}行的断点')
+        else:
+            self.editor_breakpoints[line] = None
+            self.statusBar().showMessage(f'已在第{line}行设置断点')
+        self.refresh_editor_marks()
+        
+    def set_condition_breakpoint(self):
+        """在光标所在行设置条件断点"""
+        line = self.code_editor.textCursor().blockNumber() + 1
+        condition, ok = QInputDialog.getText(
+            self, '条件断点', f'第{line}行的断点条件（如“累加器 > 100”“槽3 == 0 且 文槽1 != 你好”）:',
+            text=self.editor_breakpoints.get(line) or '')
+        if not ok:
+            return
+        condition = condition.strip()
+        if condition:
+            try:
+                compile_condition(condition, self.vm.max_memory_slots)
+            except ValueError as e:
+                QMessageBox.warning(self, '无效条件', str(e))
+                return
+        self.editor_breakpoints[line] = condition or None
+        self.statusBar().showMessage(f'已在第{line}行设置断点' + (f'（条件: {condition}）' if condition else ''))
+        self.refresh_editor_marks()
+        
+    def clear_breakpoints(self):
+        """清除编辑器和卡片上的所有断点（动画运行期间只清除标记，虚拟机在下次运行前同步）"""
+        self.editor_breakpoints.clear()
+        self.card_model.clear_breaks()
+        if self.animation_worker is None:
+            self.vm.clear_breakpoints()
+        self.refresh_editor_marks()
+        
+    def refresh_editor_marks(self):
+        """重新绘制编辑器中的热度图和断点标记"""
+        selections = list(self.heat_selections)
+        document = self.code_editor.document()
+        for line, condition in self.editor_breakpoints.items():
+            block = document.findBlockByNumber(line - 1)
+            if not block.isValid():
+                continue
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setBackground(QColor(255, 200, 120) if condition else QColor(255, 150, 150))
+            selection.format.setProperty(QTextFormat.FullWidthSelection, True)
+            selection.cursor = QTextCursor(block)
+            selections.append(selection)
+        self.code_editor.setExtraSelections(selections)
+        
+    def toggle_profiling(self, enabled):
+        """切换性能分析模式"""
+        self.vm.profiling = enabled
+        if not enabled:
+            self.clear_profile_view()
+        self.statusBar().showMessage('性能分析模式已开启' if enabled else '性能分析模式已关闭')
+        
+    def clear_profile_view(self):
+        """清除代码编辑器和卡片上的热度图以及热点行表格"""
+        self.heat_selections = []
+        self.refresh_editor_marks()
+        self.card_model.clear_heat()
+        self.profile_table.setRowCount(0)
+        
+    def show_profile(self):
+        """把性能分析结果显示为热度图和热点行表格"""
+        self.clear_profile_view()
+        report = self.vm.profile_report()
+        if not report:
+            return
+        hottest = report[0]['total'] or 1.0
+        
+        # 代码编辑器：按行号整行着色
+        selections = []
+        document = self.code_editor.document()
+        for row in report:
+            block = document.findBlockByNumber(row['line'] - 1)
+            if not block.isValid():
+                continue
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setBackground(heat_color(row['total'] / hottest))
+            selection.format.setProperty(QTextFormat.FullWidthSelection, True)
+            selection.cursor = QTextCursor(block)
+            selections.append(selection)
+        self.heat_selections = selections
+        self.refresh_editor_marks()
+        
+        # 卡片：按指令的源代码行号找到对应的卡片
+        rows_by_line = self.card_model.rows_by_line()
+        self.card_model.set_heat({
+            rows_by_line[row['line']]: (heat_color(row['total'] / hottest),
+                                        f"执行 {row['count']} 次，共 {row['total'] * 1000:.3f} ms")
+            for row in report if row['line'] in rows_by_line})
+        
+        # 热点行表格（数值列按数值排序）
+        self.profile_table.setSortingEnabled(False)
+        self.profile_table.setRowCount(len(report))
+        for r, row in enumerate(report):
+            values = [row['line'], row['text'], row['count'],
+                      round(row['total'] * 1000, 3), round(row['average'] * 1e6, 2)]
+            for c, value in enumerate(values):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                self.profile_table.setItem(r, c, item)
+        self.profile_table.setSortingEnabled(True)
+        self.profile_table.sortItems(3, Qt.DescendingOrder)
         
     def step_program(self):
         """单步执行程序"""
@@ -1713,15 +4953,57 @@ class MainWindow(QMainWindow):
             self.running_label.setStyleSheet("QLabel { background-color: #ccffcc; border: 1px solid #99cc99; padding: 2px; }")
             
         if self.vm.program_counter < len(self.vm.program):
-            self.vm.execute_step()
+            self.vm.step()
             self.update_display()
         else:
             self.vm.is_running = False
             self.running_label.setText('停止')
             self.running_label.setStyleSheet("QLabel { background-color: #ffcccc; border: 1px solid #cc9999; padding: 2px; }")
             
+    def toggle_recording(self, enabled):
+        """切换执行历史记录"""
+        self.vm.recording = enabled
+        if not enabled:
+            self.vm.history.clear()
+            
+    def update_running_label(self):
+        """按虚拟机运行状态更新状态标签"""
+        if self.vm.is_running:
+            self.running_label.setText('运行中')
+            self.running_label.setStyleSheet("QLabel { background-color: #ccffcc; border: 1px solid #99cc99; padding: 2px; }")
+        else:
+            self.running_label.setText('停止')
+            self.running_label.setStyleSheet("QLabel { background-color: #ffcccc; border: 1px solid #cc9999; padding: 2px; }")
+            
+    def step_back(self):
+        """后退一步"""
+        if not self.vm.step_back():
+            self.statusBar().showMessage('没有可以后退的执行记录（需先开启“记录执行历史”）')
+            return
+        self.output_text.append(f"后退到第 {self.vm.history.step} 步")
+        self.update_running_label()
+        self.update_display()
+        
+    def goto_step(self):
+        """跳到指定步"""
+        if not self.vm.recording:
+            self.statusBar().showMessage('请先开启“记录执行历史”')
+            return
+        if not self.vm.program:
+            self.load_from_cards()
+            self.vm.is_running = True
+        target = self.goto_step_spin.value()
+        reached = self.vm.goto_step(target)
+        self.output_text.append(f"跳到第 {reached} 步")
+        if reached != target:
+            self.statusBar().showMessage(f'无法到达第 {target} 步（最早可回到第 {self.vm.history.base} 步，或程序已结束）')
+        self.update_running_label()
+        self.update_display()
+        
     def reset_program(self):
         """重置虚拟机"""
+        if self.animation_worker is not None:
+            return
         self.vm.reset()
         self.running_label.setText('停止')
         self.running_label.setStyleSheet("QLabel { background-color: #ffcccc; border: 1px solid #cc9999; padding: 2px; }")
@@ -1746,14 +5028,15 @@ class MainWindow(QMainWindow):
         # 更新内存显示
         self.update_memory_display()
         
-        # 更新输出
+        # 更新输出（一次性插入）
         if self.vm.output_history:
-            for msg in self.vm.output_history:
-                self.output_text.append(msg)
+            self.output_text.write(self.vm.output_history)
             self.vm.output_history = []
             
-    def update_memory_display(self):
-        """更新内存表格显示"""
+    def update_memory_display(self, memory=None, text_memory=None):
+        """更新内存表格显示（默认显示虚拟机当前内存，动画运行时显示帧中的副本）"""
+        memory = self.vm.memory if memory is None else memory
+        text_memory = self.vm.text_memory if text_memory is None else text_memory
         # 更新数字内存
         for i in range(100):
             row = i // 10
@@ -1765,7 +5048,7 @@ class MainWindow(QMainWindow):
                 num_item = QTableWidgetItem()
                 num_item.setTextAlignment(Qt.AlignCenter)
                 self.num_memory_table.setItem(row, col, num_item)
-            num_item.setText(str(self.vm.memory[i]))
+            num_item.setText(str(memory[i]))
             
             # 文本内存
             text_item = self.text_memory_table.item(row, col)
@@ -1774,25 +5057,25 @@ class MainWindow(QMainWindow):
                 text_item.setTextAlignment(Qt.AlignCenter)
                 self.text_memory_table.setItem(row, col, text_item)
             
-            text = self.vm.text_memory[i]
+            text = text_memory[i]
             display_text = text[:10] + ("..." if len(text) > 10 else "")
             text_item.setText(display_text)
             text_item.setToolTip(text)
             
             # 高亮非空值
-            if self.vm.memory[i] != 0:
+            if memory[i] != 0:
                 num_item.setBackground(QColor(255, 255, 200))
             else:
                 num_item.setBackground(QColor(255, 255, 255))
                 
-            if self.vm.text_memory[i]:
+            if text_memory[i]:
                 text_item.setBackground(QColor(200, 255, 200))
             else:
                 text_item.setBackground(QColor(255, 255, 255))
                 
     def new_file(self):
         """新建文件"""
-        if self.cards or self.code_editor.toPlainText().strip():
+        if self.card_model.rowCount() or self.code_editor.toPlainText().strip():
             reply = QMessageBox.question(self, '确认', '当前内容未保存，确定要新建吗？',
                                        QMessageBox.Yes | QMessageBox.No)
             if reply == QMessageBox.No:
@@ -1801,29 +5084,99 @@ class MainWindow(QMainWindow):
         self.clear_all()
         
     def open_file(self):
-        """打开文件"""
+        """打开文件（在工作线程中分块读取，逐块插入编辑器）"""
+        if self.file_worker is not None:
+            self.statusBar().showMessage('请等待当前文件读写完成')
+            return
         filename, _ = QFileDialog.getOpenFileName(self, '打开文件', '', '文本文件 (*.txt);;所有文件 (*.*)')
         if filename:
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                self.code_editor.setText(content)
-                self.sync_code_to_cards()
-                self.statusBar().showMessage(f'已打开文件: {filename}')
-            except Exception as e:
-                QMessageBox.critical(self, '错误', f'无法打开文件: {str(e)}')
+            # 读入期间编辑器只读、不记录撤销，也不触发同步，读完后一次性同步到卡片；
+            # 读取失败时恢复原来的程序，不同步读了一半的内容
+            self.file_backup = self.code_editor.toPlainText()
+            self.code_editor.blockSignals(True)
+            self.code_editor.clear()
+            self.code_editor.setReadOnly(True)
+            self.code_editor.setUndoRedoEnabled(False)
+            worker = self.start_file_worker(FileWorker(filename), f'正在打开: {filename}')
+            worker.chunk_ready.connect(self.append_file_chunk)
                 
     def save_file(self):
-        """保存文件"""
+        """保存文件（在工作线程中原子写入：先写临时文件再替换）"""
+        if self.file_worker is not None:
+            self.statusBar().showMessage('请等待当前文件读写完成')
+            return
         filename, _ = QFileDialog.getSaveFileName(self, '保存文件', '', '文本文件 (*.txt);;所有文件 (*.*)')
         if filename:
-            try:
-                content = self.code_editor.toPlainText()
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                self.statusBar().showMessage(f'已保存到: {filename}')
-            except Exception as e:
-                QMessageBox.critical(self, '错误', f'无法保存文件: {str(e)}')
+            self.start_file_worker(FileWorker(filename, self.code_editor.toPlainText()),
+                                   f'正在保存: {filename}')
+                
+    def start_file_worker(self, worker, message):
+        """在工作线程中运行文件读写任务，并显示进度条"""
+        thread = QThread(self)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.progress.connect(self.file_progress.setValue)
+        worker.finished.connect(self.on_file_finished)
+        worker.finished.connect(thread.quit)
+        thread.finished.connect(thread.deleteLater)
+        self.file_worker, self.file_thread = worker, thread
+        
+        self.file_progress.setValue(0)
+        self.file_progress.show()
+        self.statusBar().showMessage(message)
+        thread.start()
+        return worker
+        
+    def append_file_chunk(self, chunk):
+        """把读到的一块文本追加到编辑器末尾"""
+        cursor = QTextCursor(self.code_editor.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(chunk)
+        
+    def on_file_finished(self, error):
+        """文件读写结束"""
+        worker = self.file_worker
+        self.file_worker = None
+        self.file_thread = None
+        worker.deleteLater()
+        self.file_progress.hide()
+        opening = worker.text is None
+        if opening:
+            if error:
+                self.code_editor.setPlainText(self.file_backup)
+            self.file_backup = None
+            self.code_editor.setReadOnly(False)
+            self.code_editor.setUndoRedoEnabled(True)
+            self.code_editor.blockSignals(False)
+            if not error:
+                self.sync_code_to_cards()
+        if error:
+            action = '打开' if opening else '保存'
+            self.statusBar().showMessage(f'{action}失败: {worker.filename}')
+            QMessageBox.critical(self, '错误', f'无法{action}文件: {error}')
+        elif opening:
+            self.statusBar().showMessage(f'已打开文件: {worker.filename}')
+        else:
+            self.statusBar().showMessage(f'已保存到: {worker.filename}')
+                
+    def toggle_output_log(self, enabled):
+        """开始或停止把完整输出写入日志文件"""
+        if not enabled:
+            self.output_text.set_log_file(None)
+            self.statusBar().showMessage('已停止写入日志文件')
+            return
+        filename, _ = QFileDialog.getSaveFileName(self, '输出日志文件', '', '日志文件 (*.log);;所有文件 (*.*)')
+        try:
+            if not filename:
+                raise OSError('未选择文件')
+            self.output_text.set_log_file(filename)
+            self.statusBar().showMessage(f'输出将同时写入: {filename}')
+        except OSError as e:
+            self.log_action.blockSignals(True)
+            self.log_action.setChecked(False)
+            self.log_action.blockSignals(False)
+            if filename:
+                QMessageBox.critical(self, '错误', f'无法打开日志文件: {str(e)}')
                 
     def test_hanzi_processor(self):
         """测试汉字处理器"""
@@ -1862,6 +5215,11 @@ class MainWindow(QMainWindow):
             results.append(f"类别: {hp.get_category(hanzi)}")
             results.append(f"押韵: {hp.get_rhyme(hanzi)}")
             results.append(f"后继: {'、'.join(hp.get_successor(hanzi))}")
+            results.append(f"部首: {hp.get_radical(hanzi)}")
+            fits = hp.top_fits(hanzi[0], 10)
+            results.append(f"最佳适配: {'、'.join(f'{c}({score:.2f})' for c, score in fits)}")
+            source = '磁盘缓存' if hp.index_stats['source'] == 'cache' else '重新构建'
+            results.append(f"索引: {source}，耗时 {hp.index_stats['seconds'] * 1000:.1f} 毫秒")
             
             result_text.setText('\n'.join(results))
         
@@ -1899,12 +5257,19 @@ class MainWindow(QMainWindow):
         
     def closeEvent(self, event):
         """关闭窗口事件"""
-        if self.cards or self.code_editor.toPlainText().strip():
+        if self.card_model.rowCount() or self.code_editor.toPlainText().strip():
             reply = QMessageBox.question(self, '确认', '当前内容未保存，确定要退出吗？',
                                        QMessageBox.Yes | QMessageBox.No)
             if reply == QMessageBox.No:
                 event.ignore()
                 return
+        
+        if self.animation_worker is not None:
+            self.animation_worker.stop()
+            self.animation_thread.wait()
+        if self.file_thread is not None:
+            self.file_thread.wait()  # 等保存完成，避免留下写了一半的临时文件
+        self.output_text.set_log_file(None)
                 
         event.accept()
 
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+汉字卡片编程语言 - 性能基准测试
+测量虚拟机逐条指令吞吐、程序加载速度、汉字处理查询以及放大后的示例程序，
+结果连同机器信息保存为JSON；compare 命令比较两次结果并标出性能回归。
+
+用法: python hanzi_bench.py run [-o 结果.json] [--quick] [--filter 关键字] [--repeat N]
+      python hanzi_bench.py compare 旧结果.json 新结果.json [--threshold 0.1]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from hanzi import (ARITHMETIC_EXAMPLE, ARITHMETIC_EXAMPLE_MEMORY, ENGINES, HANZI_EXAMPLE,
+                   HanziProcessor, ProgramCache, VirtualMachine, measure_index_startup, np)
+
+
+# 结果文件格式版本
+RESULT_FORMAT = 1
+
+# 逐条指令测试用的代表性操作数（None表示无操作数）
+INSTRUCTION_SAMPLES = [
+    ('加', '3'), ('加', '槽1'), ('减', '2'), ('乘', '2'), ('除', '3'), ('除', '槽1'),
+    ('存储', '槽2'), ('读取', '槽1'), ('跳转', '0'), ('跳转', '槽3'), ('停机', None),
+    ('拼接', '山'), ('拼接', '文槽0'), ('拆分', '1'), ('修饰', '美'), ('复制', '2'),
+    ('粘贴', '文槽3'), ('取含义', None), ('取拼音', None), ('取对话', None), ('取词性', None),
+    ('取类别', None), ('取前压', None), ('后继', None), ('取结构位置适配', '山'),
+    ('取语义位置适配', '水'), ('存储文本', '文槽4'), ('读取文本', '文槽0'), ('替换', '文槽5'),
+    ('区间求和', '槽0~9'), ('区间填充', '槽10~19'), ('区间复制', '槽0~3'), ('区间反转', '槽0~9'),
+    ('区间排序', '槽0~9'), ('区间拼接', '文槽0~1'), ('区间拼音', '文槽0~1'),
+]
+
+# 程序加载测试的规模（行数）
+LOAD_SIZES = {'1k': 1000, '100k': 100000, '1M': 1000000}
+QUICK_LOAD_SIZES = {'1k': 1000, '100k': 100000}
+
+# 加载测试的程序片段（不含跳转，任意重复都合法）
+LOAD_SNIPPET = ['读取 槽0', '加 3', '存储 槽1', '拼接 你好', '取拼音', '存储文本 文槽2', '# 注释', '']
+
+SHORT_TEXT = '你好'
+LONG_TEXT = '你好中国学习山水' * 250
+REPLACEMENT_TABLE = '好 坏\n山 水\n中国 华夏'
+
+
+def measure(setup, repeat):
+    """运行 repeat 次取最快一次；setup() 返回被测函数，被测函数返回完成的操作数"""
+    best = None
+    ops = 0
+    for _ in range(repeat):
+        func = setup()
+        start = time.perf_counter()
+        ops = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    best = max(best, 1e-9)
+    return {'ops': ops, 'seconds': best, 'ops_per_sec': ops / best}
+
+
+def prepared_vm(program_text):
+    """加载程序并填好测试用内存的虚拟机"""
+    vm = VirtualMachine()
+    vm.load_program(program_text)
+    vm.memory[1] = 5
+    vm.memory[3] = 0
+    vm.text_memory[0] = '你好中国'
+    vm.text_memory[5] = REPLACEMENT_TABLE
+    return vm
+
+
+def bench_instructions(iterations, repeat):
+    """execute_step 逐条指令吞吐（每次执行前复位程序计数器和累加器）"""
+    results = {}
+    for instruction, operand in INSTRUCTION_SAMPLES:
+        line = instruction if operand is None else f"{instruction} {operand}"
+
+        def setup(line=line):
+            vm = prepared_vm(line)
+            step = vm.execute_step
+
+            def run():
+                for _ in range(iterations):
+                    vm.program_counter = 0
+                    vm.is_running = True
+                    vm.accumulator = 7
+                    vm.text_accumulator = SHORT_TEXT
+                    step()
+                return iterations
+            return run
+
+        results[f"execute_step/{line}"] = measure(setup, repeat)
+    return results
+
+
+def bench_load(sizes, repeat):
+    """load_program 解析速度（不用缓存），以及源文本不变时命中程序缓存的速度"""
+    results = {}
+    for name, size in sizes.items():
+        text = '\n'.join(LOAD_SNIPPET[i % len(LOAD_SNIPPET)] for i in range(size))
+
+        def setup(text=text, size=size, cached=False):
+            vm = VirtualMachine()
+            vm.program_cache = ProgramCache() if cached else None
+            if cached:
+                vm.load_program(text)  # 先填好缓存
+
+            def run():
+                vm.load_program(text)
+                return size
+            return run
+
+        # 大程序只测一次，避免整个测试过长
+        results[f"load_program/{name}"] = measure(setup, repeat if size <= 100000 else 1)
+        results[f"load_program_cached/{name}"] = measure(lambda setup=setup: setup(cached=True),
+                                                         repeat if size <= 100000 else 1)
+    return results
+
+
+def processor_queries(processor):
+    """汉字处理查询：名称 -> 以输入文本为参数的函数"""
+    return {
+        'is_hanzi': processor.is_hanzi,
+        'get_pinyin': processor.get_pinyin,
+        'get_meaning': processor.get_meaning,
+        'get_structure': processor.get_structure,
+        'get_pos': processor.get_pos,
+        'get_category': processor.get_category,
+        'get_rhyme': processor.get_rhyme,
+        'get_successor': processor.get_successor,
+        'get_radical': processor.get_radical,
+        'get_final': processor.get_final,
+        'get_dialog': processor.get_dialog,
+        'feature_labels': processor.feature_labels,
+        'concatenate': lambda text: processor.concatenate(text, '山'),
+        'split': lambda text: processor.split(text, 1),
+        'duplicate': lambda text: processor.duplicate(text, 3),
+        'modify': lambda text: processor.modify(text, '好', '坏'),
+        'modify_many': lambda text: processor.modify_many(text, REPLACEMENT_TABLE),
+        'structure_position_fit': lambda text: processor.structure_position_fit(text, '山'),
+        'semantic_position_fit': lambda text: processor.semantic_position_fit(text, '水'),
+        'similarity': lambda text: processor.similarity(text, '山'),
+        'similarity_scores': processor.similarity_scores,
+        'top_fits': processor.top_fits,
+    }
+
+
+def bench_processor(iterations, repeat):
+    """HanziProcessor 各查询在短输入和长输入上的速度"""
+    processor = HanziProcessor()
+    processor.ensure_indexes()
+    results = {}
+    for name, query in processor_queries(processor).items():
+        for size, text in (('short', SHORT_TEXT), ('long', LONG_TEXT)):
+            def setup(query=query, text=text):
+                def run():
+                    for _ in range(iterations):
+                        query(text)
+                    return iterations
+                return run
+
+            results[f"processor/{name}/{size}"] = measure(setup, repeat)
+    return results
+
+
+def scaled_hanzi_example(scale):
+    """把汉字示例的主体重复 scale 次（只保留最后一个停机）"""
+    body = [line for line in HANZI_EXAMPLE.split('\n') if not line.startswith('停机')]
+    return '\n'.join(body * scale + ['停机'])
+
+
+def bench_examples(scale, repeat):
+    """放大后的示例程序在各执行引擎上的端到端运行时间（包括加载，不用程序缓存）"""
+    results = {}
+    # 算术示例是无条件循环，按步数放大
+    arithmetic_steps = 1000 * scale
+    hanzi_program = scaled_hanzi_example(scale)
+    for engine in ENGINES:
+        def arithmetic_setup(engine=engine):
+            vm = VirtualMachine()
+            vm.program_cache = None
+
+            def run():
+                vm.load_program(ARITHMETIC_EXAMPLE)
+                for slot, value in ARITHMETIC_EXAMPLE_MEMORY.items():
+                    vm.memory[slot] = value
+                vm.run_program(engine=engine, max_steps=arithmetic_steps)
+                return vm.steps_executed
+            return run
+
+        def hanzi_setup(engine=engine):
+            vm = VirtualMachine()
+            vm.program_cache = None
+
+            def run():
+                vm.load_program(hanzi_program)
+                vm.run_program(engine=engine, max_steps=len(vm.program) + 1)
+                return vm.steps_executed
+            return run
+
+        results[f"example/arithmetic/{engine}"] = measure(arithmetic_setup, repeat)
+        results[f"example/hanzi/{engine}"] = measure(hanzi_setup, repeat)
+    return results
+
+
+def bench_index_startup():
+    """派生索引冷启动/热启动耗时（每项只测一次）"""
+    timings = measure_index_startup()
+    return {f"index_startup/{name}": {'ops': 1, 'seconds': timings[name], 'ops_per_sec': 1 / max(timings[name], 1e-9)}
+            for name in ('cold', 'warm')}
+
+
+def machine_metadata():
+    """记录结果时的机器和环境信息"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        revision = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__ if np is not None else None,
+        'revision': revision or None,
+    }
+
+
+def run_benchmarks(args):
+    """运行全部（或按关键字过滤的）基准测试"""
+    iterations = 2000 if args.quick else 20000
+    scale = 10 if args.quick else 100
+    groups = [
+        ('execute_step', lambda: bench_instructions(iterations, args.repeat)),
+        ('load_program', lambda: bench_load(QUICK_LOAD_SIZES if args.quick else LOAD_SIZES, args.repeat)),
+        ('processor', lambda: bench_processor(iterations // 10, args.repeat)),
+        ('example', lambda: bench_examples(scale, args.repeat)),
+        ('index_startup', bench_index_startup),
+    ]
+    results = {}
+    for group, bench in groups:
+        if args.filter and args.filter not in group:
+            continue
+        print(f"运行 {group} ...", file=sys.stderr)
+        results.update(bench())
+
+    for name, result in results.items():
+        print(f"{name:<45} {result['ops_per_sec']:>14,.0f} 次/秒  {result['seconds'] * 1000:>10.2f} ms")
+
+    if args.output:
+        report = {'format': RESULT_FORMAT, 'meta': machine_metadata(),
+                  'options': {'quick': args.quick, 'repeat': args.repeat, 'filter': args.filter},
+                  'results': results}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}", file=sys.stderr)
+    return 0
+
+
+def load_results(filename):
+    """读取结果文件"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    if report.get('format') != RESULT_FORMAT:
+        raise ValueError(f"{filename}: 不支持的结果格式 {report.get('format')!r}")
+    return report
+
+
+def compare_results(old, new, threshold):
+    """比较两次结果，返回[(名称, 旧次/秒, 新次/秒, 变化比例, 标记), ...]"""
+    rows = []
+    for name in old['results']:
+        if name not in new['results']:
+            continue
+        before = old['results'][name]['ops_per_sec']
+        after = new['results'][name]['ops_per_sec']
+        change = after / before - 1
+        if change < -threshold:
+            mark = '回归'
+        elif change > threshold:
+            mark = '提升'
+        else:
+            mark = ''
+        rows.append((name, before, after, change, mark))
+    return rows
+
+
+def run_compare(args):
+    """compare 命令：有回归时返回1"""
+    try:
+        old, new = load_results(args.old), load_results(args.new)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+
+    for key in ('machine', 'processor', 'python', 'implementation'):
+        if old['meta'].get(key) != new['meta'].get(key):
+            print(f"警告: 两次结果的 {key} 不同（{old['meta'].get(key)} / {new['meta'].get(key)}），"
+                  f"比较可能不可靠", file=sys.stderr)
+
+    rows = compare_results(old, new, args.threshold)
+    for name, before, after, change, mark in rows:
+        print(f"{name:<45} {before:>14,.0f} -> {after:>14,.0f}  {change:>+8.1%}  {mark}")
+    regressions = [row for row in rows if row[4] == '回归']
+    print(f"共比较 {len(rows)} 项，{len(regressions)} 项回归（阈值 {args.threshold:.0%}）")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='汉字卡片编程语言性能基准测试')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='运行基准测试')
+    run_parser.add_argument('-o', '--output', help='结果保存为JSON文件')
+    run_parser.add_argument('--quick', action='store_true', help='缩小规模，快速运行')
+    run_parser.add_argument('--filter', default='', help='只运行名称包含该关键字的测试组')
+    run_parser.add_argument('--repeat', type=int, default=3, help='每项重复次数（取最快一次）')
+
+    compare_parser = commands.add_parser('compare', help='比较两次结果，标出回归')
+    compare_parser.add_argument('old', help='基准结果文件')
+    compare_parser.add_argument('new', help='新结果文件')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='判定回归的相对变化阈值')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        return run_benchmarks(args)
+    return run_compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+汉字卡片编程语言 - 指令覆盖率
+用多组初始内存批量运行同一个程序，合并每次运行的覆盖位图，
+输出文本、JSON 或 lcov 格式的覆盖率报告，找出测试输入从未执行到的分支。
+
+用法: python hanzi_coverage.py 程序.txt 输入.json [--format text|json|lcov] [-o 报告文件]
+                              [--engine fast] [--max-steps 1000] [--fail-under 百分比]
+                              [--cache-dir 目录]
+
+输入文件是JSON列表，每项为一次运行的初始内存:
+    [{"memory": {"0": 10, "1": 0}, "text_memory": {"0": "你好"}}, ...]
+"""
+
+import argparse
+import json
+import sys
+
+from hanzi import ENGINES, ProgramCache, VirtualMachine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量运行程序并统计指令覆盖率')
+    parser.add_argument('program', help='程序文件（- 表示从标准输入读取）')
+    parser.add_argument('inputs', help='初始内存列表（JSON文件）')
+    parser.add_argument('--format', choices=('text', 'json', 'lcov'), default='text', help='报告格式')
+    parser.add_argument('-o', '--output', help='报告保存到文件（默认输出到屏幕）')
+    parser.add_argument('--engine', choices=ENGINES, default='fast', help='执行引擎')
+    parser.add_argument('--max-steps', type=int, default=1000, help='每次运行的最大执行步数')
+    parser.add_argument('--fail-under', type=float, default=None, help='覆盖率低于该百分比时返回1')
+    parser.add_argument('--cache-dir', default=None, help='程序缓存目录（同一程序再次运行时跳过解析和校验）')
+    args = parser.parse_args(argv)
+
+    vm = VirtualMachine()
+    try:
+        with open(args.inputs, 'r', encoding='utf-8') as f:
+            inputs = json.load(f)
+        if args.program == '-':
+            vm.load_lines(sys.stdin)
+        elif args.cache_dir:
+            # 缓存键是整个源文本的哈希，需要先读入全文
+            vm.program_cache = ProgramCache(cache_dir=args.cache_dir)
+            with open(args.program, 'r', encoding='utf-8') as f:
+                vm.load_program(f.read())
+        else:
+            with open(args.program, 'r', encoding='utf-8') as f:
+                vm.load_lines(f)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+    if not isinstance(inputs, list):
+        print("错误: 输入文件应为JSON列表", file=sys.stderr)
+        return 2
+
+    for line_num, message in vm.load_errors:
+        print(f"第{line_num}行: {message}", file=sys.stderr)
+
+    try:
+        report = vm.run_batch(inputs, args.engine, args.max_steps, source=args.program)
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+    text = {'text': report.to_text, 'json': report.to_json, 'lcov': report.to_lcov}[args.format]()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"覆盖率 {report.percent:.1f}%，报告已保存到 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.fail_under is not None and report.percent < args.fail_under:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
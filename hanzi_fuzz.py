@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+汉字卡片编程语言 - 执行引擎差分模糊测试
+随机生成卡片程序，分别用标准解释器（execute_step）和其他执行引擎运行，
+比较最终状态、执行步数和覆盖位图；发现不一致时把用例缩减为最小复现程序。
+开始前先检查回归用例，以及损坏的程序缓存条目是否按未命中处理。
+
+用法: python hanzi_fuzz.py [--cases N] [--seed S] [--max-lines L] [--max-steps K]
+                          [--engines fast,compiled] [--modes plain,recording,profiling,optimized]
+                          [--timeout 秒]
+"""
+
+import argparse
+import marshal
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+from hanzi import (ENGINES, INSTRUCTION_OPERANDS, OPERAND_KIND_CODES, ProgramCache,
+                   VirtualMachine)
+
+
+# 需要逐条输出也与标准解释器完全一致的引擎（其余引擎只比较最后一条输出）
+FULL_TRACE_ENGINES = ('reference', 'fast')
+
+# 引擎的运行方式：plain 普通运行，recording 记录执行历史（运行后再全部撤销，检查能否回到初始状态），
+# profiling 性能分析（逐条计时）；后两种走各自独立的执行循环；
+# optimized 加载时做窥孔优化（指令位置和步数会变，只比较 OPTIMIZED_FIELDS）
+MODES = ('plain', 'recording', 'profiling', 'optimized')
+
+# 优化后程序与原程序应一致的状态字段（只在标准解释器于步数上限内停机时比较）
+OPTIMIZED_FIELDS = ('memory', 'text_memory', 'accumulator', 'text_accumulator', 'is_running')
+
+# 随机程序用到的文本素材（包含替换表，供“替换 文槽X”使用）
+TEXT_SAMPLES = ['你好', '山', '水吗', '中国', 'ab', '?x', '学习', '好山好水']
+HANZI_SAMPLES = ['你好', '山', '水吗', '中国', '学习', '好山好水']
+REPLACEMENT_TABLES = ['好 坏\n山 水', '你 您\n中国 华夏', 'a b\nab']
+
+SLOTS = 100
+
+# 曾经发现引擎不一致的用例：(程序, 初始数字内存, 初始文本内存)，每次运行先检查
+REGRESSION_CASES = [
+    # 反复平方：其他引擎格式化执行轨迹时超过整数转字符串的位数上限而报错，编译引擎要显式检查
+    (['读取 槽0', '乘 槽0', '存储 槽0', '跳转 0'], {0: 3}, {}),
+]
+
+
+def random_operand(rng, instruction, size, allow_growth):
+    """按指令要求生成随机操作数（偶尔故意生成不匹配的操作数）"""
+    kinds = INSTRUCTION_OPERANDS[instruction]
+    if kinds is None:
+        return None
+    if rng.random() < 0.03:
+        kinds = ('slot', 'number', 'text_slot', 'hanzi', 'text', 'slot_range', 'text_slot_range')
+    kind = rng.choice(kinds)
+
+    if not allow_growth:
+        # 有跳转的程序可能循环到步数上限，要避免文本按指数增长（数值不限制：超过整数转字符串
+        # 的位数上限时各引擎都应报执行错误）：文本只从程序从不写入的文槽0-7拼接，
+        # 写入（粘贴、存储文本、拆分、区间拼音）都落在文槽8以上
+        if kind == 'text_slot_range':
+            if instruction == '区间拼接':
+                start = rng.randint(0, 7)
+                return f"文槽{start}~{rng.randint(start, 7)}"
+            if instruction == '区间拼音':
+                start = rng.choice([rng.randint(8, 15), rng.randint(95, SLOTS - 1)])
+                return f"文槽{start}~{rng.randint(start, min(start + 4, SLOTS - 1))}"
+        if kind == 'text_slot':
+            if instruction == '拼接':
+                return f"文槽{rng.randint(0, 7)}"
+            if instruction in ('粘贴', '存储文本'):
+                return f"文槽{rng.choice([rng.randint(8, 15), rng.randint(95, SLOTS - 1)])}"
+        if kind == 'number' and instruction == '拆分':
+            return str(rng.choice([8, 9, 97, 98, 99, 120]))
+
+    if kind == 'slot':
+        # 偏向低编号槽，保证读写相互影响
+        return f"槽{rng.choice([rng.randint(0, 7), rng.randint(0, SLOTS - 1)])}"
+    if kind == 'text_slot':
+        return f"文槽{rng.choice([rng.randint(0, 7), rng.randint(95, SLOTS - 1)])}"
+    if kind in ('slot_range', 'text_slot_range'):
+        prefix = '槽' if kind == 'slot_range' else '文槽'
+        start = rng.choice([rng.randint(0, 7), rng.randint(0, SLOTS - 1)])
+        return f"{prefix}{start}~{rng.randint(start, min(start + 8, SLOTS - 1))}"
+    if kind == 'hanzi':
+        return rng.choice(HANZI_SAMPLES)
+    if kind == 'text':
+        return rng.choice(['ab', '?x', 'x1'])
+
+    if instruction == '跳转':
+        return str(rng.randint(0, max(size - 1, 0)))
+    if instruction == '拆分':
+        return str(rng.choice([0, 1, 2, 3, 97, 98, 99, 120]))
+    if instruction == '复制':
+        # 循环里反复复制同样会让文本指数增长，只在没有跳转的程序里允许复制两次
+        return str(rng.randint(0, 2 if allow_growth else 1))
+    if instruction in ('除', '乘'):
+        return str(rng.choice([-3, -2, -1, 0, 1, 2, 3, 7]))
+    return str(rng.randint(-5, 12))
+
+
+def generate_program(rng, max_lines):
+    """生成一个随机程序，返回指令行列表"""
+    size = rng.randint(1, max_lines)
+    instructions = list(INSTRUCTION_OPERANDS)
+    # 算术和控制指令出现得更频繁，更容易形成循环
+    weights = [6 if name in ('加', '减', '乘', '除', '存储', '读取', '跳转') else 1
+               for name in instructions]
+    chosen = rng.choices(instructions, weights, k=size)
+    allow_growth = '跳转' not in chosen
+    lines = []
+    for instruction in chosen:
+        operand = random_operand(rng, instruction, size, allow_growth)
+        lines.append(instruction if operand is None else f"{instruction} {operand}")
+    return lines
+
+
+def generate_memory(rng):
+    """生成随机初始内存，返回({槽: 值}, {文槽: 文本})"""
+    memory = {slot: rng.randint(-4, 12) for slot in rng.sample(range(8), rng.randint(0, 6))}
+    text_memory = {slot: rng.choice(TEXT_SAMPLES + REPLACEMENT_TABLES)
+                   for slot in rng.sample(range(8), rng.randint(0, 4))}
+    return memory, text_memory
+
+
+def run_case(vm, lines, memory, text_memory, engine, max_steps, mode='plain'):
+    """在指定引擎上以指定方式运行一个用例，返回最终状态"""
+    vm.reset()
+    vm.recording = mode == 'recording'
+    vm.profiling = mode == 'profiling'
+    vm.load_program('\n'.join(lines), optimize=mode == 'optimized')
+    for slot, value in memory.items():
+        vm.memory[slot] = value
+    for slot, text in text_memory.items():
+        vm.text_memory[slot] = text
+    initial = (list(vm.memory), list(vm.text_memory), vm.accumulator, vm.text_accumulator, vm.program_counter)
+    vm.run_program(engine=engine, max_steps=max_steps)
+    state = {
+        'memory': list(vm.memory),
+        'text_memory': list(vm.text_memory),
+        'accumulator': vm.accumulator,
+        'text_accumulator': vm.text_accumulator,
+        'program_counter': vm.program_counter,
+        'is_running': vm.is_running,
+        'steps': vm.steps_executed,
+        'coverage': bytes(vm.coverage),
+        'output': list(vm.output_history),
+    }
+    if vm.recording:
+        while vm.step_back():
+            pass
+        state['rewound'] = initial == (list(vm.memory), list(vm.text_memory), vm.accumulator,
+                                       vm.text_accumulator, vm.program_counter)
+    return state
+
+
+class CaseTimeout(BaseException):
+    """单个引擎运行用例超时（继承 BaseException，不会被引擎内部的 except Exception 吞掉）"""
+
+
+def _raise_timeout(signum, frame):
+    raise CaseTimeout()
+
+
+def run_limited(vm, lines, memory, text_memory, engine, max_steps, timeout, mode='plain'):
+    """带时间上限运行用例，超时返回 None（系统不支持 setitimer 或 timeout 为0时不限时）"""
+    if not timeout or not hasattr(signal, 'setitimer'):
+        return run_case(vm, lines, memory, text_memory, engine, max_steps, mode)
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return run_case(vm, lines, memory, text_memory, engine, max_steps, mode)
+    except CaseTimeout:
+        return None
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def compare_states(expected, actual):
+    """返回两个状态中不一致的字段名列表"""
+    return [key for key in expected if expected[key] != actual[key]]
+
+
+class Fuzzer:
+    """差分模糊测试器"""
+
+    def __init__(self, engines, max_steps=200, timeout=5.0, modes=('plain',)):
+        self.engines = engines
+        self.max_steps = max_steps
+        self.timeout = timeout
+        # 参与比较的(引擎, 运行方式)，报告中记为“引擎”或“引擎/运行方式”；
+        # 标准解释器的记录和性能分析循环也要和它的普通运行比较
+        self.variants = ([('reference', mode) for mode in modes if mode != 'plain']
+                         + [(engine, mode) for engine in engines for mode in modes])
+        self.vms = {label: VirtualMachine() for label in ['reference'] + [self.label(*v) for v in self.variants]}
+
+    @staticmethod
+    def label(engine, mode):
+        return engine if mode == 'plain' else f"{engine}/{mode}"
+
+    def check(self, lines, memory, text_memory):
+        """运行一个用例，返回[(引擎/运行方式, 不一致字段, 标准状态, 引擎状态), ...]"""
+        expected = run_limited(self.vms['reference'], lines, memory, text_memory, 'reference',
+                               self.max_steps, self.timeout)
+        # 超时按失败报告（不跳过用例）：标准解释器超时时无法比较，直接报告
+        if expected is None:
+            return [('reference', ['timeout'], {'timeout': True}, {'timeout': True})]
+        failures = []
+        for engine, mode in self.variants:
+            label = self.label(engine, mode)
+            actual = run_limited(self.vms[label], lines, memory, text_memory, engine, self.max_steps,
+                                 self.timeout, mode)
+            if actual is None:
+                failures.append((label, ['timeout'], {'timeout': False}, {'timeout': True}))
+                continue
+            if mode == 'optimized':
+                # 优化会减少步数，原程序未停机时两者停在不同位置，无法比较
+                if expected['is_running']:
+                    continue
+                reference = {field: expected[field] for field in OPTIMIZED_FIELDS}
+                fields = compare_states(reference, actual)
+                if fields:
+                    failures.append((label, fields, reference, actual))
+                continue
+            reference = dict(expected)
+            if 'rewound' in actual:
+                reference['rewound'] = True
+            if engine not in FULL_TRACE_ENGINES:
+                reference['output'] = expected['output'][-1:]
+                actual['output'] = actual['output'][-1:]
+            fields = compare_states(reference, actual)
+            if fields:
+                failures.append((label, fields, reference, actual))
+        return failures
+
+    def fails(self, lines, memory, text_memory, engine):
+        """用例在指定引擎上是否仍然不一致"""
+        return any(failure[0] == engine for failure in self.check(lines, memory, text_memory))
+
+    def shrink(self, lines, memory, text_memory, engine):
+        """缩减失败用例：删除指令、简化操作数、清除初始内存"""
+        lines, memory, text_memory = list(lines), dict(memory), dict(text_memory)
+        changed = True
+        while changed:
+            changed = False
+
+            chunk = max(len(lines) // 2, 1)
+            while chunk >= 1:
+                index = 0
+                while index < len(lines):
+                    candidate = lines[:index] + lines[index + chunk:]
+                    if candidate and self.fails(candidate, memory, text_memory, engine):
+                        lines = candidate
+                        changed = True
+                    else:
+                        index += chunk
+                chunk //= 2
+
+            for index, line in enumerate(lines):
+                parts = line.split()
+                if len(parts) < 2 or not parts[1].lstrip('-').isdigit() or parts[1] in ('0', '1'):
+                    continue
+                for simpler in ('0', '1', str(int(parts[1]) // 2)):
+                    if simpler == parts[1]:
+                        continue
+                    candidate = lines[:index] + [f"{parts[0]} {simpler}"] + lines[index + 1:]
+                    if self.fails(candidate, memory, text_memory, engine):
+                        lines = candidate
+                        changed = True
+                        break
+
+            for table in (memory, text_memory):
+                for slot in list(table):
+                    value = table.pop(slot)
+                    if self.fails(lines, memory, text_memory, engine):
+                        changed = True
+                    else:
+                        table[slot] = value
+        return lines, memory, text_memory
+
+
+def format_failure(engine, lines, memory, text_memory, fields, expected, actual):
+    """格式化最小复现用例"""
+    report = [f"引擎 {engine} 与标准解释器不一致: {', '.join(fields)}", "程序:"]
+    report += [f"    {index}: {line}" for index, line in enumerate(lines)]
+    if memory:
+        report.append(f"初始数字内存: {memory}")
+    if text_memory:
+        report.append(f"初始文本内存: {text_memory}")
+    for field in fields:
+        if field in ('memory', 'text_memory'):
+            # 内存只列出不一致的槽
+            slots = [i for i, (a, b) in enumerate(zip(expected[field], actual[field])) if a != b]
+            report.append(f"  {field}: 标准 = {({i: expected[field][i] for i in slots})!r}")
+            report.append(f"  {field}: {engine} = {({i: actual[field][i] for i in slots})!r}")
+        else:
+            report.append(f"  {field}: 标准 = {expected[field]!r}")
+            report.append(f"  {field}: {engine} = {actual[field]!r}")
+    return '\n'.join(report)
+
+
+# 程序缓存损坏方式：名称 -> 改写磁盘条目字节串的函数（每种都必须按未命中处理，重新解析后照常运行）
+CACHE_PROGRAM = ['读取 槽0', '加 5', '拼接 你好', '存储 槽1', '停机']
+
+
+def _change_kind(data):
+    """把第一条指令的操作数类型改为与指令不匹配的“汉字”（列本身仍然一致）"""
+    entry = marshal.loads(data)
+    entry['kinds'] = bytes([OPERAND_KIND_CODES['hanzi']]) + entry['kinds'][1:]
+    return marshal.dumps(entry)
+
+
+def _drop_field(field):
+    def corrupt(data):
+        entry = marshal.loads(data)
+        del entry[field]
+        return marshal.dumps(entry)
+    return corrupt
+
+
+CACHE_CORRUPTIONS = {
+    'truncated': lambda data: data[:len(data) // 2],
+    'missing errors': _drop_field('errors'),
+    'missing opcodes': _drop_field('opcodes'),
+    'mismatched kind': _change_kind,
+    'kind out of range': lambda data: marshal.dumps(dict(marshal.loads(data), kinds=b'\xff' * len(CACHE_PROGRAM))),
+}
+
+
+def cache_state(vm):
+    """缓存检查比较的状态：程序、校验结果和运行结果"""
+    vm.memory[0] = 7
+    vm.run_program(engine='fast')
+    return (list(vm.program), vm.load_errors, vm.validated, vm.memory[1], vm.text_accumulator,
+            vm.is_running, vm.output_history)
+
+
+def check_program_cache():
+    """用损坏的磁盘缓存条目加载程序，返回失败说明列表（空表示全部按未命中处理）"""
+    text = '\n'.join(CACHE_PROGRAM)
+    fresh = VirtualMachine()
+    fresh.program_cache = None
+    fresh.load_program(text)
+    expected = cache_state(fresh)
+
+    failures = []
+    for name, corrupt in CACHE_CORRUPTIONS.items():
+        cache_dir = tempfile.mkdtemp(prefix='hanzi_fuzz_cache_')
+        try:
+            writer = VirtualMachine()
+            writer.program_cache = ProgramCache(cache_dir=cache_dir)
+            writer.load_program(text)
+            path = writer.program_cache._path(writer.program_cache.key(text, False, writer.max_memory_slots))
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(path, 'wb') as f:
+                f.write(corrupt(data))
+
+            vm = VirtualMachine()
+            vm.program_cache = ProgramCache(cache_dir=cache_dir)  # 新的内存缓存，只能从磁盘读取
+            try:
+                vm.load_program(text)
+                actual = cache_state(vm)
+            except Exception as e:
+                failures.append(f"{name}: 加载时抛出 {type(e).__name__}: {e}")
+                continue
+            if actual != expected:
+                failures.append(f"{name}: 状态与重新解析的结果不一致")
+                continue
+            # 损坏的条目应已被重新生成的条目替换
+            with open(path, 'rb') as f:
+                if f.read() != data:
+                    failures.append(f"{name}: 磁盘条目没有重新生成")
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='执行引擎差分模糊测试')
+    parser.add_argument('--cases', type=int, default=2000, help='随机用例数量')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子（默认随机）')
+    parser.add_argument('--max-lines', type=int, default=16, help='随机程序的最大行数')
+    parser.add_argument('--max-steps', type=int, default=200, help='每个用例的最大执行步数')
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help=f"引擎的运行方式，逗号分隔（{'/'.join(MODES)}）")
+    parser.add_argument('--timeout', type=float, default=5.0, help='每个引擎运行一个用例的时间上限（秒，0 表示不限）')
+    parser.add_argument('--engines', default=','.join(e for e in ENGINES if e != 'reference'),
+                        help='参与比较的引擎，逗号分隔')
+    args = parser.parse_args(argv)
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    rng = random.Random(seed)
+    engines = tuple(e for e in args.engines.split(',') if e)
+    unknown = [e for e in engines if e not in ENGINES or e == 'reference']
+    if unknown:
+        parser.error(f"未知引擎: {', '.join(unknown)}")
+    modes = tuple(m for m in args.modes.split(',') if m)
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"未知运行方式: {', '.join(unknown)}")
+
+    failures = check_program_cache()
+    if failures:
+        print("程序缓存检查失败")
+        print('\n'.join(failures))
+        return 1
+
+    fuzzer = Fuzzer(engines, args.max_steps, args.timeout, modes)
+    for lines, memory, text_memory in REGRESSION_CASES:
+        for engine, fields, expected, actual in fuzzer.check(lines, memory, text_memory):
+            print("回归用例失败")
+            print(format_failure(engine, lines, memory, text_memory, fields, expected, actual))
+            return 1
+
+    start = time.perf_counter()
+    for case in range(args.cases):
+        lines = generate_program(rng, args.max_lines)
+        memory, text_memory = generate_memory(rng)
+        failures = fuzzer.check(lines, memory, text_memory)
+        if failures:
+            engine = failures[0][0]
+            lines, memory, text_memory = fuzzer.shrink(lines, memory, text_memory, engine)
+            engine, fields, expected, actual = [f for f in fuzzer.check(lines, memory, text_memory)
+                                                if f[0] == engine][0]
+            print(f"种子 {seed}，第 {case} 个用例失败")
+            print(format_failure(engine, lines, memory, text_memory, fields, expected, actual))
+            return 1
+
+    elapsed = time.perf_counter() - start
+    print(f"种子 {seed}: {args.cases} 个用例全部一致 "
+          f"（{', '.join(fuzzer.label(*v) for v in fuzzer.variants)}），{args.cases / elapsed:.0f} 个/秒")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())